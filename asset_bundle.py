@@ -0,0 +1,144 @@
+# Prebuilt asset bundle for instant startup
+#
+# An offline build step packs the roster's species data and its sprites,
+# already decoded and scaled to every size the screens use, into a single
+# file. At launch the game memory-maps the bundle and wraps the raw RGBA
+# pixels in surfaces directly, so it makes no HTTP requests and does no PNG
+# decoding or scaling. Build (or rebuild) it with:
+#
+#     python asset_bundle.py [output path] [api base url]
+#
+# File layout: MAGIC, the length of the JSON index as 4 little-endian bytes,
+# the index, then the pixel data. The index maps each species name to its
+# data and each sprite URL and size to [offset, width, height] of its pixels,
+# with offsets counted from the start of the pixel data.
+
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+import pygame
+
+import asset_cache
+from battle_engine import ROSTER
+
+MAGIC = b'PKBUNDL1'
+
+# sprite widths drawn by the select, stats and battle screens
+BUNDLE_SIZES = (100, 150, 200, 330)
+SIDES = ('front_default', 'back_default')
+
+# where the game looks for the bundle
+bundle_path = os.environ.get(
+    'POKEMON_BATTLE_BUNDLE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pokemon_battle.bundle')
+)
+
+# base url of the API the bundle is built from
+base_url = os.environ.get('POKEMON_BATTLE_API', 'https://pokeapi.co/api/v2')
+
+
+# Keep only the parts of a /pokemon/{name} response the game uses
+def trim_species(data):
+    return {'sprites': {side: data['sprites'][side] for side in SIDES}}
+
+
+# Scale a decoded sprite to a target width, exactly as the game does
+def scale_sprite(image, size):
+    scale = size / image.get_width()
+    new_width = image.get_width() * scale
+    new_height = image.get_height() * scale
+    return pygame.transform.scale(image, (int(new_width), int(new_height)))
+
+
+# A bundle file opened read-only and memory-mapped
+class Bundle:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an asset bundle')
+        start = len(MAGIC) + 4
+        (index_length,) = struct.unpack('<I', self.buffer[len(MAGIC):start])
+        index = json.loads(self.buffer[start:start + index_length])
+        self.data_start = start + index_length
+        self.species_data = index['species']
+        self.sprites = index['sprites']
+
+    # Trimmed species data, or None if the species is not bundled
+    def species(self, name):
+        return self.species_data.get(name)
+
+    # The bundled pixels copied once into a display-format surface, or None
+    # if this sprite size is not bundled. A surface left over the read-only
+    # mapping would crash the interpreter when drawn on, so one is never
+    # handed out. Needs the display mode set.
+    def sprite(self, url, size):
+        entry = self.sprites.get(url, {}).get(str(size))
+        if entry is None:
+            return None
+        offset, width, height = entry
+        offset += self.data_start
+        pixels = memoryview(self.buffer)[offset:offset + width * height * 4]
+        return pygame.image.frombuffer(pixels, (width, height), 'RGBA').convert_alpha()
+
+
+# The bundle at path, or None when there is no usable one
+def open_bundle(path=None):
+    try:
+        return Bundle(path or bundle_path)
+    except (OSError, ValueError):
+        return None
+
+
+# Fetch the roster and write its bundle to path
+def build(path=None, base_url=base_url):
+    path = path or bundle_path
+    species = {}
+    sprites = {}
+    chunks = []
+    offset = 0
+
+    for spec in ROSTER:
+        name = spec[0]
+        data = trim_species(asset_cache.fetch_json(f'{base_url}/pokemon/{name.lower()}'))
+        species[name] = data
+
+        for side in SIDES:
+            url = data['sprites'][side]
+            image = pygame.image.load(io.BytesIO(asset_cache.fetch_bytes(url)))
+            sprites[url] = {}
+            for size in BUNDLE_SIZES:
+                scaled = scale_sprite(image, size)
+                pixels = pygame.image.tobytes(scaled, 'RGBA')
+                sprites[url][str(size)] = [offset, scaled.get_width(), scaled.get_height()]
+                chunks.append(pixels)
+                offset += len(pixels)
+
+    index = json.dumps({'species': species, 'sprites': sprites}).encode()
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(index)))
+        f.write(index)
+        for pixels in chunks:
+            f.write(pixels)
+    os.replace(tmp_path, path)
+    asset_cache.flush()
+    return path
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    path = build(
+        sys.argv[1] if len(sys.argv) > 1 else None,
+        sys.argv[2] if len(sys.argv) > 2 else base_url,
+    )
+    print(f'Wrote {path} ({os.path.getsize(path) / 1024:.0f} KB) in {time.perf_counter() - start:.1f} s')
@@ -0,0 +1,215 @@
+# On-disk cache for PokeAPI JSON and sprite bytes
+#
+# Blobs are stored by the sha256 of their content, and an index maps every
+# URL to its blob plus the metadata needed to revalidate it (ETag,
+# Last-Modified, fetch time). The directory is capped in size and the least
+# recently used URLs are evicted first. A fresh entry is served without
+# touching the network, so a warm start makes zero requests.
+
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+import instrument
+
+# where the cache lives and how big it may grow
+cache_dir = os.environ.get(
+    'POKEMON_BATTLE_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'pokemon_battle')
+)
+cache_max_bytes = int(os.environ.get('POKEMON_BATTLE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+# how long (in seconds) an entry is served before asking the server again
+cache_ttl = int(os.environ.get('POKEMON_BATTLE_CACHE_TTL', 7 * 24 * 60 * 60))
+
+# offline mode never touches the network and only serves cached entries
+offline = os.environ.get('POKEMON_BATTLE_OFFLINE', '') not in ('', '0')
+
+# (connect, read) timeout in seconds for every request
+request_timeout = (3.05, 10)
+
+_index = None
+_index_dirty = False
+_lock = threading.RLock()
+
+# one keep-alive session shared by all loader threads, so the roster reuses
+# pooled connections instead of opening a new one per request
+_session = requests.Session()
+_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def _index_path():
+    return os.path.join(cache_dir, 'index.json')
+
+
+def _blob_path(digest):
+    return os.path.join(cache_dir, 'objects', digest[:2], digest[2:])
+
+
+def _load_index():
+    global _index
+    if _index is None:
+        try:
+            with open(_index_path()) as f:
+                _index = json.load(f)
+        except (OSError, ValueError):
+            _index = {}
+    return _index
+
+
+# Write a file whole or not at all. Each writer gets its own temporary file,
+# so threads and game processes sharing the cache never move each other's.
+def _write_file(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _save_index():
+    global _index_dirty
+    _index_dirty = False
+    _write_file(_index_path(), json.dumps(_index).encode())
+
+
+def _mark_dirty():
+    global _index_dirty
+    _index_dirty = True
+
+
+# Write pending access times back to disk (also runs at interpreter exit)
+@atexit.register
+def flush():
+    with _lock:
+        if _index_dirty:
+            _save_index()
+
+
+def _read_blob(digest):
+    try:
+        with open(_blob_path(digest), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_blob(content):
+    digest = hashlib.sha256(content).hexdigest()
+    path = _blob_path(digest)
+    if not os.path.exists(path):
+        _write_file(path, content)
+    return digest
+
+
+# Drop least recently used URLs until the unique blobs fit in the size cap
+def _evict():
+    index = _load_index()
+    sizes = {entry['digest']: entry['size'] for entry in index.values()}
+    total = sum(sizes.values())
+    if total <= cache_max_bytes:
+        return
+
+    for url in sorted(index, key=lambda u: index[u]['accessed']):
+        if total <= cache_max_bytes:
+            break
+        digest = index.pop(url)['digest']
+
+        # the blob may still be shared with another URL
+        if any(entry['digest'] == digest for entry in index.values()):
+            continue
+        total -= sizes[digest]
+        try:
+            os.remove(_blob_path(digest))
+        except OSError:
+            pass
+
+
+def _store(url, response):
+    content = response.content
+    digest = _write_blob(content)
+    now = time.time()
+    with _lock:
+        _load_index()[url] = {
+            'digest': digest,
+            'size': len(content),
+            'fetched': now,
+            'accessed': now,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        _evict()
+        _save_index()
+    return content
+
+
+# Return the bytes behind a URL, from the cache when possible
+def fetch_bytes(url):
+    with _lock:
+        entry = _load_index().get(url)
+        content = _read_blob(entry['digest']) if entry else None
+        if content is None:
+            entry = None
+
+        if entry:
+            # access times only steer eviction, so they are written lazily
+            entry['accessed'] = time.time()
+            _mark_dirty()
+            fresh = time.time() - entry['fetched'] < cache_ttl
+            if fresh or offline:
+                instrument.hit('asset cache')
+                return content
+
+    instrument.miss('asset cache')
+
+    if offline:
+        raise CacheMiss(f'{url} is not cached and offline mode is on')
+
+    # revalidate a stale entry instead of downloading it again
+    headers = {}
+    if entry:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        with instrument.timer('http get'):
+            response = _session.get(url, headers=headers, timeout=request_timeout)
+    except requests.RequestException:
+        # serve the stale copy rather than failing without network
+        if entry:
+            return content
+        raise
+
+    if response.status_code == 304 and entry:
+        with _lock:
+            entry['fetched'] = time.time()
+            _save_index()
+        return content
+
+    response.raise_for_status()
+    return _store(url, response)
+
+
+def fetch_json(url):
+    return json.loads(fetch_bytes(url))
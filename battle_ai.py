@@ -0,0 +1,227 @@
+# Search-based battle AI
+#
+# The rival looks ahead with expectiminimax over the exact chance model in
+# battle_solver: every status coin flip, miss and ability roll is a chance
+# node, the side to move picks how many potions to drink before attacking,
+# and the other side is assumed to answer as well as it can. Below the search
+# horizon a state is valued by the exact win probability under greedy play.
+#
+# Start-of-turn states are already packed into small integers, so they key a
+# transposition table directly. Search deepens one turn at a time until the
+# time budget runs out and the deepest finished search decides. Root options
+# can also be searched in parallel in a process pool. Run as a script to pit
+# a difficulty against the greedy policy:
+#
+#     python battle_ai.py [battles per matchup] [difficulty]
+
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from battle_engine import ROSTER, PLAYER, RIVAL, ACTION_ATTACK, ACTION_POTION, Battle, Fighter, greedy_policy, run_battle
+from battle_solver import MatchupSolver, battle_state, decode_state
+
+# Difficulty -> (time budget per decision in seconds, deepest search in turns);
+# easy plays greedy_policy
+DIFFICULTIES = {
+    'easy': None,
+    'normal': (0.01, 1),
+    'hard': (0.05, 8),
+}
+
+# Transposition tables are dropped once they grow past this many entries
+MAX_TABLE_SIZE = 1000000
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# The roster-style spec of a fighter, which is all the solver needs
+def fighter_spec(fighter):
+    return (fighter.name, fighter.type, fighter.max_hp, fighter.attack, fighter.status_ability)
+
+
+class SearchPolicy:
+
+    def __init__(self, time_budget=0.05, max_depth=8, workers=0):
+        self.time_budget = time_budget
+        self.max_depth = max_depth
+        self.deadline = None
+
+        # per matchup: the solver valuing states past the horizon, and the
+        # transposition table of (state, depth) -> player win probability
+        self.solvers = {}
+        self.tables = {}
+
+        self.pool = ProcessPoolExecutor(workers) if workers else None
+
+    # Value the matchup's states under greedy play ahead of the first
+    # decision, which would otherwise pay for it inside its time budget
+    def prepare(self, battle):
+        self.prepare_matchup(tuple(fighter_spec(f) for f in battle.fighters))
+
+    def prepare_matchup(self, specs):
+        self.set_matchup(specs)
+        self.solver.solve_start()
+
+    # Use as a battle policy: the actions for the side whose turn it is
+    def __call__(self, battle):
+        specs = tuple(fighter_spec(f) for f in battle.fighters)
+        drink = self.choose(specs, battle_state(battle))
+        if drink is None:
+            return greedy_policy(battle)
+        return [ACTION_POTION] * drink + [ACTION_ATTACK]
+
+    # How many potions the side to move should drink before attacking, from a
+    # state whose status check has passed; None if no search finished in time
+    def choose(self, specs, code):
+        turn, hp, status, potions = decode_state(code)
+        options = range(potions[turn] + 1)
+        if self.pool:
+            values = self.search_parallel(specs, code, options)
+        else:
+            values = self.search_options(specs, code, options, time.perf_counter() + self.time_budget)
+        if not values:
+            return None
+
+        # the player maximizes its win probability, the rival minimizes it
+        best = max if turn == PLAYER else min
+        return best(options, key=lambda drink: values[drink])
+
+    # Iteratively deepen over the root options; values from the deepest search
+    # that finished for every option
+    def search_options(self, specs, code, options, deadline):
+        self.set_matchup(specs)
+        self.deadline = deadline
+        turn, hp, status, potions = decode_state(code)
+        values = None
+        for depth in range(1, self.max_depth + 1):
+            try:
+                values = {drink: self.option_value(turn, hp, status, potions, drink, depth)
+                          for drink in options}
+            except SearchTimeout:
+                break
+        return values
+
+    # Search each root option in its own worker process
+    def search_parallel(self, specs, code, options):
+        futures = [self.pool.submit(_search_option, specs, code, drink, self.time_budget, self.max_depth)
+                   for drink in options]
+        depths = [future.result() for future in futures]
+
+        # compare the options at the deepest depth they all reached
+        common = min(len(values) for values in depths)
+        if common == 0:
+            return None
+        return {drink: values[common - 1] for drink, values in zip(options, depths)}
+
+    def set_matchup(self, specs):
+        if specs not in self.solvers:
+            self.solvers[specs] = MatchupSolver(*specs)
+            self.tables[specs] = {}
+        self.solver = self.solvers[specs]
+        self.table = self.tables[specs]
+        if len(self.table) > MAX_TABLE_SIZE:
+            self.table.clear()
+
+    # Player win probability of a start-of-turn state searched depth turns ahead
+    def state_value(self, code, depth):
+        if code < 0:
+            return 1.0 if code == -1 - PLAYER else 0.0
+        if depth == 0:
+            return self.solver.solve(code)[0]
+
+        key = (code, depth)
+        if key in self.table:
+            return self.table[key]
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        turn, hp, status, potions = decode_state(code)
+        value = 0
+        for p, can_act, checked in self.solver.status_check(turn, status):
+            if not can_act:
+                value += p * self.outcomes_value(turn, False, hp, checked, potions, 0, depth)
+                continue
+            best = max if turn == PLAYER else min
+            value += p * best(
+                self.option_value(turn, hp, checked, potions, drink, depth)
+                for drink in range(potions[turn] + 1)
+            )
+
+        self.table[key] = value
+        return value
+
+    # Player win probability after the side to move drinks and attacks
+    def option_value(self, turn, hp, status, potions, drink, depth):
+        return self.outcomes_value(turn, True, hp, status, potions, drink, depth)
+
+    def outcomes_value(self, turn, can_act, hp, status, potions, drink, depth):
+        outcomes = {}
+        self.solver.play_turn(turn, 1, can_act, hp, status, potions, drink, outcomes)
+        return sum(q * self.state_value(key, depth - 1) for key, q in outcomes.items())
+
+
+# One SearchPolicy per worker process, so its tables outlive a single decision
+_worker_policy = None
+
+
+def _search_option(specs, code, drink, time_budget, max_depth):
+    global _worker_policy
+    if _worker_policy is None:
+        _worker_policy = SearchPolicy(time_budget, max_depth)
+    policy = _worker_policy
+    policy.set_matchup(specs)
+    policy.deadline = time.perf_counter() + time_budget
+    turn, hp, status, potions = decode_state(code)
+
+    values = []
+    for depth in range(1, max_depth + 1):
+        try:
+            values.append(policy.option_value(turn, hp, status, potions, drink, depth))
+        except SearchTimeout:
+            break
+    return values
+
+
+# A battle policy for a difficulty name
+def make_policy(difficulty='hard', workers=0):
+    settings = DIFFICULTIES[difficulty]
+    if settings is None:
+        return greedy_policy
+    time_budget, max_depth = settings
+    return SearchPolicy(time_budget, max_depth, workers)
+
+
+if __name__ == '__main__':
+    battles_per_matchup = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    difficulty = sys.argv[2] if len(sys.argv) > 2 else 'hard'
+    policy = make_policy(difficulty)
+
+    # time every decision the search makes
+    timings = []
+
+    def timed_policy(battle):
+        start = time.perf_counter()
+        actions = policy(battle)
+        timings.append(time.perf_counter() - start)
+        return actions
+
+    wins = total = 0
+    for i, player in enumerate(ROSTER):
+        for j, rival in enumerate(ROSTER):
+            if i == j:
+                continue
+            if isinstance(policy, SearchPolicy):
+                policy.prepare(Battle(Fighter(*player), Fighter(*rival)))
+            for _ in range(battles_per_matchup):
+                winner = run_battle(Fighter(*player), Fighter(*rival), rival_policy=timed_policy)
+                wins += winner == RIVAL
+                total += 1
+
+    print(f'{difficulty} rival won {wins / total:.3f} of {total} battles against greedy play')
+    if timings:
+        timings.sort()
+        print(f'Decision time: median {timings[len(timings) // 2] * 1000:.1f} ms, '
+              f'max {timings[-1] * 1000:.1f} ms over {len(timings)} decisions')
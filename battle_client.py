@@ -0,0 +1,140 @@
+# The game's connection to a battle server
+#
+# A reader thread receives messages into a queue and calls notify (the game
+# posts a pygame event from it to wake its loop); everything else runs on
+# the game's thread, which polls the queue as it needs to. The game plays
+# the battle with its own engine and, before each new turn, waits for the
+# server's TURN for the last one (see battle_protocol). The connection opens
+# with a HELLO carrying a session id of its own, which a sharded server routes
+# it by.
+
+import random
+import socket
+import threading
+from collections import deque
+
+# how long to wait for the server to accept the connection, in seconds
+connect_timeout = 5
+
+from battle_protocol import (
+    MATCH, TURN, LEFT, ERROR, LEAVE, LENGTH,
+    message, hello_message, join_message, action_message, unpack_match, unpack_turn, turn_actions, check_turn,
+)
+
+
+class BattleClient:
+
+    def __init__(self, address, notify=None):
+        host, port = address.rsplit(':', 1)
+        self.socket = socket.create_connection((host, int(port)), timeout=connect_timeout)
+        self.socket.settimeout(None)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.session_id = random.getrandbits(64)
+        self.socket.sendall(hello_message(self.session_id))
+        self.notify = notify
+        self.inbox = deque()
+
+        # the latest MATCH not yet taken, the TURNs of the battle by turn,
+        # the last turn checked against the server, and why the battle or
+        # the connection ended
+        self.match = None
+        self.turns = {}
+        self.checked = -1
+        self.error = None
+
+        self.reader = threading.Thread(target=self.receive, name='battle client', daemon=True)
+        self.reader.start()
+
+    def receive(self):
+        try:
+            with self.socket.makefile('rb') as file:
+                while True:
+                    prefix = file.read(LENGTH.size)
+                    if len(prefix) < LENGTH.size:
+                        break
+                    data = file.read(LENGTH.unpack(prefix)[0])
+                    self.inbox.append((data[0], data[1:]))
+                    if self.notify:
+                        self.notify()
+        except OSError:
+            pass
+        self.inbox.append((None, b'Lost the connection to the battle server'))
+        if self.notify:
+            self.notify()
+
+    # Handle the messages received so far
+    def poll(self):
+        while self.inbox:
+            type, payload = self.inbox.popleft()
+            if type == MATCH:
+                self.match = unpack_match(payload)
+                self.turns.clear()
+                self.checked = -1
+            elif type == TURN:
+                turn = unpack_turn(payload)
+                self.turns[turn.turn] = turn
+            elif type == LEFT:
+                self.error = 'Rival left the battle!'
+            elif type in (ERROR, None):
+                self.error = payload.decode(errors='replace')
+
+    def send(self, data):
+        try:
+            self.socket.sendall(data)
+        except OSError:
+            self.error = 'Lost the connection to the battle server'
+
+    # Ask for a battle with a roster species against another player or an
+    # AI difficulty
+    def join(self, name, opponent):
+        self.poll()
+        self.match = None
+        self.error = None
+        self.send(join_message(name, opponent))
+
+    # Leave the queue or forfeit the battle
+    def leave(self):
+        self.send(message(LEAVE))
+
+    # The potions drunk before attacking on a turn
+    def send_action(self, turn, potions):
+        self.send(action_message(turn, potions))
+
+    def take_match(self):
+        self.poll()
+        match, self.match = self.match, None
+        return match
+
+    def take_error(self):
+        self.poll()
+        error, self.error = self.error, None
+        return error
+
+    # Whether the server has confirmed every turn the battle has played; a
+    # turn it played differently is replaced by the server's state
+    def ready(self, battle):
+        self.poll()
+        last = battle.turns - 1
+        if last <= self.checked:
+            return True
+        turn = self.turns.pop(last, None)
+        if turn is None:
+            return False
+        if not check_turn(battle, turn):
+            print(f'Out of step with the battle server on turn {last}; took its state')
+        self.checked = last
+        return True
+
+    # The rival's actions on the current turn, or None until they arrive
+    def actions(self, battle):
+        self.poll()
+        turn = self.turns.get(battle.turns)
+        return turn_actions(turn) if turn else None
+
+    def close(self):
+        self.notify = None
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
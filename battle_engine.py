@@ -0,0 +1,442 @@
+# Battle rules with no pygame and no sleeping
+#
+# The engine only changes battle state and describes what happened as a list
+# of BattleEvent tuples. The pygame UI is one consumer of those events (it
+# shows each message and paces them); a headless simulation can run thousands
+# of battles per second and simply ignore them.
+
+from collections import namedtuple
+
+from type_chart import parse_types, effectiveness, type_damage
+from battle_rng import (
+    BattleStream, turn_counter, OPENING_ROLL, ROLL_STATUS, ROLL_CONFUSION, ROLL_MISS, ROLL_ABILITY,
+)
+
+# Status condition constants
+STATUS_NONE = 0
+STATUS_BURN = 1
+STATUS_PARALYSIS = 2
+STATUS_POISON = 3
+STATUS_SLEEP = 4
+STATUS_CONFUSION = 5
+
+# Move names for each Pokemon
+MOVE_NAMES = {
+    'Raichu': 'Thunder Wave',
+    'Charizard': 'Blast Burn',
+    'Nidoking': 'Toxic',
+    'Venusaur': 'Sleep Powder',
+    'Gyarados': 'Confuse Ray',
+    'Dragonite': 'Dragon Dance'
+}
+
+# The roster: name, type, hp, attack and status ability. Weaknesses come
+# from the type chart.
+ROSTER = [
+    ('Raichu', 'Electric', 140, 30, STATUS_PARALYSIS),
+    ('Charizard', 'Fire', 180, 40, STATUS_BURN),
+    ('Venusaur', 'Grass', 230, 25, STATUS_SLEEP),
+    ('Gyarados', 'Water', 160, 45, STATUS_CONFUSION),
+    ('Nidoking', 'Ground', 150, 35, STATUS_POISON),
+    ('Dragonite', 'Dragon', 190, 50, None),
+]
+
+# Sides of a battle
+PLAYER = 0
+RIVAL = 1
+
+# Actions a side can take once it is allowed to act
+ACTION_ATTACK = 'attack'
+ACTION_POTION = 'potion'
+
+# Kinds of battle events
+EVENT_MESSAGE = 'message'  # a line of battle text
+EVENT_COIN = 'coin'        # a coin flip is announced
+EVENT_REFRESH = 'refresh'  # HP or status changed, the battle should be redrawn
+EVENT_FAINT = 'faint'      # a Pokemon fainted and the battle is over
+
+# Refresh events also carry each side's (HP, status) at that moment, because
+# a consumer may show them well after the battle state has moved on
+BattleEvent = namedtuple('BattleEvent', ['kind', 'text', 'state'], defaults=[None])
+
+# A coin lands heads when its roll is below one half
+COIN = ('Heads', 'Tails')
+
+def flip(roll):
+    return COIN[roll >= 0.5]
+
+# The battle state of one Pokemon
+class Fighter:
+
+    # a fixed set of fields keeps each fighter small and cheap to copy
+    __slots__ = ('name', 'type', 'attacking_type', 'defending_types', 'current_hp', 'max_hp',
+                 'attack', 'status', 'status_ability', 'num_potions')
+
+    def __init__(self, name, type, hp, attack, status_ability=None):
+
+        # set the pokemon's name and type ('Fire', or 'Grass/Poison' for two),
+        # plus its type chart indexes
+        self.name = name
+        self.type = type
+        self.attacking_type, self.defending_types = parse_types(type)
+
+        # set the pokemon's stats (TCG Pocket style - lower numbers)
+        self.max_hp = hp
+        self.attack = attack
+
+        # which status this pokemon can inflict
+        self.status_ability = status_ability
+
+        self.reset()
+
+    # A plain Fighter with the same battle state, for simulation and search
+    def copy(self):
+        clone = Fighter.__new__(Fighter)
+        for field in Fighter.__slots__:
+            setattr(clone, field, getattr(self, field))
+        return clone
+
+    # Restore full HP, no status and both potions, ready for a new battle
+    def reset(self):
+        self.current_hp = self.max_hp
+
+        # status conditions
+        self.status = STATUS_NONE
+
+        # number of potions left
+        self.num_potions = 2
+
+    # Check and apply status effects at the START of the turn; rng is the
+    # battle's stream and turn the number of turns played before this one
+    def check_status_at_turn_start(self, rng, turn, events):
+        # Paralysis: Can't act for 1 turn
+        if self.status == STATUS_PARALYSIS:
+            self.status = STATUS_NONE  # Remove paralysis after 1 turn
+            return False  # Cannot act this turn
+
+        # Burn: Flip coin to try to remove it
+        elif self.status == STATUS_BURN:
+            coin = flip(rng.uniform(turn_counter(turn, ROLL_STATUS)))
+            events.append(BattleEvent(EVENT_COIN, f'{self.name} is burned! Flipping coin...'))
+            events.append(BattleEvent(EVENT_MESSAGE, f'Result: {coin}!'))
+            if coin == 'Heads':
+                self.status = STATUS_NONE
+                events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} recovered from burn!'))
+                events.append(BattleEvent(EVENT_REFRESH, None))
+            else:
+                events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} is still burned!'))
+            return True  # Can act, a remaining burn hurts at end of turn
+
+        # Sleep: Flip coin to wake up
+        elif self.status == STATUS_SLEEP:
+            coin = flip(rng.uniform(turn_counter(turn, ROLL_STATUS)))
+            events.append(BattleEvent(EVENT_COIN, f'{self.name} is asleep! Flipping coin...'))
+            events.append(BattleEvent(EVENT_MESSAGE, f'Result: {coin}!'))
+            if coin == 'Heads':
+                self.status = STATUS_NONE
+                events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} woke up!'))
+                events.append(BattleEvent(EVENT_REFRESH, None))
+                return True  # Can act this turn
+            else:
+                events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} is still asleep!'))
+                return False  # Cannot act
+
+        return True  # Can act
+
+    # Perform an attack on another Pokemon
+    def perform_attack(self, other, rng, turn, events):
+        # Get move name
+        move_name = MOVE_NAMES.get(self.name, 'Attack')
+
+        # Check confusion WHEN attacking
+        if self.status == STATUS_CONFUSION:
+            coin = flip(rng.uniform(turn_counter(turn, ROLL_CONFUSION)))
+            events.append(BattleEvent(EVENT_COIN, f'{self.name} is confused! Flipping coin...'))
+            events.append(BattleEvent(EVENT_MESSAGE, f'Result: {coin}!'))
+            if coin == 'Heads':
+                # Wake up from confusion and attack normally
+                self.status = STATUS_NONE
+                events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} snapped out of confusion!'))
+                events.append(BattleEvent(EVENT_REFRESH, None))
+            else:
+                # Attack fails and confusion is removed
+                self.status = STATUS_NONE
+                events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} missed due to confusion!'))
+                other.apply_status_damage_at_turn_end(events)
+                return  # Turn ends, no damage
+
+        # Calculate damage from the type chart
+        damage = type_damage(self.attack, self.attacking_type, other.defending_types)
+        multiplier = effectiveness(self.attacking_type, other.defending_types)
+
+        # Missed attack (25% chance)
+        missed_attack = rng.uniform(turn_counter(turn, ROLL_MISS)) < 0.25
+
+        events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} uses {move_name}!'))
+
+        # Apply damage
+        if missed_attack:
+            events.append(BattleEvent(EVENT_MESSAGE, 'Attack missed!'))
+            if other.status == STATUS_BURN or other.status == STATUS_POISON:
+                other.apply_status_damage_at_turn_end(events)
+            return
+
+        other.take_damage(damage)
+        events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} deals {damage} damage!'))
+        if multiplier > 1:
+            events.append(BattleEvent(EVENT_MESSAGE, f'{move_name} was super effective!'))
+        elif multiplier < 1:
+            events.append(BattleEvent(EVENT_MESSAGE, f'{move_name} was not very effective...'))
+        events.append(BattleEvent(EVENT_REFRESH, None))
+
+        # Apply status condition based on ability (immediately)
+        if not self.status_ability:
+            return
+        roll = rng.uniform(turn_counter(turn, ROLL_ABILITY))
+
+        if self.status_ability == STATUS_BURN:
+            # Burn has 50% chance
+            if roll < 0.5:
+                other.status = STATUS_BURN
+                other.take_damage(20)
+                events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} is burned!'))
+            else:
+                events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} resisted the burn!'))
+
+        elif self.status_ability == STATUS_POISON:
+            # Poison is guaranteed (100%)
+            other.status = STATUS_POISON
+            other.take_damage(10)
+            events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} is poisoned!'))
+
+        elif self.status_ability == STATUS_PARALYSIS:
+            # Paralysis has 50% chance
+            if roll < 0.5:
+                other.status = STATUS_PARALYSIS
+                events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} is paralyzed!'))
+            else:
+                events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} resisted the paralysis!'))
+
+        elif self.status_ability == STATUS_SLEEP:
+            # Sleep has 75% chance
+            if roll < 0.75:
+                other.status = STATUS_SLEEP
+                events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} fell asleep!'))
+            else:
+                events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} stayed awake!'))
+
+        elif self.status_ability == STATUS_CONFUSION:
+            # Confusion is guaranteed (100%)
+            other.status = STATUS_CONFUSION
+            events.append(BattleEvent(EVENT_MESSAGE, f'{other.name} is confused!'))
+
+        events.append(BattleEvent(EVENT_REFRESH, None))
+
+    # Apply status damage at the END of the turn
+    def apply_status_damage_at_turn_end(self, events):
+        # Burn: Take 20 damage at end of turn (if still burned)
+        if self.status == STATUS_BURN:
+            self.take_damage(20)
+            events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} took 20 burn damage!'))
+            events.append(BattleEvent(EVENT_REFRESH, None))
+
+        # Poison: Take 10 damage at end of turn
+        elif self.status == STATUS_POISON:
+            self.take_damage(10)
+            events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} took 10 poison damage!'))
+            events.append(BattleEvent(EVENT_REFRESH, None))
+
+        # Paralysis: Remove it at end of turn
+        elif self.status == STATUS_PARALYSIS:
+            self.status = STATUS_NONE
+            events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} is no longer paralyzed!'))
+            events.append(BattleEvent(EVENT_REFRESH, None))
+
+    def take_damage(self, damage):
+        self.current_hp -= damage
+        if self.current_hp < 0:
+            self.current_hp = 0
+
+    def use_potion(self, events):
+        if self.num_potions > 0:
+            # Heal 50 HP
+            self.current_hp += 50
+            if self.current_hp > self.max_hp:
+                self.current_hp = self.max_hp
+            self.num_potions -= 1
+
+            # Cure status conditions
+            had_status = self.status != STATUS_NONE
+            self.status = STATUS_NONE
+
+            events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} uses a potion and heals 50 HP!'))
+            if had_status:
+                events.append(BattleEvent(EVENT_MESSAGE, f'{self.name} is cured from all status effects!'))
+            events.append(BattleEvent(EVENT_REFRESH, None))
+
+            return True
+        return False
+
+# The events of one battle step; refreshes are stamped with the current state
+class EventLog(list):
+
+    def __init__(self, battle):
+        list.__init__(self)
+        self.battle = battle
+
+    def append(self, event):
+        if event.kind == EVENT_REFRESH:
+            event = event._replace(state=self.battle.snapshot())
+        list.append(self, event)
+
+# One battle between a player and a rival, advanced one action at a time.
+# Every step returns the events it produced.
+class Battle:
+
+    __slots__ = ('fighters', 'rng', 'turn', 'turn_started', 'can_act', 'winner', 'turns', 'recorder')
+
+    # rng is anything with uniform(counter), normally the battle's own
+    # BattleStream; by default a randomly seeded one
+    def __init__(self, player, rival, rng=None):
+        self.fighters = (player, rival)
+        self.rng = rng or BattleStream()
+
+        # whose turn it is, whether its start-of-turn status check has run and
+        # whether the side may act this turn
+        self.turn = None
+        self.turn_started = False
+        self.can_act = False
+
+        # PLAYER or RIVAL once the other side has fainted, and how many turns
+        # have been played
+        self.winner = None
+        self.turns = 0
+
+        # told about every finished turn when the battle is being recorded
+        self.recorder = None
+
+    @property
+    def player(self):
+        return self.fighters[PLAYER]
+
+    @property
+    def rival(self):
+        return self.fighters[RIVAL]
+
+    # An independent copy of this battle, optionally drawing from another rng
+    def copy(self, rng=None):
+        clone = Battle(self.player.copy(), self.rival.copy(), rng or self.rng)
+        clone.turn = self.turn
+        clone.turn_started = self.turn_started
+        clone.can_act = self.can_act
+        clone.winner = self.winner
+        clone.turns = self.turns
+        return clone
+
+    # Each side's (HP, status) right now
+    def snapshot(self):
+        return tuple((f.current_hp, f.status) for f in self.fighters)
+
+    # Coin flip to see who goes first
+    def start(self):
+        coin = flip(self.rng.uniform(OPENING_ROLL))
+        events = [
+            BattleEvent(EVENT_COIN, 'Flipping coin to see who goes first...'),
+            BattleEvent(EVENT_MESSAGE, f'{coin}!'),
+        ]
+        if coin == 'Heads':
+            events.append(BattleEvent(EVENT_MESSAGE, 'Player goes first!'))
+            self._begin_turn(PLAYER)
+        else:
+            events.append(BattleEvent(EVENT_MESSAGE, 'Rival goes first!'))
+            self._begin_turn(RIVAL)
+        return events
+
+    # Check status at START of turn; a side that cannot act passes its turn
+    def start_turn(self):
+        events = EventLog(self)
+        active = self.fighters[self.turn]
+        other = self.fighters[1 - self.turn]
+
+        self.turn_started = True
+        self.can_act = active.check_status_at_turn_start(self.rng, self.turns, events)
+
+        if not self.can_act:
+            events.append(BattleEvent(EVENT_MESSAGE, f'{active.name} cannot attack this turn!'))
+
+            # Apply status damage/update
+            other.apply_status_damage_at_turn_end(events)
+            active.apply_status_damage_at_turn_end(events)
+            self._end_turn(events)
+
+        return events
+
+    # The active side uses a potion; its turn goes on
+    def use_potion(self):
+        events = EventLog(self)
+        self.fighters[self.turn].use_potion(events)
+        return events
+
+    # The active side attacks, which ends its turn
+    def attack(self):
+        events = EventLog(self)
+        active = self.fighters[self.turn]
+        other = self.fighters[1 - self.turn]
+
+        active.perform_attack(other, self.rng, self.turns, events)
+
+        if other.current_hp > 0:
+            # Apply status damage/effect
+            if other.status != STATUS_PARALYSIS:
+                active.apply_status_damage_at_turn_end(events)
+
+        self._end_turn(events)
+        return events
+
+    def _begin_turn(self, side):
+        self.turn = side
+        self.turn_started = False
+        self.can_act = False
+
+    def _end_turn(self, events):
+        self.turns += 1
+        if self.rival.current_hp == 0:
+            self.winner = PLAYER
+        elif self.player.current_hp == 0:
+            self.winner = RIVAL
+        if self.recorder:
+            self.recorder.end_turn(self)
+
+        if self.winner is None:
+            self._begin_turn(1 - self.turn)
+        else:
+            loser = self.fighters[1 - self.winner]
+            events.append(BattleEvent(EVENT_FAINT, f'{loser.name} fainted!'))
+
+# AI decision: use potion if low HP, then attack
+def greedy_policy(battle):
+    active = battle.fighters[battle.turn]
+    if (active.max_hp - active.current_hp >= 50) and active.num_potions > 0:
+        return [ACTION_POTION, ACTION_ATTACK]
+    return [ACTION_ATTACK]
+
+# Play a new Battle to the end without any I/O and return it
+def play_battle(battle, player_policy=greedy_policy, rival_policy=greedy_policy):
+    battle.start()
+    policies = (player_policy, rival_policy)
+
+    while battle.winner is None:
+        battle.start_turn()
+        if not battle.can_act:
+            continue
+        for action in policies[battle.turn](battle):
+            if action == ACTION_POTION:
+                battle.use_potion()
+            else:
+                battle.attack()
+
+    return battle
+
+# Play one whole battle between two fighters and return the winning side
+def run_battle(player, rival, player_policy=greedy_policy, rival_policy=greedy_policy, rng=None):
+    return play_battle(Battle(player, rival, rng), player_policy, rival_policy).winner
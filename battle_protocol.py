@@ -0,0 +1,183 @@
+# Wire protocol between the battle server and its clients
+#
+# Every message is its length as 2 little-endian bytes, then a type byte and
+# the payload. Battles run in lockstep: the server sends a MATCH with the
+# battle's (seed, battle id) and both stat lines, every client plays the
+# battle with its own engine on the same random stream, and only actions
+# travel: one byte per turn for the potions drunk before attacking, as in
+# battle_replay. After every turn the server, which alone applies the rules
+# to the real battle, sends each side a TURN with the action taken and the
+# packed state, so a client that disagrees takes the server's state.
+#
+# Every client sees itself as the player: the second side of a battle gets
+# its MATCH and TURN messages mirrored and plays on a MirroredStream.
+#
+# Client messages:
+#   HELLO    session id (8 bytes), sent first; a sharded server routes the
+#            connection to a worker by its hash
+#   JOIN     species name, opponent ('player' or an AI difficulty), each
+#            length-prefixed UTF-8
+#   ACTION   turn (2 bytes), potions drunk before attacking
+#   LEAVE    -                        leave the queue, or forfeit the battle
+# Server messages:
+#   WAITING  -                        queued for another player
+#   MATCH    seed and battle id (8 bytes each), mirrored, own spec, rival spec
+#   TURN     turn (2 bytes), action (NO_ACTION when the side could not act),
+#            the state after it (battle_replay.STATE) and the winner
+#            (NO_WINNER until there is one)
+#   LEFT     -                        the rival left; the battle is over
+#   ERROR    UTF-8 text
+
+import struct
+from collections import namedtuple
+
+from battle_engine import ACTION_ATTACK, ACTION_POTION, PLAYER, Battle, Fighter
+from battle_replay import NO_ACTION, STATE, pack_spec, pack_state, unpack_spec
+from battle_rng import BattleStream, MirroredStream
+
+# message types
+JOIN = 1
+ACTION = 2
+LEAVE = 3
+HELLO = 4
+WAITING = 16
+MATCH = 17
+TURN = 18
+LEFT = 19
+ERROR = 20
+
+# winner byte of a battle still being fought
+NO_WINNER = 0xFF
+
+# the opponent asked for to be matched with another player
+OPPONENT_PLAYER = 'player'
+
+# longest message a peer may send
+MAX_MESSAGE = 1024
+
+LENGTH = struct.Struct('<H')
+ACTION_MESSAGE = struct.Struct('<HB')
+SESSION_ID = struct.Struct('<Q')
+MATCH_MESSAGE = struct.Struct('<QQ?')
+
+Match = namedtuple('Match', ['seed', 'battle_id', 'mirrored', 'specs'])
+Turn = namedtuple('Turn', ['turn', 'action', 'state', 'winner'])
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# what decoding a malformed message can raise
+BAD_MESSAGE = (ProtocolError, struct.error, IndexError, UnicodeDecodeError)
+
+
+def message(type, payload=b''):
+    return LENGTH.pack(len(payload) + 1) + bytes((type,)) + payload
+
+
+def pack_text(text):
+    text = text.encode()
+    return bytes((len(text),)) + text
+
+
+def unpack_text(data, offset=0):
+    length = data[offset]
+    return bytes(data[offset + 1:offset + 1 + length]).decode(), offset + 1 + length
+
+
+def hello_message(session_id):
+    return message(HELLO, SESSION_ID.pack(session_id))
+
+
+def join_message(name, opponent):
+    return message(JOIN, pack_text(name) + pack_text(opponent))
+
+
+def unpack_join(payload):
+    name, offset = unpack_text(payload)
+    opponent, offset = unpack_text(payload, offset)
+    return name, opponent
+
+
+def action_message(turn, potions):
+    return message(ACTION, ACTION_MESSAGE.pack(turn, potions))
+
+
+def match_message(seed, battle_id, side, specs):
+    return message(MATCH, MATCH_MESSAGE.pack(seed, battle_id, side != PLAYER)
+                   + pack_spec(specs[side]) + pack_spec(specs[1 - side]))
+
+
+def unpack_match(payload):
+    seed, battle_id, mirrored = MATCH_MESSAGE.unpack_from(payload)
+    player, offset = unpack_spec(payload, MATCH_MESSAGE.size)
+    rival, offset = unpack_spec(payload, offset)
+    return Match(seed, battle_id, mirrored, (player, rival))
+
+
+# The TURN of the turn just played, as seen from side
+def turn_message(battle, action, side):
+    winner = NO_WINNER if battle.winner is None else battle.winner ^ side
+    state = pack_state(battle, side)
+    return message(TURN, ACTION_MESSAGE.pack(battle.turns - 1, action) + state + bytes((winner,)))
+
+
+def unpack_turn(payload):
+    turn, action = ACTION_MESSAGE.unpack_from(payload)
+    state = bytes(payload[ACTION_MESSAGE.size:ACTION_MESSAGE.size + STATE.size])
+    winner = payload[ACTION_MESSAGE.size + STATE.size]
+    return Turn(turn, action, state, None if winner == NO_WINNER else winner)
+
+
+# The next (type, payload) from an asyncio StreamReader
+async def read_message(reader):
+    (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    if not 0 < length <= MAX_MESSAGE:
+        raise ProtocolError(f'bad message length {length}')
+    data = await reader.readexactly(length)
+    return data[0], memoryview(data)[1:]
+
+
+# The (type, payload) of every whole message in data, as read_message
+# returns them
+def split_messages(data):
+    offset = 0
+    while offset + LENGTH.size <= len(data):
+        (length,) = LENGTH.unpack_from(data, offset)
+        if not 0 < length <= MAX_MESSAGE:
+            raise ProtocolError(f'bad message length {length}')
+        offset += LENGTH.size + length
+        if offset > len(data):
+            return
+        yield data[offset - length], memoryview(data)[offset - length + 1:offset]
+
+
+# The random stream of a MATCH's battle, seen from the client's side
+def match_stream(match):
+    return (MirroredStream if match.mirrored else BattleStream)(match.seed, match.battle_id)
+
+
+# The client's side of a MATCH: a new battle with the client as the player
+def match_battle(match):
+    return Battle(Fighter(*match.specs[0]), Fighter(*match.specs[1]), match_stream(match))
+
+
+# The actions of a TURN, as a policy would return them
+def turn_actions(turn):
+    if turn.action == NO_ACTION:
+        return [ACTION_ATTACK]
+    return [ACTION_POTION] * turn.action + [ACTION_ATTACK]
+
+
+# Compare a client's battle with the server's state after a turn and take
+# the server's on any difference. Returns True when they agreed.
+def check_turn(battle, turn):
+    if pack_state(battle) == turn.state and battle.winner == turn.winner:
+        return True
+    side, *sides = STATE.unpack(turn.state)
+    for fighter, i in zip(battle.fighters, (0, 3)):
+        fighter.current_hp, fighter.status, fighter.num_potions = sides[i:i + 3]
+    battle.turn = side
+    battle.winner = turn.winner
+    return False
@@ -0,0 +1,266 @@
+# Compact binary battle replays
+#
+# A battle is fully determined by its two stat lines, the (seed, battle id)
+# of its random stream and what each side did on each turn, so that is all a
+# replay holds: one byte per turn for the number of potions drunk before
+# attacking (or NO_ACTION when the side could not act), a 16-bit checksum of
+# the state after every turn and a 32-bit checksum over the whole battle.
+# Replaying re-runs the rules on the same stream and compares the checksums,
+# which pins down the first turn a rule change alters. Run as a script:
+#
+#     python battle_replay.py record <log> [battles] [difficulty]
+#     python battle_replay.py verify <log>
+#     python battle_replay.py play <log> [index] [speed]
+#
+# play shows one battle of the log in the game window, sped up or slowed down.
+#
+# File layout: MAGIC, then one record after another, each prefixed with its
+# length as 2 little-endian bytes. A record is the seed and battle id (8
+# bytes each), the player and rival specs (name and type as length-prefixed
+# UTF-8, hp and attack as 2 bytes each, the status ability as 1 byte), the
+# winner, the turn count as 2 bytes, the turns (action byte and 2-byte
+# checksum each) and the 4-byte battle checksum.
+
+import os
+import random
+import runpy
+import struct
+import sys
+import time
+import zlib
+from collections import namedtuple
+
+from battle_ai import fighter_spec, make_policy
+from battle_engine import ROSTER, PLAYER, ACTION_ATTACK, ACTION_POTION, STATUS_NONE, Battle, Fighter, play_battle
+from battle_rng import BattleStream
+
+MAGIC = b'PKREPLY2'
+
+# action byte of a turn the side could not act on
+NO_ACTION = 0xFF
+
+LENGTH = struct.Struct('<H')
+SEED = struct.Struct('<QQ')
+STATS = struct.Struct('<HHB')
+COUNTS = struct.Struct('<BH')
+TURN = struct.Struct('<BH')
+CHECKSUM = struct.Struct('<I')
+STATE = struct.Struct('<BHBBHBB')
+
+# what reading a missing or damaged replay log can raise
+BAD_REPLAY = (OSError, ValueError, IndexError, struct.error)
+
+BattleRecord = namedtuple('BattleRecord', ['seed', 'battle_id', 'specs', 'winner', 'actions', 'checksums', 'checksum'])
+
+
+# The state after a turn, packed: whose turn it was, then each side's HP,
+# status and potions. Seen from side, that side comes first.
+def pack_state(battle, side=PLAYER):
+    player, rival = battle.fighters[side], battle.fighters[1 - side]
+    return STATE.pack(battle.turn ^ side, player.current_hp, player.status, player.num_potions,
+                      rival.current_hp, rival.status, rival.num_potions)
+
+
+# A spec as name and type (length-prefixed UTF-8), hp, attack and status ability
+def pack_spec(spec):
+    name, type, hp, attack, status_ability = spec
+    parts = []
+    for text in (name, type):
+        text = text.encode()
+        parts.append(bytes((len(text),)) + text)
+    parts.append(STATS.pack(hp, attack, status_ability or STATUS_NONE))
+    return b''.join(parts)
+
+
+# The spec packed at offset, and the offset after it
+def unpack_spec(data, offset=0):
+    texts = []
+    for _ in range(2):
+        length = data[offset]
+        texts.append(bytes(data[offset + 1:offset + 1 + length]).decode())
+        offset += 1 + length
+    hp, attack, status_ability = STATS.unpack_from(data, offset)
+    return (texts[0], texts[1], hp, attack, status_ability or None), offset + STATS.size
+
+
+# Follows a Battle drawing from a BattleStream as battle.recorder and builds
+# its BattleRecord
+class ReplayRecorder:
+
+    def __init__(self, battle):
+        self.seed = battle.rng.seed
+        self.battle_id = battle.rng.battle_id
+        self.specs = tuple(fighter_spec(f) for f in battle.fighters)
+        self.potions = [f.num_potions for f in battle.fighters]
+        self.actions = bytearray()
+        self.checksums = []
+        self.checksum = 0
+        battle.recorder = self
+
+    # Called by the battle at the end of every turn, before the turn passes
+    def end_turn(self, battle):
+        active = battle.fighters[battle.turn]
+        if battle.can_act:
+            self.actions.append(self.potions[battle.turn] - active.num_potions)
+        else:
+            self.actions.append(NO_ACTION)
+        self.potions = [f.num_potions for f in battle.fighters]
+
+        state = pack_state(battle)
+        self.checksums.append(zlib.crc32(state) & 0xFFFF)
+        self.checksum = zlib.crc32(state, self.checksum)
+
+    def record(self, battle):
+        return BattleRecord(self.seed, self.battle_id, self.specs, battle.winner, bytes(self.actions),
+                            self.checksums, self.checksum)
+
+
+# Use as a battle policy to repeat a record's actions
+class ReplayPolicy:
+
+    def __init__(self, record):
+        self.actions = record.actions
+
+    def __call__(self, battle):
+        # a replay that has drifted from the record just attacks
+        if battle.turns >= len(self.actions) or self.actions[battle.turns] == NO_ACTION:
+            return [ACTION_ATTACK]
+        return [ACTION_POTION] * self.actions[battle.turns] + [ACTION_ATTACK]
+
+
+def encode(record):
+    parts = [SEED.pack(record.seed, record.battle_id)]
+    parts.extend(pack_spec(spec) for spec in record.specs)
+    parts.append(COUNTS.pack(record.winner, len(record.actions)))
+    parts.extend(TURN.pack(action, checksum) for action, checksum in zip(record.actions, record.checksums))
+    parts.append(CHECKSUM.pack(record.checksum))
+    data = b''.join(parts)
+    return LENGTH.pack(len(data)) + data
+
+
+# A BattleRecord from the bytes of one record, without its length prefix
+def decode(data):
+    seed, battle_id = SEED.unpack_from(data)
+    offset = SEED.size
+    specs = []
+    for _ in range(2):
+        spec, offset = unpack_spec(data, offset)
+        specs.append(spec)
+    winner, turns = COUNTS.unpack_from(data, offset)
+    offset += COUNTS.size
+    actions = bytearray()
+    checksums = []
+    for action, checksum in TURN.iter_unpack(data[offset:offset + turns * TURN.size]):
+        actions.append(action)
+        checksums.append(checksum)
+    (checksum,) = CHECKSUM.unpack_from(data, offset + turns * TURN.size)
+    return BattleRecord(seed, battle_id, tuple(specs), winner, bytes(actions), checksums, checksum)
+
+
+# Appends encoded records to a replay log. Raises ValueError for an existing
+# file that is not a log of this version, rather than mixing in records
+# read_replays would reject it for.
+class ReplayWriter:
+
+    def __init__(self, path):
+        self.file = open(path, 'ab+')
+        self.file.seek(0)
+        header = self.file.read(len(MAGIC))
+        if header and header != MAGIC:
+            self.file.close()
+            raise ValueError(f'{path} is not a replay log of this version')
+        if not header:
+            self.file.write(MAGIC)
+
+    def write(self, record):
+        self.file.write(record if isinstance(record, bytes) else encode(record))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Every record of a replay log, read as it is needed
+def read_replays(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a replay log')
+        while True:
+            prefix = f.read(LENGTH.size)
+            if len(prefix) < LENGTH.size:
+                return
+            (length,) = LENGTH.unpack(prefix)
+            yield decode(f.read(length))
+
+
+# Play a new battle between two specs on the stream (seed, battle_id) and record it
+def record_battle(player, rival, seed, battle_id, player_policy, rival_policy):
+    battle = Battle(Fighter(*player), Fighter(*rival), BattleStream(seed, battle_id))
+    recorder = ReplayRecorder(battle)
+    play_battle(battle, player_policy, rival_policy)
+    return recorder.record(battle)
+
+
+# Re-run a record under the current rules and return the new record
+def replay(record):
+    policy = ReplayPolicy(record)
+    return record_battle(*record.specs, record.seed, record.battle_id, policy, policy)
+
+
+# The first turn where a replay differs from its record, or None if it is
+# identical; len(record.actions) if only the winner or battle length differ
+def divergence(record, replayed):
+    for turn, (old, new) in enumerate(zip(zip(record.actions, record.checksums),
+                                          zip(replayed.actions, replayed.checksums))):
+        if old != new:
+            return turn
+    if replayed.winner != record.winner or replayed.checksum != record.checksum:
+        return min(len(record.actions), len(replayed.actions))
+    return None
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    path = sys.argv[2] if len(sys.argv) > 2 else None
+    if command not in ('record', 'verify', 'play') or path is None:
+        sys.exit('usage: battle_replay.py record|verify|play <log> [...]')
+
+    if command == 'record':
+        battles = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+        difficulty = sys.argv[4] if len(sys.argv) > 4 else 'easy'
+        policy = make_policy(difficulty)
+        seed = random.getrandbits(64)
+        try:
+            writer = ReplayWriter(path)
+        except (OSError, ValueError) as error:
+            sys.exit(f'Cannot record to {path}: {error}')
+        start = time.perf_counter()
+        for battle_id in range(battles):
+            player, rival = random.sample(ROSTER, 2)
+            writer.write(record_battle(player, rival, seed, battle_id, policy, policy))
+        writer.close()
+        print(f'Recorded {battles} battles (seed {seed}) to {path} in {time.perf_counter() - start:.1f} s')
+
+    elif command == 'verify':
+        total = mismatches = 0
+        start = time.perf_counter()
+        for i, record in enumerate(read_replays(path)):
+            turn = divergence(record, replay(record))
+            if turn is not None:
+                mismatches += 1
+                if mismatches <= 10:
+                    names = ' vs '.join(spec[0] for spec in record.specs)
+                    print(f'Battle {i} ({names}) diverges at turn {turn}')
+            total += 1
+        elapsed = time.perf_counter() - start
+        print(f'{total - mismatches} of {total} battles replayed identically '
+              f'in {elapsed:.1f} s ({total / max(elapsed, 1e-9):,.0f} battles per second)')
+        sys.exit(1 if mismatches else 0)
+
+    else:
+        os.environ['POKEMON_BATTLE_REPLAY'] = path
+        os.environ['POKEMON_BATTLE_REPLAY_INDEX'] = sys.argv[3] if len(sys.argv) > 3 else '0'
+        os.environ['POKEMON_BATTLE_REPLAY_SPEED'] = sys.argv[4] if len(sys.argv) > 4 else '1'
+        runpy.run_module('pokemon_battle', run_name='__main__')
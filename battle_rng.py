@@ -0,0 +1,86 @@
+# Per-battle random streams
+#
+# Every random draw of a battle has a fixed address: the opening coin flip,
+# then four rolls per turn (the start-of-turn status coin, the confusion
+# coin, the miss roll and the status ability roll), whether or not the turn
+# uses them. A draw is a pure function of the battle's key and that address,
+# so nothing is shared between battles: any battle can be replayed from
+# (seed, battle_id) alone, workers need no coordination, and a batch
+# simulator can compute the rolls of a whole turn of many battles as one
+# array (battle_sim does exactly that and plays the same battles).
+#
+# The function is SplitMix64: the key plus (counter + 1) times a fixed odd
+# constant, scrambled by its 64-bit finalizer.
+
+import random
+
+MASK = (1 << 64) - 1
+GAMMA = 0x9E3779B97F4A7C15
+MIX1 = 0xBF58476D1CE4E5B9
+MIX2 = 0x94D049BB133111EB
+
+# Kinds of roll drawn on every turn
+ROLL_STATUS = 0
+ROLL_CONFUSION = 1
+ROLL_MISS = 2
+ROLL_ABILITY = 3
+ROLLS_PER_TURN = 4
+
+# Draws made before the first turn: picking the rival (by the game) and the
+# coin flip for who goes first
+MATCHUP_ROLL = 0
+OPENING_ROLL = 1
+FIRST_TURN_ROLL = 2
+
+
+def mix64(z):
+    z = (z ^ (z >> 30)) * MIX1 & MASK
+    z = (z ^ (z >> 27)) * MIX2 & MASK
+    return z ^ (z >> 31)
+
+
+# The 64-bit key of one battle's stream
+def stream_key(seed, battle_id):
+    return mix64((mix64(seed & MASK) + battle_id * GAMMA) & MASK)
+
+
+# The counter of one roll of a turn, counting turns from 0
+def turn_counter(turn, roll):
+    return FIRST_TURN_ROLL + turn * ROLLS_PER_TURN + roll
+
+
+# The random stream of one battle
+class BattleStream:
+
+    def __init__(self, seed=None, battle_id=0):
+        self.seed = random.getrandbits(64) if seed is None else seed & MASK
+        self.battle_id = battle_id
+        self.key = stream_key(self.seed, battle_id)
+
+    # A float in [0, 1) for a counter, with 53 random bits
+    def uniform(self, counter):
+        return (mix64((self.key + (counter + 1) * GAMMA) & MASK) >> 11) * 2.0 ** -53
+
+
+# The stream of a battle seen from the other side, with the fighters swapped:
+# the opening coin lands the other way and every other roll is the same,
+# since turn rolls are addressed by turn, not by side
+class MirroredStream(BattleStream):
+
+    def uniform(self, counter):
+        roll = BattleStream.uniform(self, counter)
+        if counter == OPENING_ROLL:
+            return roll - 0.5 if roll >= 0.5 else roll + 0.5
+        return roll
+
+
+# Draws from any random.Random-like generator in call order instead, for
+# callers that want one shared sequential stream; battles using it cannot be
+# replayed from a seed
+class SequentialStream:
+
+    def __init__(self, rng=random):
+        self.rng = rng
+
+    def uniform(self, counter):
+        return self.rng.random()
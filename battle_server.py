@@ -0,0 +1,689 @@
+# Networked battle server
+#
+# The server alone applies the battle rules: clients only send the potions
+# they drink before each attack (see battle_protocol), and every action is
+# checked against the real battle before it is played. A session joins with
+# a species from the roster and either another player, matched first come
+# first served, or one of the AI difficulties, which the server plays. All
+# state lives on the Server, its Sessions and their ServerMatches, so any
+# number of servers can run side by side.
+#
+# One asyncio process holds thousands of sessions; to use every core a
+# supervisor forks worker processes, each an independent Server over its own
+# shard of the sessions. The supervisor accepts every connection, reads its
+# HELLO and hands the socket to the worker its session id hashes to, so a
+# session always lands on the same worker. Worker 0 also matches players:
+# any other worker hands a session that joins against a player back to the
+# supervisor, which passes it on to worker 0. Once worker 0 has paired two
+# sessions it hands both back again, and the supervisor deals each pair to
+# the workers in turn, so battles between players spread over every core
+# and worker 0 is left with little more than the queue. AI decisions that
+# search ahead run on a pool local to each worker, off its event loop; greedy
+# ones are played inline. Where processes cannot be forked or sockets passed
+# between them (Windows, macOS), the server runs in a single process.
+#
+# Every battle draws from the server seed and its battle id, unique across
+# workers, so it can be written to a replay log (one per worker, suffixed
+# with its number):
+#
+#     python battle_server.py [--host 0.0.0.0] [--port 8770] [--workers N] [--seed N] [--replays log]
+#
+# Point the game at it with POKEMON_BATTLE_SERVER=host:port, or load it with
+# battle_swarm.py.
+
+import argparse
+import asyncio
+import os
+import random
+import selectors
+import signal
+import socket
+import time
+import traceback
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from battle_ai import DIFFICULTIES, fighter_spec, make_policy
+from battle_engine import ROSTER, PLAYER, ACTION_POTION, Battle, Fighter, greedy_policy
+from battle_protocol import (
+    JOIN, ACTION, LEAVE, HELLO, WAITING, LEFT, ERROR, OPPONENT_PLAYER, MAX_MESSAGE, LENGTH, ACTION_MESSAGE,
+    SESSION_ID, BAD_MESSAGE, message, match_message, turn_message, join_message, unpack_join, read_message,
+    split_messages,
+)
+from battle_replay import NO_ACTION, ReplayRecorder, ReplayWriter
+from battle_rng import BattleStream
+from battle_solver import battle_state
+
+DEFAULT_PORT = 8770
+
+# how often the server prints its counters and flushes its replay log, in seconds
+report_interval = 10
+
+# how long the supervisor waits for a new connection's HELLO, in seconds
+hello_timeout = 5
+
+# a restarted worker skips the battle ids of all that came before it in its
+# place, 2 ** BATTLE_ID_BITS each
+BATTLE_ID_BITS = 40
+
+# the worker that matches players with each other
+MATCHMAKING_WORKER = 0
+
+# every connection opens with a HELLO: its framing, then the session id
+HELLO_PREFIX = LENGTH.pack(1 + SESSION_ID.size) + bytes((HELLO,))
+HELLO_SIZE = len(HELLO_PREFIX) + SESSION_ID.size
+
+# the most one message between the supervisor and a worker carries: the
+# JOINs of a matched pair, with up to one socket each
+CHANNEL_MESSAGE = 2 * (LENGTH.size + MAX_MESSAGE)
+CHANNEL_FDS = 2
+
+
+# One search policy per difficulty in each process of an AI pool, so its
+# solvers and tables are reused by every battle the pool decides
+_pool_policies = {}
+
+
+# How many potions a search difficulty drinks from a state whose status check
+# has passed, or None if no search finished in time; runs on the AI pool
+def decide(difficulty, specs, code):
+    policy = _pool_policies.get(difficulty)
+    if policy is None:
+        policy = _pool_policies[difficulty] = make_policy(difficulty)
+    if specs not in policy.solvers:
+        policy.prepare_matchup(specs)
+    return policy.choose(specs, code)
+
+
+# The roster spec of a species by name, or None
+def find_spec(name):
+    return next((spec for spec in ROSTER if spec[0].lower() == name.lower()), None)
+
+
+# One connected client
+class Session:
+
+    __slots__ = ('writer', 'spec', 'match', 'side')
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.spec = None
+        self.match = None
+        self.side = PLAYER
+
+    def send(self, data):
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+
+# One battle between two sides; a side without a session is played by the
+# server at its AI difficulty
+class ServerMatch:
+
+    def __init__(self, server, sessions, specs, difficulties):
+        self.server = server
+        self.sessions = sessions
+        self.difficulties = difficulties
+        self.closed = False
+        battle_id = server.next_battle_id
+        server.next_battle_id += server.battle_id_step
+        self.battle = Battle(Fighter(*specs[0]), Fighter(*specs[1]), BattleStream(server.seed, battle_id))
+        self.recorder = ReplayRecorder(self.battle) if server.replay_writer else None
+
+        for side, session in enumerate(sessions):
+            if session:
+                session.match = self
+                session.side = side
+                session.send(match_message(server.seed, battle_id, side, specs))
+        server.matches += 1
+
+        self.battle.start()
+        self.advance()
+
+    # Play turns until the battle ends or waits for a player's action or for
+    # the AI pool
+    def advance(self):
+        battle = self.battle
+        while battle.winner is None:
+            if not battle.turn_started:
+                battle.start_turn()
+                if not battle.can_act:
+                    self.broadcast(NO_ACTION)
+                    continue
+            difficulty = self.difficulties[battle.turn]
+            if difficulty is None:
+                return
+            potions = self.server.choose(self, difficulty)
+            if potions is None:
+                return
+            self.play(potions)
+        self.finish()
+
+    # Play the AI's turn once the pool has decided it; greedy play stands in
+    # for a search that ran out of time
+    def resume(self, future):
+        if self.closed or future.cancelled():
+            return
+        potions = future.result()
+        if potions is None:
+            potions = greedy_policy(self.battle).count(ACTION_POTION)
+        self.play(potions)
+        self.advance()
+
+    # The active side drinks potions, then attacks
+    def play(self, potions):
+        battle = self.battle
+        for _ in range(potions):
+            battle.use_potion()
+        battle.attack()
+        self.broadcast(potions)
+
+    def broadcast(self, action):
+        self.server.turns += 1
+        for side, session in enumerate(self.sessions):
+            if session:
+                session.send(turn_message(self.battle, action, side))
+
+    # A player's action, played if it is theirs to take
+    def act(self, session, turn, potions):
+        battle = self.battle
+        fighter = battle.fighters[session.side]
+        if (battle.winner is not None or battle.turn != session.side or not battle.can_act
+                or turn != battle.turns or potions > fighter.num_potions):
+            session.send(message(ERROR, f'Action not allowed on turn {battle.turns}'.encode()))
+            return
+        self.play(potions)
+        self.advance()
+
+    def finish(self):
+        if self.recorder:
+            self.server.replay_writer.write(self.recorder.record(self.battle))
+        self.close()
+
+    # Detach both sessions; the one still playing is told when the other left
+    def close(self, leaver=None):
+        self.closed = True
+        for session in self.sessions:
+            if session and session.match is self:
+                session.match = None
+                if leaver and session is not leaver:
+                    session.send(message(LEFT))
+        self.server.matches -= 1
+        self.server.finished += 1
+
+
+class Server:
+
+    # Battle ids count up from first_battle_id in steps of battle_id_step, so
+    # workers sharing a seed never play the same battle
+    def __init__(self, seed=None, replay_writer=None, ai_pool=None, first_battle_id=0, battle_id_step=1,
+                 name='server'):
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.replay_writer = replay_writer
+        self.ai_pool = ai_pool
+        self.next_battle_id = first_battle_id
+        self.battle_id_step = battle_id_step
+        self.name = name
+
+        # sessions waiting for another player, oldest first
+        self.waiting = deque()
+
+        # on a worker that does not match players: hands a session joining
+        # against a player over to the one that does, given its writer and
+        # JOIN; returns whether it did
+        self.matchmaker = None
+
+        # on the worker that matches players: hands a pair of sessions over
+        # to the worker that is to play their battle, given them and their
+        # JOINs; returns whether it did
+        self.dealer = None
+
+        # policies played inline, one per difficulty
+        self.policies = {}
+
+        # counters for the report
+        self.sessions = 0
+        self.matches = 0
+        self.finished = 0
+        self.turns = 0
+
+    # The number of potions an AI difficulty drinks before attacking, or None
+    # when the decision went to the AI pool and the match resumes once it is
+    # made
+    def choose(self, match, difficulty):
+        battle = match.battle
+        if DIFFICULTIES[difficulty] is None or self.ai_pool is None:
+            if difficulty not in self.policies:
+                self.policies[difficulty] = make_policy(difficulty)
+            return self.policies[difficulty](battle).count(ACTION_POTION)
+
+        specs = tuple(fighter_spec(f) for f in battle.fighters)
+        future = asyncio.wrap_future(self.ai_pool.submit(decide, difficulty, specs, battle_state(battle)))
+        future.add_done_callback(match.resume)
+        return None
+
+    # Serve a connection until it closes or is handed over; received is what
+    # was already read from it
+    async def serve(self, reader, writer, received=b'', session=None):
+        session = session or Session(writer)
+        self.sessions += 1
+        try:
+            for type, payload in split_messages(received):
+                if self.handle(session, type, payload):
+                    return
+            while True:
+                type, payload = await read_message(reader)
+                if self.handle(session, type, payload):
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError) + BAD_MESSAGE:
+            pass
+        finally:
+            self.leave(session)
+            self.sessions -= 1
+            writer.close()
+
+    # Act on a message from a session. Returns True once the session was
+    # handed over to another worker.
+    def handle(self, session, type, payload):
+        if type == JOIN:
+            name, opponent = unpack_join(payload)
+            if (opponent == OPPONENT_PLAYER and self.matchmaker and not session.match
+                    and self.matchmaker(session.writer, message(JOIN, payload))):
+                return True
+            if self.join(session, name, opponent):
+                return True
+        elif type == ACTION and session.match:
+            session.match.act(session, *ACTION_MESSAGE.unpack(payload))
+        elif type == LEAVE:
+            self.leave(session)
+        return False
+
+    # Serve a connection the supervisor handed over with what it read from it
+    async def adopt(self, sock, received):
+        try:
+            reader, writer = await asyncio.open_connection(sock=sock)
+        except OSError:
+            sock.close()
+            return
+        await self.serve(reader, writer, received)
+
+    # Play a battle between the two sessions the matching worker paired, on
+    # the sockets the supervisor handed over with their JOINs, and serve both
+    async def adopt_pair(self, socks, joins):
+        streams = []
+        for sock in socks:
+            try:
+                streams.append(await asyncio.open_connection(sock=sock))
+            except OSError:
+                sock.close()
+        if len(streams) < len(socks):
+            for reader, writer in streams:
+                writer.close()
+            return
+
+        sessions = [Session(writer) for reader, writer in streams]
+        for session, (type, payload) in zip(sessions, split_messages(joins)):
+            session.spec = find_spec(unpack_join(payload)[0])
+        ServerMatch(self, sessions, tuple(session.spec for session in sessions), (None, None))
+        await asyncio.gather(*(self.serve(reader, writer, session=session)
+                               for (reader, writer), session in zip(streams, sessions)))
+
+    # Start a battle for a session against an AI difficulty, or queue it for
+    # the next player who joins. Returns True if the session was paired and
+    # handed over with its rival to the worker playing their battle.
+    def join(self, session, name, opponent):
+        spec = find_spec(name)
+        if spec is None or (opponent != OPPONENT_PLAYER and opponent not in DIFFICULTIES):
+            session.send(message(ERROR, f'Cannot join with {name} against {opponent}'.encode()))
+            return
+        if session.match or session in self.waiting:
+            session.send(message(ERROR, b'Already joined'))
+            return
+        session.spec = spec
+
+        if opponent != OPPONENT_PLAYER:
+            rival = random.choice([rival for rival in ROSTER if rival != spec])
+            ServerMatch(self, (session, None), (spec, rival), (None, opponent))
+        elif self.waiting:
+            other = self.waiting.popleft()
+            joins = join_message(other.spec[0], OPPONENT_PLAYER) + join_message(spec[0], OPPONENT_PLAYER)
+            if self.dealer and self.dealer((other, session), joins):
+                # stop serving the rival here too; the socket lives on in
+                # the worker that now serves it
+                other.writer.close()
+                return True
+            ServerMatch(self, (other, session), (other.spec, spec), (None, None))
+        else:
+            self.waiting.append(session)
+            session.send(message(WAITING))
+
+    def leave(self, session):
+        if session in self.waiting:
+            self.waiting.remove(session)
+        if session.match:
+            session.match.close(leaver=session)
+
+    async def report(self):
+        last_turns, last_time = self.turns, time.perf_counter()
+        while True:
+            await asyncio.sleep(report_interval)
+            now = time.perf_counter()
+            print(f'{self.name}: {self.sessions} sessions, {len(self.waiting)} waiting, {self.matches} battles, '
+                  f'{self.finished} finished, {(self.turns - last_turns) / (now - last_time):,.0f} turns/s',
+                  flush=True)
+            last_turns, last_time = self.turns, now
+            if self.replay_writer:
+                self.replay_writer.flush()
+
+
+# Serve every connection the supervisor sends down channel until it closes.
+# Unless matchmaking, send sessions joining against a player back up it;
+# when matchmaking, send every pair made back up it to be dealt to a worker.
+async def adopt_connections(server, channel, matchmaking):
+    loop = asyncio.get_running_loop()
+    closed = loop.create_future()
+    channel.setblocking(False)
+
+    # the loop only holds its tasks weakly
+    adopting = set()
+
+    def receive():
+        while True:
+            try:
+                data, fds, flags, address = socket.recv_fds(channel, CHANNEL_MESSAGE, CHANNEL_FDS)
+            except BlockingIOError:
+                return
+            if not fds:
+                loop.remove_reader(channel)
+                closed.set_result(None)
+                return
+            socks = [socket.socket(fileno=fd) for fd in fds]
+            if len(socks) > 1:
+                task = loop.create_task(server.adopt_pair(socks, data))
+            else:
+                task = loop.create_task(server.adopt(socks[0], data))
+            adopting.add(task)
+            task.add_done_callback(adopting.discard)
+
+    # the supervisor holds its own reference to the socket once it is sent,
+    # so closing this worker's does not end the connection
+    def hand_over(writer, join):
+        try:
+            socket.send_fds(channel, [join], [writer.get_extra_info('socket').fileno()])
+        except OSError:
+            return False
+        return True
+
+    def deal(sessions, joins):
+        try:
+            socket.send_fds(channel, [joins], [session.writer.get_extra_info('socket').fileno()
+                                               for session in sessions])
+        except OSError:
+            return False
+        return True
+
+    if matchmaking:
+        server.dealer = deal
+    else:
+        server.matchmaker = hand_over
+    loop.add_reader(channel, receive)
+    await closed
+
+
+# Run one Server: on its own listener, or as worker index of workers on the
+# connections the supervisor sends down channel, after restarts earlier
+# workers in its place. Searching AI difficulties decide on ai_processes
+# processes, or on one thread when there are none.
+async def run(host, port, seed=None, replays=None, ai_processes=0, channel=None, index=0, workers=1, restarts=0):
+    replay_writer = ReplayWriter(replays) if replays else None
+    ai_pool = ProcessPoolExecutor(ai_processes) if ai_processes else ThreadPoolExecutor(1)
+    name = f'worker {index}' if channel else 'server'
+    first_battle_id = index + workers * (restarts << BATTLE_ID_BITS)
+    server = Server(seed, replay_writer, ai_pool, first_battle_id, workers, name)
+    report = asyncio.create_task(server.report())
+    try:
+        if channel:
+            await adopt_connections(server, channel, index == MATCHMAKING_WORKER)
+        else:
+            listener = await asyncio.start_server(server.serve, host, port, backlog=4096)
+            print(f'Serving battles on {host}:{port} (seed {server.seed})', flush=True)
+            async with listener:
+                await listener.serve_forever()
+    finally:
+        report.cancel()
+        ai_pool.shutdown(cancel_futures=True)
+        if replay_writer:
+            replay_writer.close()
+
+
+# The replay log of one worker
+def worker_replays(replays, index):
+    return f'{replays}.{index}' if replays else None
+
+
+# Whether this platform can fork workers and pass sockets to them
+def can_fork_workers():
+    if not hasattr(os, 'fork') or not hasattr(socket, 'send_fds'):
+        return False
+    try:
+        pair = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    except (AttributeError, OSError):
+        return False
+    for sock in pair:
+        sock.close()
+    return True
+
+
+# Forks the workers, routes each connection to one by its session id, passes
+# on sessions joining against a player to the matchmaking worker, deals the
+# pairs it makes to the workers in turn and replaces any worker that dies
+class Supervisor:
+
+    def __init__(self, host, port, workers, seed=None, replays=None, ai_processes=0):
+        self.seed = random.getrandbits(64) if seed is None else seed
+        self.replays = replays
+        self.ai_processes = ai_processes
+        self.listener = socket.create_server((host, port), backlog=4096)
+        self.listener.setblocking(False)
+        # every registered socket carries what to call when it is readable
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, self.accept)
+
+        # per worker: its pid and the channel its connections go down, and
+        # how many times it was restarted
+        self.workers = [None] * workers
+        self.restarts = [0] * workers
+
+        # the worker the next pair of players is dealt to
+        self.next_dealt = 0
+
+        # connections still reading their HELLO: socket -> (bytes so far,
+        # when it was accepted)
+        self.pending = {}
+
+        for index in range(workers):
+            self.spawn(index)
+        print(f'Serving battles on {host}:{port} with {workers} workers (seed {self.seed})', flush=True)
+
+    def spawn(self, index):
+        channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        pid = os.fork()
+        if pid:
+            worker_channel.close()
+            self.workers[index] = (pid, channel)
+            self.selector.register(channel, selectors.EVENT_READ, self.pass_on)
+            return
+
+        # the worker keeps nothing of the supervisor but its own channel
+        status = 0
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            channel.close()
+            self.selector.close()
+            self.listener.close()
+            for sock in self.pending:
+                sock.close()
+            for worker in self.workers:
+                if worker:
+                    worker[1].close()
+            replays = worker_replays(self.replays, index)
+            asyncio.run(run(None, None, self.seed, replays, self.ai_processes, worker_channel, index,
+                            len(self.workers), self.restarts[index]))
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def serve_forever(self):
+        while True:
+            for key, events in self.selector.select(timeout=1):
+                key.data(key.fileobj)
+            self.expire()
+            self.reap()
+
+    def accept(self, listener):
+        while True:
+            try:
+                sock, address = listener.accept()
+            except OSError:
+                return
+            sock.setblocking(False)
+            self.pending[sock] = (b'', time.monotonic())
+            self.selector.register(sock, selectors.EVENT_READ, self.read_hello)
+
+    def read_hello(self, sock):
+        data, accepted = self.pending[sock]
+        try:
+            received = sock.recv(HELLO_SIZE - len(data))
+        except BlockingIOError:
+            return
+        except OSError:
+            received = b''
+        data += received
+        if not received or not HELLO_PREFIX.startswith(data[:len(HELLO_PREFIX)]):
+            self.drop(sock)
+        elif len(data) == HELLO_SIZE:
+            self.send(zlib.crc32(data[len(HELLO_PREFIX):]) % len(self.workers), [sock.fileno()], data)
+            self.drop(sock)
+        else:
+            self.pending[sock] = (data, accepted)
+
+    # A worker sent back a session joining against a player, or the matching
+    # worker a pair of them to play each other, with their JOINs
+    def pass_on(self, channel):
+        try:
+            joins, fds, flags, address = socket.recv_fds(channel, CHANNEL_MESSAGE, CHANNEL_FDS)
+        except OSError:
+            return
+        if len(fds) > 1:
+            self.send(self.next_dealt, fds, joins)
+            self.next_dealt = (self.next_dealt + 1) % len(self.workers)
+        elif fds:
+            self.send(MATCHMAKING_WORKER, fds, joins)
+        for fd in fds:
+            os.close(fd)
+        if not fds:
+            # the worker is gone; reap restarts it
+            self.selector.unregister(channel)
+
+    # Hand connections to a worker with what was read from them; the worker
+    # gets its own copy of each socket, so the caller closes its own
+    def send(self, index, fds, received):
+        pid, channel = self.workers[index]
+        try:
+            socket.send_fds(channel, [received], fds)
+        except OSError as error:
+            print(f'Could not hand a connection to worker {index}: {error}', flush=True)
+
+    def drop(self, sock):
+        self.selector.unregister(sock)
+        del self.pending[sock]
+        sock.close()
+
+    # Drop connections that never finished their HELLO
+    def expire(self):
+        now = time.monotonic()
+        for sock, (data, accepted) in list(self.pending.items()):
+            if now - accepted > hello_timeout:
+                self.drop(sock)
+
+    # Restart workers that exited; the sessions they held are lost
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            for index, (worker_pid, channel) in enumerate(self.workers):
+                if worker_pid == pid:
+                    print(f'worker {index} exited with status {status}; restarting it', flush=True)
+                    if channel.fileno() in self.selector.get_map():
+                        self.selector.unregister(channel)
+                    channel.close()
+                    self.restarts[index] += 1
+                    self.spawn(index)
+
+    # Close every channel, which stops its worker, then wait for them all
+    def stop(self):
+        for pid, channel in self.workers:
+            channel.close()
+        for pid, channel in self.workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve networked battles.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes, each serving a shard of the sessions (default: one per core; '
+                             '1 serves in this process)')
+    parser.add_argument('--ai-processes', type=int, default=0,
+                        help='processes per worker for AI search (default: one thread)')
+    parser.add_argument('--seed', type=int, help='server seed (default: random)')
+    parser.add_argument('--replays', help='replay log to append every battle to')
+    args = parser.parse_args()
+
+    if args.workers > 1 and not can_fork_workers():
+        print('Worker processes are not supported here; serving in a single process', flush=True)
+        args.workers = 1
+
+    # a worker that cannot open its replay log would only be restarted over
+    # and over, so every log is checked up front
+    if args.replays:
+        paths = [args.replays] if args.workers <= 1 else [worker_replays(args.replays, i) for i in range(args.workers)]
+        try:
+            for path in paths:
+                ReplayWriter(path).close()
+        except (OSError, ValueError) as error:
+            parser.error(f'cannot append to the replay log: {error}')
+
+    if args.workers <= 1:
+        try:
+            asyncio.run(run(args.host, args.port, args.seed, args.replays, args.ai_processes))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    # stop the workers when terminated, as on Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    supervisor = Supervisor(args.host, args.port, args.workers, args.seed, args.replays, args.ai_processes)
+    try:
+        supervisor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
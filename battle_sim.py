@@ -0,0 +1,243 @@
+# Lockstep NumPy simulator for very many battles at once
+#
+# N battles are held as structure-of-arrays (HP, status, potions and whose
+# turn it is, one row per side) and every step advances all unfinished
+# battles by one turn. The rules are the ones in battle_engine, with both
+# sides playing greedy_policy. Each battle draws from its battle_rng stream,
+# computed for every battle and every roll of a turn as one block, so battle
+# i of a seed is the very battle the engine plays with BattleStream(seed, i).
+# Run as a script to print the win-rate matrix of the roster:
+#
+#     python battle_sim.py [battles per matchup] [seed]
+
+import random
+import sys
+import time
+
+import numpy as np
+
+import battle_rng
+import type_chart
+from battle_engine import (
+    ROSTER, PLAYER, RIVAL,
+    STATUS_NONE, STATUS_BURN, STATUS_PARALYSIS, STATUS_POISON, STATUS_SLEEP, STATUS_CONFUSION,
+)
+
+# Per-species tables, indexed by roster position
+MAX_HP = np.array([spec[2] for spec in ROSTER])
+ABILITY = np.array([spec[4] or STATUS_NONE for spec in ROSTER])
+
+# The type chart's damage bonuses as a (attacking type, defending types) view
+TYPE_BONUS = np.frombuffer(type_chart.BONUS, dtype=np.int8).reshape(len(type_chart.TYPES), -1)
+
+# Per-species type chart indexes and base attack
+ATTACKING_TYPE, DEFENDING_TYPES = np.array([type_chart.parse_types(spec[1]) for spec in ROSTER]).T
+ATTACK = np.array([spec[3] for spec in ROSTER])
+
+# DAMAGE[i, j] is how much species i deals to species j on a hit, looked up
+# for every pair at once
+DAMAGE = np.maximum(
+    ATTACK[:, None] + TYPE_BONUS[ATTACKING_TYPE[:, None], DEFENDING_TYPES[None, :]],
+    type_chart.MIN_DAMAGE,
+)
+
+# Chance that a landed hit also applies the attacker's status ability
+ABILITY_CHANCE = np.zeros(STATUS_CONFUSION + 1)
+ABILITY_CHANCE[STATUS_BURN] = 1 / 2
+ABILITY_CHANCE[STATUS_POISON] = 1
+ABILITY_CHANCE[STATUS_PARALYSIS] = 1 / 2
+ABILITY_CHANCE[STATUS_SLEEP] = 3 / 4
+ABILITY_CHANCE[STATUS_CONFUSION] = 1
+
+# Extra damage dealt when a status ability lands
+ABILITY_DAMAGE = np.zeros(STATUS_CONFUSION + 1, dtype=np.int64)
+ABILITY_DAMAGE[STATUS_BURN] = 20
+ABILITY_DAMAGE[STATUS_POISON] = 10
+
+# Damage taken at the end of a turn for each status
+STATUS_DAMAGE = np.zeros(STATUS_CONFUSION + 1, dtype=np.int64)
+STATUS_DAMAGE[STATUS_BURN] = 20
+STATUS_DAMAGE[STATUS_POISON] = 10
+
+# Battles still running after this many turns are reported as undecided
+MAX_TURNS = 1000
+
+# Counters of the rolls of a turn, in battle_rng order
+TURN_ROLLS = np.arange(battle_rng.ROLLS_PER_TURN, dtype=np.uint64)
+
+
+# battle_rng.mix64 over an array of uint64 (which wraps like the masked ints)
+def mix64(z):
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(battle_rng.MIX1)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(battle_rng.MIX2)
+    return z ^ (z >> np.uint64(31))
+
+
+# battle_rng.stream_key for many battle ids of one seed
+def stream_keys(seed, battle_ids):
+    base = np.uint64(battle_rng.mix64(seed & battle_rng.MASK))
+    return mix64(base + np.asarray(battle_ids, dtype=np.uint64) * np.uint64(battle_rng.GAMMA))
+
+
+# BattleStream.uniform for every counter of every battle: one row per counter
+def stream_rolls(keys, counters):
+    z = keys[None, :] + (counters[:, None] + np.uint64(1)) * np.uint64(battle_rng.GAMMA)
+    return (mix64(z) >> np.uint64(11)) * 2.0 ** -53
+
+
+# The state of N battles, one column per battle and one row per side
+class BattleArrays:
+
+    def __init__(self, player_species, rival_species, keys):
+        n = len(player_species)
+        self.keys = keys
+        self.species = np.array([player_species, rival_species])
+        self.hp = MAX_HP[self.species]
+        self.status = np.full((2, n), STATUS_NONE, dtype=np.int8)
+        self.potions = np.full((2, n), 2, dtype=np.int8)
+        self.turn = np.zeros(n, dtype=np.int8)
+        self.winner = np.full(n, -1, dtype=np.int8)
+
+    # Apply status damage at the END of the turn for the given (side, battle) pairs
+    def end_of_turn(self, sides, rows):
+        status = self.status[sides, rows]
+        hp = self.hp[sides, rows] - STATUS_DAMAGE[status]
+        self.hp[sides, rows] = np.maximum(hp, 0)
+
+        # Paralysis wears off at end of turn
+        status[status == STATUS_PARALYSIS] = STATUS_NONE
+        self.status[sides, rows] = status
+
+    # Advance every unfinished battle by one turn, the given turn of each
+    def step(self, turn):
+        rows = np.flatnonzero(self.winner < 0)
+        active = self.turn[rows]
+        other = 1 - active
+        counters = TURN_ROLLS + np.uint64(battle_rng.turn_counter(turn, 0))
+        rolls = stream_rolls(self.keys[rows], counters)
+        heads = rolls[battle_rng.ROLL_STATUS] < 0.5
+
+        # Check status at START of turn
+        status = self.status[active, rows]
+        can_act = np.ones(rows.size, dtype=bool)
+        paralyzed = status == STATUS_PARALYSIS
+        can_act[paralyzed] = False
+        status[paralyzed] = STATUS_NONE
+        status[(status == STATUS_BURN) & heads] = STATUS_NONE
+        asleep = status == STATUS_SLEEP
+        can_act[asleep & ~heads] = False
+        status[asleep & heads] = STATUS_NONE
+        self.status[active, rows] = status
+
+        # A side that cannot act passes; both sides take end-of-turn damage
+        passed = ~can_act
+        self.end_of_turn(other[passed], rows[passed])
+        self.end_of_turn(active[passed], rows[passed])
+
+        rows_a = rows[can_act]
+        active_a = active[can_act]
+        other_a = other[can_act]
+        rolls_a = rolls[:, can_act]
+        attacker = self.species[active_a, rows_a]
+        defender = self.species[other_a, rows_a]
+
+        # AI decision: use potion if low HP
+        hp = self.hp[active_a, rows_a]
+        drink = (MAX_HP[attacker] - hp >= 50) & (self.potions[active_a, rows_a] > 0)
+        sides, drinkers = active_a[drink], rows_a[drink]
+        self.hp[sides, drinkers] = np.minimum(hp[drink] + 50, MAX_HP[attacker[drink]])
+        self.potions[sides, drinkers] -= 1
+        self.status[sides, drinkers] = STATUS_NONE
+
+        # Confusion: flip a coin; tails misses and the defender takes its status damage
+        confused = self.status[active_a, rows_a] == STATUS_CONFUSION
+        self.status[active_a[confused], rows_a[confused]] = STATUS_NONE
+        fumbled = confused & (rolls_a[battle_rng.ROLL_CONFUSION] >= 0.5)
+        self.end_of_turn(other_a[fumbled], rows_a[fumbled])
+
+        # Missed attack (25% chance); a burned or poisoned defender still takes damage
+        missed = ~fumbled & (rolls_a[battle_rng.ROLL_MISS] < 0.25)
+        defender_status = self.status[other_a, rows_a]
+        hurt = missed & ((defender_status == STATUS_BURN) | (defender_status == STATUS_POISON))
+        self.end_of_turn(other_a[hurt], rows_a[hurt])
+
+        # Landed hits deal damage, then maybe apply the attacker's status ability
+        hit = ~fumbled & ~missed
+        sides, targets = other_a[hit], rows_a[hit]
+        ability = ABILITY[attacker[hit]]
+        lands = rolls_a[battle_rng.ROLL_ABILITY][hit] < ABILITY_CHANCE[ability]
+        damage = DAMAGE[attacker[hit], defender[hit]] + ABILITY_DAMAGE[ability] * lands
+        self.hp[sides, targets] = np.maximum(self.hp[sides, targets] - damage, 0)
+        self.status[sides[lands], targets[lands]] = ability[lands]
+
+        # Apply the attacker's status damage unless the defender fainted or is paralyzed
+        tail = (self.hp[other_a, rows_a] > 0) & (self.status[other_a, rows_a] != STATUS_PARALYSIS)
+        self.end_of_turn(active_a[tail], rows_a[tail])
+
+        # A fainted rival is checked first, as in Battle._end_turn
+        rival_down = self.hp[RIVAL, rows] == 0
+        player_down = ~rival_down & (self.hp[PLAYER, rows] == 0)
+        self.winner[rows[rival_down]] = PLAYER
+        self.winner[rows[player_down]] = RIVAL
+        self.turn[rows] = other
+
+    def run(self):
+        # Coin flip to see who goes first
+        opening = np.array([battle_rng.OPENING_ROLL], dtype=np.uint64)
+        self.turn[:] = stream_rolls(self.keys, opening)[0] >= 0.5
+        for turn in range(MAX_TURNS):
+            if (self.winner >= 0).all():
+                break
+            self.step(turn)
+        return self.winner
+
+
+# Simulate one battle per (player, rival) pair of roster indexes and return
+# the winning side of each (-1 if it did not finish). The battles get the
+# streams of ids first_id, first_id + 1, ... of the seed.
+def simulate(player_species, rival_species, seed=None, first_id=0):
+    if seed is None:
+        seed = random.getrandbits(64)
+    keys = stream_keys(seed, np.arange(first_id, first_id + len(player_species)))
+    return BattleArrays(player_species, rival_species, keys).run()
+
+
+# Player win rate for every (player, rival) matchup of the roster. Battles
+# are run in batches of at most batch_size to keep memory bounded; battle
+# ids count up through the matchups in order.
+def matchup_matrix(battles_per_matchup=100000, seed=None, batch_size=1 << 20):
+    if seed is None:
+        seed = random.getrandbits(64)
+
+    n = len(ROSTER)
+    pairs = [(i, j) for i in range(n) for j in range(n) if i != j]
+    players = np.repeat([i for i, j in pairs], battles_per_matchup)
+    rivals = np.repeat([j for i, j in pairs], battles_per_matchup)
+
+    wins = np.zeros((n, n))
+    for start in range(0, players.size, batch_size):
+        batch_players = players[start:start + batch_size]
+        batch_rivals = rivals[start:start + batch_size]
+        winners = simulate(batch_players, batch_rivals, seed, start)
+        np.add.at(wins, (batch_players, batch_rivals), winners == PLAYER)
+
+    matrix = wins / battles_per_matchup
+    np.fill_diagonal(matrix, np.nan)
+    return matrix
+
+
+if __name__ == '__main__':
+    battles_per_matchup = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else random.getrandbits(64)
+
+    start = time.perf_counter()
+    matrix = matchup_matrix(battles_per_matchup, seed)
+    elapsed = time.perf_counter() - start
+    total = battles_per_matchup * len(ROSTER) * (len(ROSTER) - 1)
+
+    names = [spec[0] for spec in ROSTER]
+    print('Player win rate (rows: player, columns: rival)')
+    print(' ' * 10 + ''.join(f'{name:>10}' for name in names))
+    for name, row in zip(names, matrix):
+        print(f'{name:<10}' + ''.join('       ---' if np.isnan(rate) else f'{rate:10.3f}' for rate in row))
+    print(f'{total} battles (seed {seed}) in {elapsed:.1f} s ({total / elapsed * 60:,.0f} battles per minute)')
@@ -0,0 +1,308 @@
+# Exact win probabilities for a matchup, solved as a Markov chain
+#
+# A battle at the start of a turn is fully described by whose turn it is and
+# both sides' HP, status and potions; with greedy_policy on both sides every
+# turn is a random transition between such states. States are packed into
+# small integers and valued with memoized dynamic programming.
+#
+# Every transition either changes no HP and no potions (a miss, a coin flip,
+# a status wearing off) or strictly lowers (potions left, total HP). So the
+# only cycles are between states that share HP and potions; those few states
+# are solved together as a small linear system, once everything they lead to
+# is solved. Run as a script to print the roster matrix:
+#
+#     python battle_solver.py
+
+import time
+
+import numpy as np
+
+from type_chart import hit_damage
+from battle_engine import (
+    ROSTER, PLAYER, RIVAL,
+    STATUS_NONE, STATUS_BURN, STATUS_PARALYSIS, STATUS_POISON, STATUS_SLEEP, STATUS_CONFUSION,
+)
+
+# Chance that a landed hit also applies each status ability, and the damage it adds
+ABILITY_CHANCE = {
+    STATUS_BURN: 1 / 2,
+    STATUS_POISON: 1,
+    STATUS_PARALYSIS: 1 / 2,
+    STATUS_SLEEP: 3 / 4,
+    STATUS_CONFUSION: 1,
+}
+ABILITY_DAMAGE = {STATUS_BURN: 20, STATUS_POISON: 10}
+
+# Bits of an encoded state that may change without HP or potions changing
+GROUP_MASK = 1 << 28 | 0o77 << 18
+
+# Most HP an encoded state can hold
+MAX_HP = 511
+
+
+# Raise ValueError for a spec whose states cannot be encoded
+def check_spec(spec):
+    if not 0 < spec[2] <= MAX_HP:
+        raise ValueError(f'{spec[0]} has {spec[2]} HP; the solver handles 1 to {MAX_HP}')
+
+
+# Pack a start-of-turn state into one integer:
+# turn (1 bit), potions (2 bits each), status (3 bits each), HP (9 bits each)
+def encode_state(turn, hp, status, potions):
+    code = turn
+    code = (code << 2 | potions[0]) << 2 | potions[1]
+    code = (code << 3 | status[0]) << 3 | status[1]
+    code = (code << 9 | hp[0]) << 9 | hp[1]
+    return code
+
+
+def decode_state(code):
+    hp = ((code >> 9) & MAX_HP, code & MAX_HP)
+    code >>= 18
+    status = ((code >> 3) & 7, code & 7)
+    code >>= 6
+    potions = ((code >> 2) & 3, code & 3)
+    return code >> 4, hp, status, potions
+
+
+# The encoded state of a Battle waiting for its next turn to start
+def battle_state(battle):
+    player, rival = battle.fighters
+    return encode_state(
+        battle.turn,
+        (player.current_hp, rival.current_hp),
+        (player.status, rival.status),
+        (player.num_potions, rival.num_potions),
+    )
+
+
+def _replace(pair, side, value):
+    return (value, pair[1]) if side == 0 else (pair[0], value)
+
+
+# Apply status damage at the END of the turn for one side
+def _end_of_turn(hp, status, side):
+    if status[side] == STATUS_BURN:
+        hp = _replace(hp, side, max(hp[side] - 20, 0))
+    elif status[side] == STATUS_POISON:
+        hp = _replace(hp, side, max(hp[side] - 10, 0))
+    elif status[side] == STATUS_PARALYSIS:
+        status = _replace(status, side, STATUS_NONE)
+    return hp, status
+
+
+# Exact solver for one (player, rival) matchup of roster specs
+class MatchupSolver:
+
+    def __init__(self, player, rival):
+        check_spec(player)
+        check_spec(rival)
+        self.max_hp = (player[2], rival[2])
+        self.ability = (player[4] or STATUS_NONE, rival[4] or STATUS_NONE)
+
+        # damage[side] is what that side deals on a hit
+        self.damage = (
+            hit_damage(player[3], player[1], rival[1])[0],
+            hit_damage(rival[3], rival[1], player[1])[0],
+        )
+
+        # encoded state -> (player win probability, expected turns left)
+        self.values = {}
+
+    # The start-of-turn status check of the active side, as a list of
+    # (probability, can act, status afterwards)
+    def status_check(self, active, status):
+        cleared = _replace(status, active, STATUS_NONE)
+        if status[active] == STATUS_PARALYSIS:
+            return [(1, False, cleared)]
+        elif status[active] == STATUS_BURN:
+            return [(1 / 2, True, cleared), (1 / 2, True, status)]
+        elif status[active] == STATUS_SLEEP:
+            return [(1 / 2, True, cleared), (1 / 2, False, status)]
+        return [(1, True, status)]
+
+    # How many potions greedy_policy drinks before attacking
+    def greedy_drink(self, active, hp, potions):
+        return 1 if self.max_hp[active] - hp[active] >= 50 and potions[active] > 0 else 0
+
+    # Every way the rest of a turn can play out once the status check is done,
+    # added to outcomes as {next state or winner: probability}. A side that
+    # can act drinks `drink` potions and attacks.
+    def play_turn(self, active, p, can_act, hp, status, potions, drink, outcomes):
+        other = 1 - active
+
+        def finish(p, hp, status):
+            if hp[RIVAL] == 0:
+                key = -1 - PLAYER
+            elif hp[PLAYER] == 0:
+                key = -1 - RIVAL
+            else:
+                key = encode_state(other, hp, status, potions)
+            outcomes[key] = outcomes.get(key, 0) + p
+
+        # Apply the attacker's status damage unless the defender fainted or is paralyzed
+        def tail(p, hp, status):
+            if hp[other] > 0 and status[other] != STATUS_PARALYSIS:
+                hp, status = _end_of_turn(hp, status, active)
+            finish(p, hp, status)
+
+        if not can_act:
+            hp, status = _end_of_turn(hp, status, other)
+            hp, status = _end_of_turn(hp, status, active)
+            finish(p, hp, status)
+            return
+
+        for _ in range(drink):
+            hp = _replace(hp, active, min(hp[active] + 50, self.max_hp[active]))
+            status = _replace(status, active, STATUS_NONE)
+            potions = _replace(potions, active, potions[active] - 1)
+
+        # Confusion: heads snaps out of it, tails misses
+        if status[active] == STATUS_CONFUSION:
+            status = _replace(status, active, STATUS_NONE)
+            fumble_hp, fumble_status = _end_of_turn(hp, status, other)
+            tail(p / 2, fumble_hp, fumble_status)
+            p /= 2
+
+        # Missed attack (25% chance)
+        if status[other] == STATUS_BURN or status[other] == STATUS_POISON:
+            miss_hp, miss_status = _end_of_turn(hp, status, other)
+        else:
+            miss_hp, miss_status = hp, status
+        tail(p / 4, miss_hp, miss_status)
+
+        hit = p * 3 / 4
+        hp = _replace(hp, other, max(hp[other] - self.damage[active], 0))
+        ability = self.ability[active]
+        if ability == STATUS_NONE:
+            tail(hit, hp, status)
+            return
+
+        chance = ABILITY_CHANCE[ability]
+        if chance < 1:
+            tail(hit * (1 - chance), hp, status)
+        landed_hp = _replace(hp, other, max(hp[other] - ABILITY_DAMAGE.get(ability, 0), 0))
+        tail(hit * chance, landed_hp, _replace(status, other, ability))
+
+    # Every way one turn can play out with both sides playing greedy_policy,
+    # as {next state or winner: probability}. Finished battles are keyed by
+    # -1 - winner.
+    def turn_outcomes(self, code):
+        turn, hp, status, potions = decode_state(code)
+        outcomes = {}
+        for p, can_act, checked in self.status_check(turn, status):
+            drink = self.greedy_drink(turn, hp, potions) if can_act else 0
+            self.play_turn(turn, p, can_act, hp, checked, potions, drink, outcomes)
+        return outcomes
+
+    # (player win probability, expected turns left) from a start-of-turn state
+    def solve(self, code):
+        if code in self.values:
+            return self.values[code]
+
+        # A chain of HP drops can be thousands of groups long, so the groups
+        # still to solve are kept on a stack rather than in recursive calls.
+        # Each is solved once every state it leads to has a value.
+        stack = [code]
+        groups = {}
+        while stack:
+            state = stack[-1]
+            if state in self.values:
+                stack.pop()
+                continue
+            if state not in groups:
+                groups[state] = self.group(state)
+            group, transitions = groups[state]
+            unsolved = [key for outcomes in transitions.values() for key in outcomes
+                        if key >= 0 and key not in transitions and key not in self.values]
+            if unsolved:
+                stack.extend(unsolved)
+                continue
+            self.solve_group(group, transitions)
+            del groups[state]
+            stack.pop()
+        return self.values[code]
+
+    # The states that share this one's HP and potions and can reach each
+    # other, and every way a turn can play out from each of them
+    def group(self, code):
+        group_key = code & ~GROUP_MASK
+        group = [code]
+        transitions = {}
+        for state in group:
+            transitions[state] = self.turn_outcomes(state)
+            for key in transitions[state]:
+                same_group = key >= 0 and key & ~GROUP_MASK == group_key
+                if same_group and key not in transitions and key not in group and key not in self.values:
+                    group.append(key)
+        return group, transitions
+
+    # Value a group of states whose outcomes outside it are all solved
+    def solve_group(self, group, transitions):
+
+        # v = P_in v + b, where b holds everything that leaves the group
+        size = len(group)
+        position = {state: i for i, state in enumerate(group)}
+        matrix = np.eye(size)
+        constants = np.zeros((size, 2))
+        for state, outcomes in transitions.items():
+            row = position[state]
+            constants[row, 1] = 1  # this turn
+            for key, p in outcomes.items():
+                if key < 0:
+                    constants[row, 0] += p if key == -1 - PLAYER else 0
+                elif key in position:
+                    matrix[row, position[key]] -= p
+                else:
+                    win, turns = self.values[key]
+                    constants[row, 0] += p * win
+                    constants[row, 1] += p * turns
+
+        solution = np.linalg.solve(matrix, constants)
+        for state, (win, turns) in zip(group, solution):
+            self.values[state] = (float(win), float(turns))
+
+    # (player win probability, expected battle length in turns) from the
+    # start of the battle, before the coin flip decides who goes first
+    def solve_start(self):
+        results = [
+            self.solve(encode_state(turn, self.max_hp, (STATUS_NONE, STATUS_NONE), (2, 2)))
+            for turn in (PLAYER, RIVAL)
+        ]
+        return tuple((a + b) / 2 for a, b in zip(*results))
+
+
+# Exact player win probability and expected length of a battle between two
+# roster specs, optionally from a mid-battle encoded state
+def solve_matchup(player, rival, state=None):
+    solver = MatchupSolver(player, rival)
+    if state is None:
+        return solver.solve_start()
+    return solver.solve(state)
+
+
+# Player win probability and expected battle length for every roster matchup
+def matchup_matrix():
+    n = len(ROSTER)
+    wins = np.full((n, n), np.nan)
+    turns = np.full((n, n), np.nan)
+    for i in range(n):
+        for j in range(n):
+            if i != j:
+                wins[i, j], turns[i, j] = solve_matchup(ROSTER[i], ROSTER[j])
+    return wins, turns
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    wins, turns = matchup_matrix()
+    elapsed = time.perf_counter() - start
+
+    names = [spec[0] for spec in ROSTER]
+    for title, matrix in (('Player win probability', wins), ('Expected battle length (turns)', turns)):
+        print(f'{title} (rows: player, columns: rival)')
+        print(' ' * 10 + ''.join(f'{name:>10}' for name in names))
+        for name, row in zip(names, matrix):
+            print(f'{name:<10}' + ''.join('       ---' if np.isnan(x) else f'{x:10.4f}' for x in row))
+        print()
+    print(f'Solved {len(names) * (len(names) - 1)} matchups in {elapsed:.2f} s')
@@ -0,0 +1,210 @@
+# Load test for the battle server: a swarm of bot clients
+#
+# Every bot holds its own connection and plays battles back to back the way
+# the game does: it joins with a random roster species, plays its side of
+# the battle with its own engine in lockstep with the server (greedy play),
+# and checks its state against every TURN. The swarm reports battles and
+# turns per second, the round trip from an ACTION to its TURN and any bot
+# that fell out of step with the server:
+#
+#     python battle_swarm.py [--clients 1000] [--duration 10] [--opponent easy|player] [--address host:port]
+#                            [--processes N] [--workers N]
+#
+# Without an address a server is started for the run on a free local port,
+# with --workers worker processes. One swarm process cannot keep several
+# server workers busy, so --processes splits the bots across that many.
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from battle_ai import DIFFICULTIES
+from battle_engine import ROSTER, PLAYER, RIVAL, ACTION_POTION, greedy_policy
+from battle_protocol import (
+    WAITING, MATCH, TURN, OPPONENT_PLAYER, BAD_MESSAGE,
+    action_message, hello_message, join_message, read_message, unpack_match, unpack_turn, match_battle,
+    turn_actions, check_turn,
+)
+
+# how long the bots take to connect, spread evenly, in seconds
+ramp_up = 1.0
+
+
+class SwarmStats:
+
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.battles = 0
+        self.turns = 0
+        self.desyncs = 0
+        self.errors = 0
+        self.round_trips = []
+
+
+# One bot: play battles until the swarm is stopped
+async def bot(host, port, opponent, stats, rng, delay):
+    await asyncio.sleep(delay)
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        stats.failed += 1
+        return
+    stats.connected += 1
+    try:
+        writer.write(hello_message(rng.getrandbits(64)))
+        while True:
+            writer.write(join_message(rng.choice(ROSTER)[0], opponent))
+            type, payload = await read_message(reader)
+            while type == WAITING:
+                type, payload = await read_message(reader)
+            if type != MATCH:
+                stats.errors += 1
+                return
+
+            battle = match_battle(unpack_match(payload))
+            battle.start()
+            while battle.winner is None:
+                side = battle.turn
+                battle.start_turn()
+                acting = battle.can_act
+                sent = None
+                if acting and side == PLAYER:
+                    potions = greedy_policy(battle).count(ACTION_POTION)
+                    writer.write(action_message(battle.turns, potions))
+                    sent = time.perf_counter()
+                    for _ in range(potions):
+                        battle.use_potion()
+                    battle.attack()
+
+                type, payload = await read_message(reader)
+                if type != TURN:
+                    # the rival left, or the server refused an action
+                    stats.errors += 1
+                    break
+                turn = unpack_turn(payload)
+                if sent:
+                    stats.round_trips.append(time.perf_counter() - sent)
+                if acting and side == RIVAL:
+                    for action in turn_actions(turn):
+                        if action == ACTION_POTION:
+                            battle.use_potion()
+                        else:
+                            battle.attack()
+                if not check_turn(battle, turn):
+                    stats.desyncs += 1
+                stats.turns += 1
+            else:
+                stats.battles += 1
+    except (asyncio.IncompleteReadError, ConnectionError) + BAD_MESSAGE:
+        stats.errors += 1
+    finally:
+        writer.close()
+
+
+async def swarm(host, port, clients, duration, opponent, seed):
+    stats = SwarmStats()
+    rng = random.Random(seed)
+    bots = [asyncio.create_task(bot(host, port, opponent, stats, random.Random(rng.getrandbits(64)),
+                                    ramp_up * i / clients))
+            for i in range(clients)]
+    await asyncio.sleep(ramp_up)
+    start = time.perf_counter()
+    battles, turns = stats.battles, stats.turns
+    stats.round_trips.clear()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    for task in bots:
+        task.cancel()
+    await asyncio.gather(*bots, return_exceptions=True)
+    return stats, stats.battles - battles, stats.turns - turns, elapsed
+
+
+# One process's share of the bots; runs on the swarm's process pool
+def swarm_shard(host, port, clients, duration, opponent, seed):
+    return asyncio.run(swarm(host, port, clients, duration, opponent, seed))
+
+
+# The bots split across processes, their stats added up
+def swarm_processes(host, port, clients, duration, opponent, seed, processes):
+    shares = [clients // processes + (i < clients % processes) for i in range(processes)]
+    with ProcessPoolExecutor(processes) as pool:
+        shards = [pool.submit(swarm_shard, host, port, share, duration, opponent, seed + i)
+                  for i, share in enumerate(shares)]
+        results = [shard.result() for shard in shards]
+
+    stats = SwarmStats()
+    for shard, battles, turns, elapsed in results:
+        for name in ('connected', 'failed', 'battles', 'turns', 'desyncs', 'errors'):
+            setattr(stats, name, getattr(stats, name) + getattr(shard, name))
+        stats.round_trips += shard.round_trips
+    return (stats, sum(result[1] for result in results), sum(result[2] for result in results),
+            max(result[3] for result in results))
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, len(samples) * p // 100)] if samples else 0.0
+
+
+# A battle server on a free local port for the length of the run
+def start_server(seed, workers):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    command = [sys.executable, 'battle_server.py', '--host', '127.0.0.1', '--port', str(port), '--seed', str(seed),
+               '--workers', str(workers)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    server.stdout.readline()
+    return server, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load a battle server with a swarm of bot clients.')
+    parser.add_argument('--clients', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=10, help='seconds measured once every bot is connected')
+    parser.add_argument('--opponent', choices=[OPPONENT_PLAYER] + list(DIFFICULTIES), default='easy')
+    parser.add_argument('--address', help='host:port of a running server (default: start one)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=1, help='swarm processes to split the bots across')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes of the server started for the run')
+    args = parser.parse_args()
+
+    server = None
+    if args.address:
+        host, port = args.address.rsplit(':', 1)
+        port = int(port)
+    else:
+        server, port = start_server(args.seed, args.workers)
+        host = '127.0.0.1'
+    try:
+        if args.processes > 1:
+            stats, battles, turns, elapsed = swarm_processes(
+                host, port, args.clients, args.duration, args.opponent, args.seed, args.processes)
+        else:
+            stats, battles, turns, elapsed = asyncio.run(
+                swarm(host, port, args.clients, args.duration, args.opponent, args.seed))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    round_trips = stats.round_trips
+    print(f'{stats.connected} bots connected, {stats.failed} failed to connect')
+    print(f'{battles} battles and {turns} turns in {elapsed:.1f} s '
+          f'({battles / elapsed:,.0f} battles/s, {turns / elapsed:,.0f} turns/s)')
+    print(f'action round trip p50 {percentile(round_trips, 50) * 1000:.1f}  '
+          f'p95 {percentile(round_trips, 95) * 1000:.1f}  p99 {percentile(round_trips, 99) * 1000:.1f} ms')
+    print(f'{stats.desyncs} turns out of step with the server, {stats.errors} errors')
+    sys.exit(1 if stats.desyncs or stats.failed else 0)
+
+
+if __name__ == '__main__':
+    main()
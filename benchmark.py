@@ -0,0 +1,359 @@
+# Offline benchmark suite
+#
+# Runs with no network: a stub_api server on localhost stands in for PokeAPI
+# (serving recorded fixtures when given, synthesized ones otherwise) and
+# rendering goes through SDL's dummy video driver, so numbers are comparable
+# from one machine, release and CI run to the next. Measured:
+#
+#   roster/cold, roster/warm, roster/bundle
+#       ms from starting the game to the first select page being loaded, on
+#       an empty asset cache, on the cache the cold run left behind, and from
+#       an asset bundle; plus the import (window and setup) time of each
+#   frame/<screen>/rebuild, /full, /steady
+#       ms per frame of draw_main_menu, draw_pokemon_select_screen,
+#       draw_pokemon_stats_screen and the battle screen: with its static
+#       layer rebuilt, with the whole window repainted from the layer, and
+#       with nothing changed; frame/battle/hp redraws changing HP bars
+#   battles/engine, battles/sim, battles/replay
+#       battles per second played by the engine with the greedy AI, by the
+#       NumPy simulator, and re-verified from replays
+#
+# Every run appends one JSON object (machine info, settings and a median,
+# min, p95 and max per benchmark) as a line to the output file, so a history
+# of runs can be diffed or plotted between releases:
+#
+#     python benchmark.py [--repeat N] [--frames N] [--battles N] [--only roster frame battles]
+#                         [--fixtures dir] [--latency s] [--output benchmark_results.jsonl]
+#
+# Loading and drawing run in child processes of this script, each a fresh
+# interpreter importing the game, so nothing is cached between runs that
+# would not be cached between launches.
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+GROUPS = ('roster', 'frame', 'battles')
+SCREENS = ('main menu', 'select', 'stats', 'battle')
+
+# environment settings of the game that would skew a run
+GAME_SETTINGS = ('POKEMON_BATTLE_PROFILE', 'POKEMON_BATTLE_OVERLAY', 'POKEMON_BATTLE_TRACE',
+                 'POKEMON_BATTLE_REPLAY', 'POKEMON_BATTLE_REPLAY_INDEX', 'POKEMON_BATTLE_REPLAY_SPEED',
+                 'POKEMON_BATTLE_REPLAYS', 'POKEMON_BATTLE_SERVER', 'POKEMON_BATTLE_SEED',
+                 'POKEMON_BATTLE_AI_WORKERS')
+
+# the longest a child may take before the run is abandoned
+child_timeout = 300
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, len(samples) * p // 100)]
+
+
+def summarize(name, unit, samples):
+    return {
+        'name': name,
+        'unit': unit,
+        'median': percentile(samples, 50),
+        'min': min(samples),
+        'p95': percentile(samples, 95),
+        'max': max(samples),
+        'samples': len(samples),
+    }
+
+
+# Import the game, as a launch would, and wait for the first select page
+def load_game():
+    start = time.perf_counter()
+    import pygame
+    import pokemon_battle as game
+    imported = time.perf_counter()
+
+    deadline = imported + child_timeout
+    while not game.first_page_loaded:
+        if time.perf_counter() > deadline:
+            sys.exit('the first page did not load')
+        for event in pygame.event.get(game.SPECIES_LOADED):
+            game.add_species(event.name, event.future)
+        time.sleep(0.001)
+    loaded = time.perf_counter()
+    return game, (imported - start) * 1000, (loaded - start) * 1000
+
+
+def shutdown(game):
+    game.species_pool.shutdown(wait=False, cancel_futures=True)
+    game.sprite_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def child_roster():
+    game, imported, loaded = load_game()
+    shutdown(game)
+    return {'import': imported, 'first page': loaded}
+
+
+# Milliseconds per call of draw over frames frames, running prepare untimed
+# before each
+def time_frames(draw, prepare, frames):
+    samples = []
+    for _ in range(frames):
+        prepare()
+        start = time.perf_counter()
+        draw()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def child_frames(frames):
+    game, imported, loaded = load_game()
+    pokemons = game.loaded_pokemons()
+
+    # the battle screen as prebattle leaves it, between the first two species
+    def prepare_battle():
+        player, rival = pokemons[0], pokemons[1]
+        game.choose_fighters(player, rival)
+        player.x, player.y, rival.x, rival.y = 0, 150, 300, 25
+        player.size = rival.size = 200
+        player.set_sprite('back_default')
+        rival.set_sprite('front_default')
+
+    screens = {
+        'main menu': ('main menu', game.draw_main_menu),
+        'select': ('select pokemon', lambda: game.draw_pokemon_select_screen(0)),
+        'stats': ('pokemon stats', lambda: game.draw_pokemon_stats_screen(pokemons, 0)),
+        'battle': ('battle', game.draw_battle_screen),
+    }
+
+    def rebuild(layer):
+        def prepare():
+            game.backgrounds.pop(layer, None)
+            game.invalidate_display()
+        return prepare
+
+    results = {}
+    for screen in SCREENS:
+        layer, draw = screens[screen]
+        if screen == 'battle':
+            prepare_battle()
+        results[f'{screen}/rebuild'] = time_frames(draw, rebuild(layer), frames)
+        results[f'{screen}/full'] = time_frames(draw, game.invalidate_display, frames)
+        results[f'{screen}/steady'] = time_frames(draw, lambda: None, frames)
+
+    # a turn of battle: both HP bars change every frame
+    player, rival = game.player_pokemon, game.rival_pokemon
+
+    def hit():
+        player.current_hp = player.current_hp - 10 if player.current_hp > 10 else player.max_hp
+        rival.current_hp = rival.current_hp - 10 if rival.current_hp > 10 else rival.max_hp
+    results['battle/hp'] = time_frames(game.draw_battle_screen, hit, frames)
+
+    shutdown(game)
+    return results
+
+
+# Run this script as a child with the game pointed at the stub; the child
+# prints its results as JSON on its last line
+def run_child(kind, stub, cache_dir, bundle_path, replay_path, frames=0):
+    env = {name: value for name, value in os.environ.items() if name not in GAME_SETTINGS}
+    env.update({
+        'SDL_VIDEODRIVER': 'dummy',
+        'SDL_AUDIODRIVER': 'dummy',
+        'PYGAME_HIDE_SUPPORT_PROMPT': '1',
+        'POKEMON_BATTLE_API': stub.url,
+        'POKEMON_BATTLE_CACHE_DIR': cache_dir,
+        'POKEMON_BATTLE_BUNDLE': bundle_path,
+        'POKEMON_BATTLE_REPLAYS': replay_path,
+        'POKEMON_BATTLE_AI': 'easy',
+    })
+    command = [sys.executable, os.path.abspath(__file__), '--child', kind, '--frames', str(frames)]
+    output = subprocess.run(command, env=env, stdout=subprocess.PIPE, check=True, timeout=child_timeout,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def bench_roster(args, stub, scratch, log):
+    samples = {}
+
+    def add(name, result):
+        for part, value in result.items():
+            samples.setdefault(f'roster/{name}/{part}', []).append(value)
+
+    missing_bundle = os.path.join(scratch, 'missing.bundle')
+    replay_path = os.path.join(scratch, 'replays')
+    bundle_path = os.path.join(scratch, 'roster.bundle')
+    bundle_cache = os.path.join(scratch, 'bundle cache')
+    env = dict(os.environ, POKEMON_BATTLE_CACHE_DIR=bundle_cache, SDL_VIDEODRIVER='dummy',
+               PYGAME_HIDE_SUPPORT_PROMPT='1')
+    subprocess.run([sys.executable, 'asset_bundle.py', bundle_path, stub.url], env=env, check=True,
+                   stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    for i in range(args.repeat):
+        print(f'roster load {i + 1}/{args.repeat}', file=log)
+        cache_dir = os.path.join(scratch, f'cache {i}')
+        add('cold', run_child('roster', stub, cache_dir, missing_bundle, replay_path))
+        add('warm', run_child('roster', stub, cache_dir, missing_bundle, replay_path))
+        add('bundle', run_child('roster', stub, bundle_cache, bundle_path, replay_path))
+        shutil.rmtree(cache_dir)
+
+    # the first page time is the headline; import time is reported on its own
+    results = []
+    for name, values in samples.items():
+        name = name.replace('/first page', '')
+        results.append(summarize(name, 'ms', values))
+    return results
+
+
+def bench_frames(args, stub, scratch, log):
+    samples = {}
+    for i in range(args.repeat):
+        print(f'frames {i + 1}/{args.repeat}', file=log)
+        result = run_child('frames', stub, os.path.join(scratch, 'frame cache'),
+                           os.path.join(scratch, 'missing.bundle'), os.path.join(scratch, 'replays'),
+                           args.frames)
+        for name, values in result.items():
+            samples.setdefault(name, []).extend(values)
+    return [summarize(f'frame/{name}', 'ms', values) for name, values in samples.items()]
+
+
+# Battles per second of each way of playing battles, best of several timed passes
+def bench_battles(args, log):
+    from battle_ai import make_policy
+    from battle_engine import ROSTER, Battle, Fighter, play_battle
+    from battle_replay import divergence, record_battle, replay
+    from battle_rng import BattleStream
+    import battle_sim
+
+    seed = args.seed
+    matchups = random.Random(seed).choices([(a, b) for a in ROSTER for b in ROSTER if a != b], k=args.battles)
+    policy = make_policy('easy')
+
+    def engine():
+        for battle_id, (player, rival) in enumerate(matchups):
+            play_battle(Battle(Fighter(*player), Fighter(*rival), BattleStream(seed, battle_id)), policy, policy)
+        return len(matchups)
+
+    pairs = len(ROSTER) * (len(ROSTER) - 1)
+    per_matchup = max(1, args.battles * 100 // pairs)
+
+    def sim():
+        battle_sim.matchup_matrix(per_matchup, seed)
+        return per_matchup * pairs
+
+    records = [record_battle(player, rival, seed, battle_id, policy, policy)
+               for battle_id, (player, rival) in enumerate(matchups)]
+
+    def verify():
+        for record in records:
+            if divergence(record, replay(record)) is not None:
+                sys.exit('a replay diverged from its record')
+        return len(records)
+
+    results = []
+    for name, run in (('engine', engine), ('sim', sim), ('replay', verify)):
+        print(f'battles/{name}', file=log)
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            battles = run()
+            samples.append(battles / (time.perf_counter() - start))
+        results.append(summarize(f'battles/{name}', 'battles/s', samples))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine():
+    import numpy
+    import pygame
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'pygame': pygame.version.ver,
+        'sdl': '.'.join(map(str, pygame.get_sdl_version())),
+        'numpy': numpy.__version__,
+    }
+
+
+def print_table(results, log):
+    print(f'{"Benchmark":<28}{"Unit":>10}{"Median":>12}{"Min":>12}{"p95":>12}{"Samples":>9}', file=log)
+    for result in results:
+        print(f'{result["name"]:<28}{result["unit"]:>10}{result["median"]:>12,.3f}{result["min"]:>12,.3f}'
+              f'{result["p95"]:>12,.3f}{result["samples"]:>9}', file=log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading, drawing and battles with no network.')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of every benchmark')
+    parser.add_argument('--frames', type=int, default=200, help='frames drawn per screen and mode in each run')
+    parser.add_argument('--battles', type=int, default=2000, help='battles per engine and replay pass')
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=list(GROUPS))
+    parser.add_argument('--fixtures', help='recorded API fixtures (see stub_api.py; default: synthesized)')
+    parser.add_argument('--latency', type=float, default=0, help='seconds the stub waits per request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.jsonl', help='JSON Lines file to append to, or -')
+    parser.add_argument('--child', choices=('roster', 'frames'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = child_roster() if args.child == 'roster' else child_frames(args.frames)
+        print(json.dumps(result))
+        return
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+    from stub_api import StubAPI
+
+    # progress and the table go to stderr so results can be piped from stdout
+    log = sys.stderr
+    results = []
+    started = time.time()
+    stub = StubAPI(args.fixtures, args.latency).start()
+    scratch = tempfile.mkdtemp(prefix='pokemon-benchmark-')
+    try:
+        if 'roster' in args.only:
+            results.extend(bench_roster(args, stub, scratch, log))
+        if 'frame' in args.only:
+            results.extend(bench_frames(args, stub, scratch, log))
+        if 'battles' in args.only:
+            results.extend(bench_battles(args, log))
+    finally:
+        stub.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    run = {
+        'time': started,
+        'commit': git_commit(),
+        'machine': machine(),
+        'settings': {'repeat': args.repeat, 'frames': args.frames, 'battles': args.battles,
+                     'fixtures': 'recorded' if args.fixtures else 'synthesized', 'latency': args.latency,
+                     'seed': args.seed},
+        'results': results,
+    }
+    print_table(results, log)
+    line = json.dumps(run)
+    if args.output == '-':
+        print(line)
+    else:
+        with open(args.output, 'a') as f:
+            f.write(line + '\n')
+        print(f'Appended results to {args.output}', file=log)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+# Built-in timers, counters and frame times
+#
+# Hot paths are wrapped in named scoped timers (with instrument.timer(name):
+# or @instrument.timed(name)) and counters. Nothing is collected unless one
+# of the settings below is on; then every name keeps its count, total and
+# worst time, a summary is printed at exit, and the game can show an overlay
+# with FPS, frame-time percentiles and cache hit rates (F3 toggles it).
+# With a trace path every timed span is also kept, in a bounded buffer, and
+# written at exit as a Chrome trace (open it in chrome://tracing or Perfetto),
+# so a slow machine can be diagnosed from the file alone:
+#
+#     POKEMON_BATTLE_TRACE=trace.json python pokemon_battle.py
+#
+# When collection is off, timed() returns the function unchanged and timer()
+# returns a shared no-op context manager.
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# collect timings and counters, show the overlay from the start, and where
+# to write the Chrome trace
+profile = os.environ.get('POKEMON_BATTLE_PROFILE', '') not in ('', '0')
+show_overlay = os.environ.get('POKEMON_BATTLE_OVERLAY', '') not in ('', '0')
+trace_path = os.environ.get('POKEMON_BATTLE_TRACE')
+enabled = profile or show_overlay or bool(trace_path)
+
+# how many recent frames the percentiles cover, and how many spans the
+# trace keeps (the oldest are dropped first)
+frame_window = 600
+max_trace_events = 1000000
+
+_lock = threading.Lock()
+_epoch = time.perf_counter()
+
+# name -> [count, total seconds, worst seconds]; name -> count
+_timers = {}
+_counters = {}
+
+# cache name -> function returning (hits, misses)
+_caches = {}
+
+_frames = deque(maxlen=frame_window)
+_spans = deque(maxlen=max_trace_events)
+_thread_names = {}
+
+_null_timer = contextlib.nullcontext()
+
+
+def record(name, start, end):
+    elapsed = end - start
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            stats = _timers[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+        if trace_path:
+            thread = threading.current_thread()
+            _thread_names[thread.ident] = thread.name
+            _spans.append((name, start, elapsed, thread.ident))
+
+
+class _Timer:
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, time.perf_counter())
+
+
+# Time a block: with instrument.timer('name'): ...
+def timer(name):
+    return _Timer(name) if enabled else _null_timer
+
+
+# Time every call of a function
+def timed(name):
+    def decorate(function):
+        if not enabled:
+            return function
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, start, time.perf_counter())
+
+        wrapper.__name__ = function.__name__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+# Count a hit or a miss of a cache that has no cache_info() of its own
+def hit(cache):
+    _count_cache(cache, 'hits')
+
+
+def miss(cache):
+    _count_cache(cache, 'misses')
+
+
+def _count_cache(cache, outcome):
+    if not enabled:
+        return
+    count(f'{cache} {outcome}')
+    if cache not in _caches:
+        _caches[cache] = lambda: (_counters.get(f'{cache} hits', 0), _counters.get(f'{cache} misses', 0))
+
+
+# Report the hit rate of a functools.lru_cache wrapped function
+def watch_cache(name, function):
+    def rates():
+        info = function.cache_info()
+        return info.hits, info.misses
+    _caches[name] = rates
+
+
+# One frame of the game loop did work from start to end
+def frame(start, end):
+    if enabled:
+        _frames.append(end - start)
+        record('frame', start, end)
+
+
+# Frame time in seconds at each percentile over the recent frames
+def frame_percentiles(percentiles=(50, 95, 99)):
+    frames = sorted(_frames)
+    if not frames:
+        return [0.0 for _ in percentiles]
+    return [frames[min(len(frames) - 1, len(frames) * p // 100)] for p in percentiles]
+
+
+# Short lines of text for the overlay
+def overlay_lines(fps):
+    p50, p95, p99 = frame_percentiles()
+    lines = [f'{fps:.0f} FPS  frame p50 {p50 * 1000:.1f}  p95 {p95 * 1000:.1f}  p99 {p99 * 1000:.1f} ms']
+    for name, rates in sorted(_caches.items()):
+        hits, misses = rates()
+        if hits + misses:
+            lines.append(f'{name}: {hits / (hits + misses):.0%} of {hits + misses}')
+    return lines
+
+
+def summary():
+    lines = [f'{"Timer":<28}{"Calls":>9}{"Total ms":>11}{"Mean ms":>10}{"Worst ms":>10}']
+    with _lock:
+        timers = sorted(_timers.items(), key=lambda item: -item[1][1])
+        counters = sorted(_counters.items())
+    for name, (calls, total, worst) in timers:
+        lines.append(f'{name:<28}{calls:>9}{total * 1000:>11.1f}{total / calls * 1000:>10.2f}{worst * 1000:>10.2f}')
+    for name, value in counters:
+        lines.append(f'{name:<28}{value:>9}')
+    for name, rates in sorted(_caches.items()):
+        hits, misses = rates()
+        if hits + misses:
+            lines.append(f'{name + " hit rate":<28}{hits / (hits + misses):>9.1%}')
+    return '\n'.join(lines)
+
+
+# Write the kept spans as Chrome trace events (timestamps in microseconds)
+def write_trace(path):
+    pid = os.getpid()
+    with _lock:
+        spans = list(_spans)
+        thread_names = dict(_thread_names)
+        counters = dict(_counters)
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+              for tid, name in thread_names.items()]
+    events.extend({'name': name, 'cat': 'game', 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': round((start - _epoch) * 1e6, 1), 'dur': round(elapsed * 1e6, 1)}
+                  for name, start, elapsed, tid in spans)
+    end = round((time.perf_counter() - _epoch) * 1e6, 1)
+    events.extend({'name': name, 'ph': 'C', 'pid': pid, 'ts': end, 'args': {'count': value}}
+                  for name, value in counters.items())
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    os.replace(tmp_path, path)
+
+
+@atexit.register
+def report():
+    if not enabled:
+        return
+    print(summary())
+    if trace_path:
+        write_trace(trace_path)
+        print(f'Wrote {len(_spans)} spans to {trace_path}')
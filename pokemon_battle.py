@@ -3,12 +3,31 @@
 
 import pygame
 from pygame.locals import *
+import os
 import time
 import math
 import random
-import requests
 import io
-from urllib.request import urlopen
+import functools
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asset_cache
+import asset_bundle
+import instrument
+from species_registry import SpeciesRegistry
+from battle_engine import *
+from timeline import Timeline
+from type_chart import weaknesses
+from battle_ai import SearchPolicy, make_policy
+from battle_replay import BAD_REPLAY, ReplayPolicy, ReplayRecorder, ReplayWriter, read_replays, divergence
+from battle_rng import BattleStream, MATCHUP_ROLL
+from battle_client import BattleClient
+from battle_protocol import OPPONENT_PLAYER, match_stream
+
+# startup is timed from here to the first frame on screen
+startup_started = time.perf_counter()
+time_to_first_frame = None
 
 pygame.init()
 
@@ -39,99 +58,206 @@ background_color = (245, 245, 245)
 combat_background_sky_color = (135, 206, 235)
 combat_background_grass_color = (34, 139, 34)
 
-# base url of the API
-base_url = 'https://pokeapi.co/api/v2'
-
-# Status condition constants
-STATUS_NONE = 0
-STATUS_BURN = 1
-STATUS_PARALYSIS = 2
-STATUS_POISON = 3
-STATUS_SLEEP = 4
-STATUS_CONFUSION = 5
-
-player_status_checked = False
-
-# Move names for each Pokemon
-MOVE_NAMES = {
-    'Raichu': 'Thunder Wave',
-    'Charizard': 'Blast Burn',
-    'Nidoking': 'Toxic',
-    'Venusaur': 'Sleep Powder',
-    'Gyarados': 'Confuse Ray',
-    'Dragonite': 'Dragon Dance'
-}
+# frame rate cap while something is animating; idle screens wait for input
+max_fps = int(os.environ.get('POKEMON_BATTLE_MAX_FPS', 60))
 
-# Weakness chart (attacker type -> defender type)
-WEAKNESSES = {
-    'Fire': 'Water',
-    'Water': 'Electric',
-    'Electric': 'Ground',
-    'Ground': 'Grass',
-    'Grass': 'Fire',
-    'Dragon': None  
-}
+# how long the send-out and fainted fades take (seconds), and how many
+# distinct alpha levels a fade goes through
+fade_duration = 1.5
+fade_steps = 32
 
-# Helper function to check if an attack is super effective
-def is_super_effective(attacker_type, defender_type, defender_weakness):
-    # Check if the defender has a specific weakness attribute
-    if defender_weakness:
-        return attacker_type == defender_weakness
-    
-    # Check the type cycle weakness
-    if defender_type in WEAKNESSES:
-        weak_to = WEAKNESSES[defender_type]
-        if weak_to and attacker_type == weak_to:
-            return True
-    
-    return False
+# base url of the API (the benchmarks point it at a local stub)
+base_url = os.environ.get('POKEMON_BATTLE_API', 'https://pokeapi.co/api/v2')
+
+# how the rival plays: 'easy' (greedy), 'normal' or 'hard' (searches ahead),
+# optionally spreading its search over worker processes
+rival_difficulty = os.environ.get('POKEMON_BATTLE_AI', 'hard')
+ai_workers = int(os.environ.get('POKEMON_BATTLE_AI_WORKERS', 0))
+rival_policy = make_policy(rival_difficulty, ai_workers)
+
+# play online on the battle server at host:port (see battle_server.py)
+# instead of against the local AI; the rival is another player or one of the
+# server's AI difficulties
+server_address = os.environ.get('POKEMON_BATTLE_SERVER')
+online_opponent = os.environ.get('POKEMON_BATTLE_OPPONENT', OPPONENT_PLAYER)
+
+# roster data and pre-scaled sprites built by asset_bundle.py, if present
+bundle = asset_bundle.open_bundle()
+
+# battle n of a session draws from the stream (seed, n); set the seed to
+# play a session again
+session_seed = int(os.environ.get('POKEMON_BATTLE_SEED') or random.getrandbits(64))
+
+# when set, every battle played is appended to this replay log (see
+# battle_replay.py)
+replay_log_path = os.environ.get('POKEMON_BATTLE_REPLAYS')
+
+# a replay log to play back instead of a game, which battle of it and how
+# many times faster than normal to play it
+replay_path = os.environ.get('POKEMON_BATTLE_REPLAY')
+replay_index = int(os.environ.get('POKEMON_BATTLE_REPLAY_INDEX', 0))
+replay_speed = float(os.environ.get('POKEMON_BATTLE_REPLAY_SPEED', 1))
+
+# battle messages and animations play from this queue while the loop keeps
+# running; a replay runs it on a sped up clock
+def playback_clock():
+    return time.monotonic() * replay_speed
+
+timeline = Timeline(playback_clock if replay_path else time.monotonic)
+
+# the battle message box at the bottom of the window
+message_box = Rect(10, 350, 480, 140)
+
+# Static layers: each screen's unchanging background is drawn once onto its
+# own surface and blitted, instead of being repainted every frame
+backgrounds = {}
+shown_background = None
+
+# Regions of the window changed since the last flush, and what each tracked
+# region (buttons, tiles, HP bars) showed when it was last drawn
+dirty_rects = []
+drawn_state = {}
+
+def mark_dirty(rect):
+    dirty_rects.append(Rect(rect))
+
+# Push only the changed regions to the display
+@instrument.timed('flush_display')
+def flush_display():
+    global time_to_first_frame
+    if dirty_rects:
+        pygame.display.update(dirty_rects)
+        dirty_rects.clear()
+        
+        if time_to_first_frame is None:
+            now = time.perf_counter()
+            time_to_first_frame = now - startup_started
+            if instrument.enabled:
+                instrument.record('first frame', startup_started, now)
+
+# Returns True when a tracked region has to be redrawn because its state changed
+def changed(key, state):
+    if key in drawn_state and drawn_state[key] == state:
+        return False
+    drawn_state[key] = state
+    return True
+
+def get_background(name):
+    if name not in backgrounds:
+        surface = pygame.Surface(size).convert()
+        background_builders[name](surface)
+        backgrounds[name] = surface
+    return backgrounds[name]
+
+# Blit a screen's static layer unless it is already on the window.
+# Returns True when the window was repainted.
+def show_background(name, state=None):
+    global shown_background
+    if shown_background == (name, state):
+        return False
+    game.blit(get_background(name), (0, 0))
+    mark_dirty(game.get_rect())
+    drawn_state.clear()
+    shown_background = (name, state)
+    return True
+
+# Forget what the window shows after drawing outside the layers (e.g. fades)
+def invalidate_display():
+    global shown_background
+    shown_background = None
+    drawn_state.clear()
+
+def draw_battle_field(surface):
+    surface.fill(combat_background_grass_color)
+    pygame.draw.rect(surface, combat_background_sky_color, (0, 0, game_width, 150))
+
+# The battle field with both Pokemon on their grass pads
+def draw_battle_scene(surface):
+    surface.blit(get_background('battle field'), (0, 0))
+    player_pokemon.draw(draw_grass_pad=True, surface=surface)
+    rival_pokemon.draw(draw_grass_pad=True, surface=surface)
+
+# Redraw both HP bars over the battle scene, optionally from an event's
+# (HP, status) snapshot of each side
+def draw_battle_hp(state=None):
+    scene = get_background('battle')
+    for pokemon, pokemon_state in zip((player_pokemon, rival_pokemon), state or (None, None)):
+        hp_rect = pokemon.get_hp_rect()
+        game.blit(scene, hp_rect, hp_rect)
+        pokemon.draw_hp(*(pokemon_state or ()))
 
 # Helper function to update the battle screen display
-def update_display():
-    game.fill(combat_background_grass_color)
-    pygame.draw.rect(game, combat_background_sky_color, (0, 0, game_width, 150))
-    
+@instrument.timed('update_display')
+def update_display(state=None):
     # Draw both Pokemon if they exist
     if player_pokemon and rival_pokemon:
-        player_pokemon.draw(draw_grass_pad=True)
-        rival_pokemon.draw(draw_grass_pad=True)
-        player_pokemon.draw_hp()
-        rival_pokemon.draw_hp()
+        if not show_background('battle'):
+            # the Pokemon have not moved; only clear the message box
+            game.blit(get_background('battle'), message_box, message_box)
+            mark_dirty(message_box)
+            drawn_state.clear()
+        draw_battle_hp(state)
+    else:
+        show_background('battle field')
     
-    pygame.display.update()
+    flush_display()
     
-class Pokemon(pygame.sprite.Sprite):
+# Load the default font once per size
+@functools.lru_cache(maxsize=None)
+@instrument.timed('create font')
+def get_font(size):
+    return pygame.font.Font(pygame.font.get_default_font(), size)
+
+# Render a string once and reuse the surface while the same text is drawn again
+@functools.lru_cache(maxsize=256)
+@instrument.timed('render text')
+def render_text(text, size, color):
+    return get_font(size).render(text, True, color)
+
+# Decode a sprite once; the URL identifies the species and the side it faces
+@functools.lru_cache(maxsize=32)
+@instrument.timed('decode sprite')
+def get_sprite(url):
+    image_file = io.BytesIO(asset_cache.fetch_bytes(url))
+    return pygame.image.load(image_file).convert_alpha()
+
+# Scale a decoded sprite to a target width once and reuse it on every frame;
+# bundled sprites come straight from the bundle's pixels
+@functools.lru_cache(maxsize=128)
+@instrument.timed('scale sprite')
+def get_scaled_sprite(url, size):
+    if bundle:
+        sprite = bundle.sprite(url, size)
+        if sprite:
+            return sprite
+    return asset_bundle.scale_sprite(get_sprite(url), size)
+
+# A scaled sprite with its alpha multiplied down, built once per alpha level
+@functools.lru_cache(maxsize=128)
+@instrument.timed('fade sprite')
+def get_faded_sprite(url, size, alpha):
+    sprite = get_scaled_sprite(url, size).copy()
+    sprite.fill((255, 255, 255, alpha), None, pygame.BLEND_RGBA_MULT)
+    return sprite
+
+# A Fighter with a sprite, so the battle engine can drive it directly
+class Pokemon(Fighter, pygame.sprite.Sprite):
     
-    def __init__(self, name, type, x, y, hp, attack, status_ability=None, weakness=None):
+    @instrument.timed('Pokemon.__init__')
+    def __init__(self, name, type, x, y, hp, attack, status_ability=None, data=None):
         
+        Fighter.__init__(self, name, type, hp, attack, status_ability)
         pygame.sprite.Sprite.__init__(self)
         
-        # call the pokemon API endpoint
-        req = requests.get(f'{base_url}/pokemon/{name.lower()}')
-        self.json = req.json()
-        
-        # set the pokemon's name and type
-        self.name = name
-        self.type = type 
+        # call the pokemon API endpoint (served from the local cache when possible)
+        # and keep only the sprite URLs, not the whole response
+        if data is None:
+            data = asset_cache.fetch_json(f'{base_url}/pokemon/{name.lower()}')
+        self.json = asset_bundle.trim_species(data)
         
         # set the sprite position on the screen
         self.x = x
         self.y = y
-        
-        # set the pokemon's stats (TCG Pocket style - lower numbers)
-        self.current_hp = hp
-        self.max_hp = hp
-        self.attack = attack
-        
-        # status conditions
-        self.status = STATUS_NONE
-        self.status_ability = status_ability  # which status this pokemon can inflict
-        
-        # weakness (specific type this Pokemon is weak to)
-        self.weakness = weakness
-        
-        # number of potions left
-        self.num_potions = 2
                 
         # set the sprite's width
         self.size = 150
@@ -139,257 +265,40 @@ class Pokemon(pygame.sprite.Sprite):
         # set the sprite to the front facing sprite
         self.set_sprite('front_default')
     
-    # Check and apply status effects at the START of the turn
-    def check_status_at_turn_start(self):
-        # Paralysis: Can't act for 1 turn
-        if self.status == STATUS_PARALYSIS:
-            self.status = STATUS_NONE  # Remove paralysis after 1 turn
-            return False  # Cannot act this turn
-        
-        # Burn: Flip coin to try to remove it
-        elif self.status == STATUS_BURN:
-            coin = random.choice(['Heads', 'Tails'])
-            display_message(f'{self.name} is burned! Flipping coin...')
-            time.sleep(3)
-            display_message(f'Result: {coin}!')
-            time.sleep(2)
-            if coin == 'Heads':
-                self.status = STATUS_NONE
-                display_message(f'{self.name} recovered from burn!')
-                time.sleep(2)
-                # Update display to show status removed
-                update_display()
-                return True  # Can act this turn
-            else:
-                display_message(f'{self.name} is still burned!')
-                time.sleep(2)
-                return True  # Can still act, will take damage at end of turn
-        
-        # Sleep: Flip coin to wake up
-        elif self.status == STATUS_SLEEP:
-            coin = random.choice(['Heads', 'Tails'])
-            display_message(f'{self.name} is asleep! Flipping coin...')
-            time.sleep(3)
-            display_message(f'Result: {coin}!')
-            time.sleep(2)
-            if coin == 'Heads':
-                self.status = STATUS_NONE
-                display_message(f'{self.name} woke up!')
-                time.sleep(2)
-                # Update display to show status removed
-                update_display()
-                return True  # Can act this turn
-            else:
-                display_message(f'{self.name} is still asleep!')
-                time.sleep(2)
-                return False  # Cannot act
-        
-        return True  # Can act
-    
-    # Perform an attack on another Pokemon
-    def perform_attack(self, other):
-        # Get move name
-        move_name = MOVE_NAMES.get(self.name, 'Attack')
-        
-        # Check confusion WHEN attacking
-        if self.status == STATUS_CONFUSION:
-            coin = random.choice(['Heads', 'Tails'])
-            display_message(f'{self.name} is confused! Flipping coin...')
-            time.sleep(3)
-            display_message(f'Result: {coin}!')
-            time.sleep(2)
-            if coin == 'Heads':
-                # Wake up from confusion and attack normally
-                self.status = STATUS_NONE
-                display_message(f'{self.name} snapped out of confusion!')
-                time.sleep(2)
-                update_display()
-                time.sleep(2)
-            else:
-                # Attack fails and confusion is removed
-                self.status = STATUS_NONE
-                display_message(f'{self.name} missed due to confusion!')
-                time.sleep(2)
-                other.apply_status_damage_at_turn_end()
-                return  # Turn ends, no damage
-        
-        # Calculate damage
-        damage = self.attack
-        
-        # Check for weakness (super effective)
-        is_super = is_super_effective(self.type, other.type, other.weakness)
-        if is_super:
-            damage += 10  # Add 10 damage for super effective attacks
-            super_effective_message = True
-        else:
-            super_effective_message = False
-        
-        # Missed attack (25% chance)
-        missed_attack = False
-        random_num = random.randint(1, 4)
-        if random_num == 1:
-            damage = 0
-            missed_attack = True
-        
-        # Display move used
-        display_message(f'{self.name} uses {move_name}!')
-        time.sleep(2)
-        
-        # Apply damage
-        if missed_attack:
-            display_message('Attack missed!')
-            time.sleep(2)
-            if other.status == STATUS_BURN or other.status == STATUS_POISON:
-                other.apply_status_damage_at_turn_end()
-        else:
-            other.take_damage(damage)
-            display_message(f'{self.name} deals {damage} damage!')
-            time.sleep(2)
-            
-            # Display super effective message if applicable
-            if is_super and super_effective_message:
-                display_message(f'{move_name} was super effective!')
-                time.sleep(2)
-            
-            # Update the display to show HP change immediately
-            update_display()
-            time.sleep(1)
-        
-        # Apply status condition based on ability (immediately)
-        if self.status_ability and not missed_attack:
-            if self.status_ability == STATUS_BURN:
-                # Burn has 50% chance 
-                if random.randint(1, 2) == 1: 
-                    other.status = STATUS_BURN
-                    other.take_damage(20)
-                    display_message(f'{other.name} is burned!')
-                    time.sleep(2)
-                else:
-                    display_message(f'{other.name} resisted the burn!')
-                    time.sleep(2)
-            
-            elif self.status_ability == STATUS_POISON:
-                # Poison is guaranteed (100%)
-                other.status = STATUS_POISON
-                other.take_damage(10)
-                display_message(f'{other.name} is poisoned!')
-                time.sleep(2)
-            
-            elif self.status_ability == STATUS_PARALYSIS:
-                # Paralysis has 50% chance
-                if random.randint(1, 2) == 1:
-                    other.status = STATUS_PARALYSIS
-                    display_message(f'{other.name} is paralyzed!')
-                    time.sleep(2)
-                else:
-                    display_message(f'{other.name} resisted the paralysis!')
-                    time.sleep(2)
-            
-            elif self.status_ability == STATUS_SLEEP:
-                # Sleep has 75% chance
-                if random.randint(1, 4) <= 3: 
-                    other.status = STATUS_SLEEP
-                    display_message(f'{other.name} fell asleep!')
-                    time.sleep(2)
-                else:
-                    display_message(f'{other.name} stayed awake!')
-                    time.sleep(2)
-            
-            elif self.status_ability == STATUS_CONFUSION:
-                # Confusion is guaranteed (100%)
-                other.status = STATUS_CONFUSION
-                display_message(f'{other.name} is confused!')
-                time.sleep(2)
-            
-            # Update the display to show status condition immediately
-            update_display()
-            time.sleep(1)
-    
-    # Apply status damage at the END of the turn
-    def apply_status_damage_at_turn_end(self):
-        # Burn: Take 20 damage at end of turn (if still burned)
-        if self.status == STATUS_BURN:
-            self.take_damage(20)
-            display_message(f'{self.name} took 20 burn damage!')
-            time.sleep(2)
-            # Update display to show HP change
-            update_display()
-            time.sleep(1)
-        
-        # Poison: Take 10 damage at end of turn
-        elif self.status == STATUS_POISON:
-            self.take_damage(10)
-            display_message(f'{self.name} took 10 poison damage!')
-            time.sleep(2)
-            # Update display to show HP change
-            update_display()
-            time.sleep(1)
-        
-        # Paralysis: Remove it at end of turn
-        elif self.status == STATUS_PARALYSIS:
-            self.status = STATUS_NONE
-            display_message(f'{self.name} is no longer paralyzed!')
-            time.sleep(2)
-            # Update display to show status removed
-            update_display()
-            time.sleep(1)
-    
-    def take_damage(self, damage):
-        self.current_hp -= damage
-        if self.current_hp < 0:
-            self.current_hp = 0
-    
-    def use_potion(self):
-        if self.num_potions > 0:
-            # Heal 50 HP
-            self.current_hp += 50
-            if self.current_hp > self.max_hp:
-                self.current_hp = self.max_hp
-            self.num_potions -= 1
-            
-            # Cure status conditions
-            had_status = self.status != STATUS_NONE
-            self.status = STATUS_NONE
-            
-            display_message(f'{self.name} uses a potion and heals 50 HP!')
-            time.sleep(2)
-            if had_status:
-                display_message(f'{self.name} is cured from all status effects!')
-                time.sleep(2)
-                
-            # Update display to show HP change and status removed
-            update_display()
-            time.sleep(1)
-            
-            return True
-        return False
-    
+    @instrument.timed('set_sprite')
     def set_sprite(self, side):
-        image = self.json['sprites'][side]
-        image_stream = urlopen(image).read()
-        image_file = io.BytesIO(image_stream)
-        self.image = pygame.image.load(image_file).convert_alpha()
-        
-        scale = self.size / self.image.get_width()
-        new_width = self.image.get_width() * scale 
-        new_height = self.image.get_height() * scale 
-        self.image = pygame.transform.scale(self.image, (int(new_width), int(new_height)))
+        self.sprite_url = self.json['sprites'][side]
+        self.image = get_scaled_sprite(self.sprite_url, self.size)
     
-    def draw(self, alpha=255, draw_grass_pad=False):    
+    def draw(self, alpha=255, draw_grass_pad=False, surface=None):    
+        if surface is None:
+            surface = game
+        
         if draw_grass_pad:
             oval_width = self.size * 1.2
             oval_height = self.size / 6
             oval_x = self.x + (self.size - oval_width) / 2
             oval_y = self.y + self.size - oval_height * 1.35
-            pygame.draw.ellipse(game, green, (oval_x, oval_y, oval_width, oval_height))
+            pygame.draw.ellipse(surface, green, (oval_x, oval_y, oval_width, oval_height))
             
-        sprite = self.image.copy()
-        transparency = (255, 255, 255, alpha)
-        sprite.fill(transparency, None, pygame.BLEND_RGBA_MULT)
-        game.blit(sprite, (self.x, self.y))
+        if alpha >= 255:
+            surface.blit(self.image, (self.x, self.y))
+        elif alpha > 0:
+            # round to one of fade_steps levels so fades reuse cached variants
+            level = round(alpha * fade_steps / 255) * 255 // fade_steps
+            if level > 0:
+                surface.blit(get_faded_sprite(self.sprite_url, self.size, level), (self.x, self.y))
+    
+    # The area covered by the health bar, HP text and status badge
+    def get_hp_rect(self):
+        return Rect(self.hp_x, self.hp_y, 260, 45)
         
-    def draw_hp(self):
-        current_hp_int = int(self.current_hp)
+    # Draws the current HP and status, or the given ones when replaying a battle event
+    @instrument.timed('draw_hp')
+    def draw_hp(self, hp=None, status=None):
+        if hp is None:
+            hp, status = self.current_hp, self.status
+        current_hp_int = int(hp)
         
         # Display the health bar
         bar_width = 200
@@ -405,30 +314,30 @@ class Pokemon(pygame.sprite.Sprite):
         
         # Display HP text
         hp_text = f'HP: {current_hp_int} / {self.max_hp}'
-        font = pygame.font.Font(pygame.font.get_default_font(), 16)
-        text = font.render(hp_text, True, black)
+        font_size = 16
+        text = render_text(hp_text, font_size, black)
         text_rect = text.get_rect()
         text_rect.x = self.hp_x
         text_rect.y = self.hp_y + 25
         game.blit(text, text_rect)
         
         # Display status condition
-        if self.status != STATUS_NONE:
+        if status != STATUS_NONE:
             status_text = ""
             status_color = black
-            if self.status == STATUS_BURN:
+            if status == STATUS_BURN:
                 status_text = "BRN"
                 status_color = orange
-            elif self.status == STATUS_PARALYSIS:
+            elif status == STATUS_PARALYSIS:
                 status_text = "PAR"
                 status_color = yellow
-            elif self.status == STATUS_POISON:
+            elif status == STATUS_POISON:
                 status_text = "PSN"
                 status_color = purple
-            elif self.status == STATUS_SLEEP:
+            elif status == STATUS_SLEEP:
                 status_text = "SLP"
                 status_color = grey
-            elif self.status == STATUS_CONFUSION:
+            elif status == STATUS_CONFUSION:
                 status_text = "CNF"
                 status_color = pink
             
@@ -444,64 +353,214 @@ class Pokemon(pygame.sprite.Sprite):
             pygame.draw.rect(game, black, status_bg, 2)
             
             # Create and center status text
-            status_surface = font.render(status_text, True, black)
+            status_surface = render_text(status_text, font_size, black)
             
             # Get text rectangle and center it within the background
             status_text_rect = status_surface.get_rect(center=status_bg.center)
             game.blit(status_surface, status_text_rect)
         
+        mark_dirty(self.get_hp_rect())
+        
     def get_rect(self):
         return Rect(self.x, self.y, self.image.get_width(), self.image.get_height())
 
+@instrument.timed('display_message')
 def display_message(message):
-    pygame.draw.rect(game, white, (10, 350, 480, 140))
-    pygame.draw.rect(game, black, (10, 350, 480, 140), 3)
+    pygame.draw.rect(game, white, message_box)
+    pygame.draw.rect(game, black, message_box, 3)
     
-    font = pygame.font.Font(pygame.font.get_default_font(), 20)
-    text = font.render(message, True, black)
+    font_size = 20
+    text = render_text(message, font_size, black)
     text_rect = text.get_rect()
     text_rect.x = 30
     text_rect.y = 410
     game.blit(text, text_rect)
     
+    # the box covers the battle buttons, so they must be redrawn afterwards
+    drawn_state.clear()
+    mark_dirty(message_box)
+    flush_display()
+    
+# How long each kind of battle event stays on screen (seconds)
+EVENT_DELAYS = {
+    EVENT_MESSAGE: 2,
+    EVENT_COIN: 3,
+    EVENT_REFRESH: 1,
+}
+
+# Queue the events produced by the battle engine on the timeline
+def play_events(events):
+    for event in events:
+        if event.kind == EVENT_REFRESH:
+            timeline.add(functools.partial(update_display, event.state), EVENT_DELAYS[event.kind])
+        elif event.kind != EVENT_FAINT:
+            # (the fainted screen fades the Pokemon out with its own message)
+            timeline.add(functools.partial(display_message, event.text), EVENT_DELAYS[event.kind])
+
+# Fade a Pokemon in on its grass pad as it is sent out (a timeline animation)
+def send_out(pokemon, message, progress):
+    game.blit(get_background('battle field'), (0, 0))
+    if pokemon is player_pokemon:
+        rival_pokemon.draw(draw_grass_pad=True)
+        rival_pokemon.draw_hp()
+    pokemon.draw(progress * 255, draw_grass_pad=True)
+    display_message(message)
     pygame.display.update()
+
+# Show a Pokemon's health bar once it is on the field
+def show_hp(pokemon):
+    pokemon.draw_hp()
+    flush_display()
+
+# Fade out whichever Pokemon lost (a timeline animation)
+def fade_out_loser(progress):
+    alpha = 255 * (1 - progress)
+    game.blit(get_background('battle field'), (0, 0))
+    player_pokemon.draw_hp()
+    rival_pokemon.draw_hp()
+    
+    if battle.winner == PLAYER:
+        player_pokemon.draw(draw_grass_pad=True)
+        rival_pokemon.draw(alpha, draw_grass_pad=True)
+        display_message(f'{rival_pokemon.name} fainted!')
+    else:
+        player_pokemon.draw(alpha, draw_grass_pad=True)
+        rival_pokemon.draw(draw_grass_pad=True)
+        display_message(f'{player_pokemon.name} fainted!')
+    
+    pygame.display.update()
+
+# Put two Pokemon in the player and rival slots, ready for prebattle
+def choose_fighters(player, rival):
+    global player_pokemon, rival_pokemon
+    player_pokemon = player
+    rival_pokemon = rival
+    player_pokemon.hp_x = 225
+    player_pokemon.hp_y = 275
+    rival_pokemon.hp_x = 100
+    rival_pokemon.hp_y = 50
+
+# Put the species of two specs in the slots with those stat lines, once both
+# are loaded. Returns False while loading, None if one cannot be loaded.
+def load_fighters(specs):
+    names = [spec[0].lower() for spec in specs]
+    for name in names:
+        request_species(name)
+    if any(name in failed_species for name in names):
+        return None
+    if not all(name in pokemon_cache for name in names):
+        return False
+    choose_fighters(*(Pokemon(spec[0], spec[1], 0, 0, *spec[2:], data=pokemon_cache[name].json)
+                      for spec, name in zip(specs, names)))
+    return True
+
+# Online, a turn starts once the server has confirmed the last one. When the
+# rival has left or the connection dropped, the battle ends there.
+def online_turn_ready():
+    global game_status
+    error = client.take_error()
+    if error:
+        client.leave()
+        timeline.add(functools.partial(display_message, error), 2)
+        game_status = 'gameover'
+        return False
+    return client.ready(battle)
+
+# Once the battle has a winner, append it to the replay log, or check it
+# against its record when it is a replay. Quitting during the last messages
+# still saves it; a log that cannot be written only costs the record.
+def finish_recording():
+    global recorder
+    if recorder is None or battle.winner is None:
+        return
+    record = recorder.record(battle)
+    recorder = None
+    
+    if replay_record:
+        turn = divergence(replay_record, record)
+        if turn is not None:
+            print(f'Replay diverged from the recorded battle at turn {turn}')
+    else:
+        try:
+            writer = ReplayWriter(replay_log_path)
+            writer.write(record)
+            writer.close()
+        except (OSError, ValueError) as error:
+            print(f'Could not save the battle to {replay_log_path}: {error}')
+
+# Which screen the battle moves to after a step
+def battle_status(battle):
+    if battle.winner is not None:
+        return 'fainted'
+    elif battle.turn == PLAYER:
+        return 'player turn'
+    return 'rival turn'
+    
+# The battle scene with the player's Attack and Potion buttons
+@instrument.timed('draw_battle_screen')
+def draw_battle_screen():
+    show_background('battle')
+    hp_state = (player_pokemon.current_hp, player_pokemon.status, rival_pokemon.current_hp, rival_pokemon.status)
+    if changed('hp', hp_state):
+        draw_battle_hp()
+        
+    attack_button = create_button(240, 140, 10, 350, 130, 420, 'Attack')
+    potion_button = create_button(240, 140, 250, 350, 370, 420, f'Potion ({player_pokemon.num_potions})')
+
+    # the divider and border lie inside the buttons, so they are pushed
+    # whenever a button is
+    pygame.draw.line(game, black, (250, 350), (250, 490), 3)
+    pygame.draw.rect(game, black, message_box, 3)
+        
+    flush_display()
+    return attack_button, potion_button
     
 def create_button(width, height, left, top, text_cx, text_cy, label, highlight=False):
     mouse_cursor = pygame.mouse.get_pos()
     button = Rect(left, top, width, height)
+    highlighted = highlight or button.collidepoint(mouse_cursor)
     
-    if highlight or button.collidepoint(mouse_cursor):
+    # only repaint the button when its look changes
+    if not changed(('button', left, top), (highlighted, label)):
+        return button
+    
+    if highlighted:
         pygame.draw.rect(game, light_grey, button)
     else:
         pygame.draw.rect(game, grey, button)
         
-    font = pygame.font.Font(pygame.font.get_default_font(), 16)
-    text = font.render(f'{label}', True, black)
+    font_size = 16
+    text = render_text(f'{label}', font_size, black)
     text_rect = text.get_rect(center=(text_cx, text_cy))
     game.blit(text, text_rect)
     
+    mark_dirty(button)
     return button
 
-def draw_main_menu():
-    game.fill(background_color)
-    pygame.draw.polygon(game, red, [(0, 0), (game_width, 0), (0, game_height)])
-    pygame.draw.polygon(game, white, [(game_width, game_height), (game_width, 0), (0, game_height)])
-    font = pygame.font.Font(pygame.font.get_default_font(), 36)
-    title = font.render("Pokemon Battle", True, black)
+def draw_main_menu_background(surface):
+    surface.fill(background_color)
+    pygame.draw.polygon(surface, red, [(0, 0), (game_width, 0), (0, game_height)])
+    pygame.draw.polygon(surface, white, [(game_width, game_height), (game_width, 0), (0, game_height)])
+    font_size = 36
+    title = render_text("Pokemon Battle", font_size, black)
     title_rect = title.get_rect(center=(game_width // 2, game_height // 4))
-    game.blit(title, title_rect)
+    surface.blit(title, title_rect)
+
+@instrument.timed('draw_main_menu')
+def draw_main_menu():
+    show_background('main menu')
 
     instructions_button = create_button(240, 50, 130, 200, 250, 225, 'Instructions')
     play_button = create_button(240, 50, 130, 275, 250, 300, 'Play Game')
 
-    pygame.display.update()
+    flush_display()
     return instructions_button, play_button
 
-def draw_instructions():
-    game.fill(background_color)
-    pygame.draw.polygon(game, white, [(0, 0), (game_width, 0), (0, game_height)])
-    pygame.draw.polygon(game, light_green, [(game_width, game_height), (game_width, 0), (0, game_height)])
-    font = pygame.font.Font(pygame.font.get_default_font(), 14)
+def draw_instructions_background(surface):
+    surface.fill(background_color)
+    pygame.draw.polygon(surface, white, [(0, 0), (game_width, 0), (0, game_height)])
+    pygame.draw.polygon(surface, light_green, [(game_width, game_height), (game_width, 0), (0, game_height)])
+    font_size = 14
     lines = [
         "How to Play:",
         "1. On your turn, you may attack and/or use potions (2 in total)",
@@ -512,50 +571,107 @@ def draw_instructions():
         "   - Sleep (75% chance per attack): Requires coin flip to wake up",
         "   - Paralysis (50% chance per attack): Can't attack/heal for 1 turn",
         "   - Confusion (100% chance per attack): Must flip coin to attack",
-        "4. Type weaknesses result in super effective attacks (+10 damage)",
+        "4. Super effective attacks deal +10 damage, resisted ones -10",
         "5. First to reduce opponent's HP to 0 wins!",
     ]
     y = 30
     for line in lines:
-        text = font.render(line, True, black)
+        text = render_text(line, font_size, black)
         text_rect = text.get_rect(left=10, top=y)
-        game.blit(text, text_rect)
+        surface.blit(text, text_rect)
         y += 38
 
-    pygame.draw.rect(game, white, (150, 445, 200, 40))
-    pygame.draw.rect(game, black, (150, 445, 200, 40), 2)
-    text = font.render("Press 'B' to go back", True, black)
+    pygame.draw.rect(surface, white, (150, 445, 200, 40))
+    pygame.draw.rect(surface, black, (150, 445, 200, 40), 2)
+    text = render_text("Press 'B' to go back", font_size, black)
     text_rect = text.get_rect(center=(game_width // 2, 465))
-    game.blit(text, text_rect)
+    surface.blit(text, text_rect)
 
-    pygame.display.update()
+def draw_instructions():
+    show_background('instructions')
+    flush_display()
     
-def draw_pokemon_select_screen(pokemons):
-    game.fill(background_color)
-    pygame.draw.polygon(game, white, [(0, 0), (game_width, 0), (0, game_height)])
-    pygame.draw.polygon(game, blue, [(game_width, game_height), (game_width, 0), (0, game_height)])
-    font = pygame.font.Font(pygame.font.get_default_font(), 20)
+def draw_pokemon_select_background(surface):
+    surface.fill(background_color)
+    pygame.draw.polygon(surface, white, [(0, 0), (game_width, 0), (0, game_height)])
+    pygame.draw.polygon(surface, blue, [(game_width, game_height), (game_width, 0), (0, game_height)])
+    font_size = 20
     
-    attack_label = font.render("Select your Pokemon", True, black)
+    attack_label = render_text("Select your Pokemon", font_size, black)
     attack_rect = attack_label.get_rect(center=(game_width // 2, 50))
-    game.blit(attack_label, attack_rect)
+    surface.blit(attack_label, attack_rect)
+
+# The full width under a tile, so a new label clears the one it replaces
+def tile_label_strip(label_rect):
+    return Rect(label_rect.centerx - 75, label_rect.y, 150, label_rect.height)
 
-    for pokemon in pokemons:
+# Where the tile of each slot on a select page sits: three per row
+def tile_rect(i):
+    return Rect(50 + (i % 3) * 150, 100 + (i // 3) * 150, 100, 100)
+
+# A grey tile holding a slot whose Pokemon has not arrived yet
+def draw_placeholder_tile(i, label):
+    font_size = 20
+    rect = tile_rect(i)
+    pygame.draw.rect(game, grey, rect)
+    pygame.draw.rect(game, black, rect, 2)
+    
+    label_text = render_text(label, font_size, dark_grey)
+    label_rect = label_text.get_rect(center=(rect.centerx, rect.bottom + 17))
+    label_strip = tile_label_strip(label_rect)
+    game.blit(get_background('select pokemon'), label_strip, label_strip)
+    game.blit(label_text, label_rect)
+    
+    mark_dirty(rect)
+    mark_dirty(label_strip)
+
+# Only the species on the shown page are fetched, built and drawn
+@instrument.timed('draw_pokemon_select_screen')
+def draw_pokemon_select_screen(page):
+    show_background('select pokemon')
+    font_size = 20
+    names, pokemons = page_pokemons(page)
+
+    # which page this is, and whether it is still loading
+    loading = any(pokemon is None and name not in failed_species for name, pokemon in zip(names, pokemons))
+    page_line = f'Page {page + 1} of {registry.page_count(SELECT_PAGE_SIZE)}' + (' - loading...' if loading else '')
+    if changed('page line', page_line):
+        page_rect = Rect(0, 65, game_width, 20)
+        game.blit(get_background('select pokemon'), page_rect, page_rect)
+        page_text = render_text(page_line, 14, black)
+        game.blit(page_text, page_text.get_rect(center=page_rect.center))
+        mark_dirty(page_rect)
+
+    for i in range(SELECT_PAGE_SIZE):
+        if i >= len(pokemons):
+            # the last page can be short; clear slots left over from a full one
+            if changed(('tile', i), None):
+                slot = Rect(25 + (i % 3) * 150, 100 + (i // 3) * 150, 150, 130)
+                game.blit(get_background('select pokemon'), slot, slot)
+                mark_dirty(slot)
+            continue
+        
+        pokemon = pokemons[i]
+        if pokemon is None:
+            label = 'Unavailable' if names[i] in failed_species else 'Loading...'
+            if changed(('tile', i), label):
+                draw_placeholder_tile(i, label)
+            continue
+        
         pokemon.size = 100
         pokemon.set_sprite('front_default')
-
-    for i, pokemon in enumerate(pokemons):
-        if i < 3:
-            pokemon.x = 50 + i * (pokemon.size + 50)
-            pokemon.y = 100
-        elif i < 6:
-            pokemon.x = 50 + (i - 3) * (pokemon.size + 50)
-            pokemon.y = 250
+        pokemon.x, pokemon.y = tile_rect(i).topleft
 
         rect = pokemon.get_rect()
 
         mouse_cursor = pygame.mouse.get_pos()
-        if rect.collidepoint(mouse_cursor):
+        hovered = rect.collidepoint(mouse_cursor)
+        
+        # only repaint a tile when its Pokemon or hover state changes
+        if not changed(('tile', i), (pokemon.name, hovered)):
+            continue
+        
+        if hovered:
             pygame.draw.rect(game, light_grey, rect)
         else:
             pygame.draw.rect(game, grey, rect)
@@ -563,29 +679,43 @@ def draw_pokemon_select_screen(pokemons):
         pygame.draw.rect(game, black, rect, 2)
         pokemon.draw()
 
-        name_text = font.render(pokemon.name, True, black)
+        name_text = render_text(pokemon.name, font_size, black)
         name_rect = name_text.get_rect(center=(pokemon.x + pokemon.image.get_width() // 2, pokemon.y + pokemon.image.get_height() + 17))
+        label_strip = tile_label_strip(name_rect)
+        game.blit(get_background('select pokemon'), label_strip, label_strip)
         game.blit(name_text, name_rect)
         
-        button_main_menu = create_button(150, 50, 20, 425, 95, 450, 'Main Menu')
-        button_stats = create_button(150, 50, 330, 425, 405, 450, 'Stats')
+        mark_dirty(rect)
+        mark_dirty(label_strip)
+        
+    button_main_menu = create_button(150, 50, 20, 425, 95, 450, 'Main Menu')
+    button_page_previous = create_button(60, 50, 185, 425, 215, 450, '<')
+    button_page_next = create_button(60, 50, 255, 425, 285, 450, '>')
+    button_stats = create_button(150, 50, 330, 425, 405, 450, 'Stats')
 
-    pygame.display.update()
-    return button_main_menu, button_stats
+    flush_display()
+    return button_main_menu, button_stats, button_page_previous, button_page_next
 
 current_pokemon_index = 0
 
-def draw_pokemon_stats_screen(pokemons, index):
-    game.fill(background_color)
-    pygame.draw.polygon(game, light_orange, [(0, 0), (game_width, 0), (0, game_height)])
-    pygame.draw.polygon(game, white, [(game_width, game_height), (game_width, 0), (0, game_height)])
-    font = pygame.font.Font(pygame.font.get_default_font(), 18)
+def draw_pokemon_stats_background(surface):
+    surface.fill(background_color)
+    pygame.draw.polygon(surface, light_orange, [(0, 0), (game_width, 0), (0, game_height)])
+    pygame.draw.polygon(surface, white, [(game_width, game_height), (game_width, 0), (0, game_height)])
+    font_size = 18
 
-    title = font.render("Pokemon Stats", True, black)
+    title = render_text("Pokemon Stats", font_size, black)
     title_rect = title.get_rect(center=(game_width // 2, 30))
-    game.blit(title, title_rect)
+    surface.blit(title, title_rect)
 
-    pokemon = pokemons[index]
+    pygame.draw.rect(surface, white, (150, 400, 200, 50))
+    pygame.draw.rect(surface, black, (150, 400, 200, 50), 2)
+    text = render_text("Press 'B' to go back", font_size, black)
+    text_rect = text.get_rect(center=(game_width // 2, 425))
+    surface.blit(text, text_rect)
+
+def draw_pokemon_details(pokemon):
+    font_size = 18
     
     status_names = {
         STATUS_BURN: "Burn",
@@ -598,15 +728,8 @@ def draw_pokemon_stats_screen(pokemons, index):
     
     move_name = MOVE_NAMES.get(pokemon.name, 'Attack')
     
-    # Get weakness display text
-    if pokemon.weakness:
-        weakness_text = f"Weakness: {pokemon.weakness}"
-    else:
-        # Check the type cycle weakness
-        if pokemon.type in WEAKNESSES and WEAKNESSES[pokemon.type]:
-            weakness_text = f"Weakness: {WEAKNESSES[pokemon.type]}"
-        else:
-            weakness_text = "Weakness: None"
+    # Get weakness display text from the type chart
+    weakness_text = f"Weakness: {', '.join(weaknesses(pokemon.type)) or 'None'}"
     
     pokemon_details = [
         f"Name: {pokemon.name}",
@@ -618,334 +741,546 @@ def draw_pokemon_stats_screen(pokemons, index):
         f"Effect: {status_names.get(pokemon.status_ability, 'None')}"
     ]
     
-    pokemon_image = pygame.transform.scale(pokemon.image, (330, 330))
+    pokemon_image = get_scaled_sprite(pokemon.json['sprites']['front_default'], 330)
     game.blit(pokemon_image, (game_width - 310, 70))
 
     y = 90
     for detail in pokemon_details:
-        text = font.render(detail, True, black)
+        text = render_text(detail, font_size, black)
         text_rect = text.get_rect(left=30, top=y)
         game.blit(text, text_rect)
         y += 32
 
+@instrument.timed('draw_pokemon_stats_screen')
+def draw_pokemon_stats_screen(pokemons, index):
+    # the details only change when another Pokemon is shown
+    pokemon = pokemons[index % len(pokemons)]
+    if show_background('pokemon stats', pokemon.name):
+        draw_pokemon_details(pokemon)
+
     button_previous = create_button(100, 50, 20, 400, 70, 425, 'Previous')
     button_next = create_button(100, 50, 380, 400, 430, 425, 'Next')
 
-    pygame.draw.rect(game, white, (150, 400, 200, 50))
-    pygame.draw.rect(game, black, (150, 400, 200, 50), 2)
-    text = font.render("Press 'B' to go back", True, black)
-    text_rect = text.get_rect(center=(game_width // 2, 425))
-    game.blit(text, text_rect)
-
-    pygame.display.update()
+    flush_display()
     return button_previous, button_next
+
+# Builders for the static layers, by name
+background_builders = {
+    'main menu': draw_main_menu_background,
+    'instructions': draw_instructions_background,
+    'select pokemon': draw_pokemon_select_background,
+    'pokemon stats': draw_pokemon_stats_background,
+    'battle field': draw_battle_field,
+    'battle': draw_battle_scene,
+}
+    
+# Where each roster slot starts on the screen: three per row
+def roster_position(i):
+    return 25 + (i % 3) * 150, 50 + (i // 3) * 150
+
+# Fetch one species' JSON and then both of its sprites in parallel; the bytes
+# land in the asset cache so building the Pokemon later makes no network calls.
+# Bundled species need neither.
+@instrument.timed('fetch_species')
+def fetch_species(name, sprite_pool):
+    spec = registry.roster_spec(name)
+    if bundle and spec and bundle.species(spec[0]):
+        return spec, bundle.species(spec[0])
     
-# Create the pokemons with their specific weaknesses
-raichu = Pokemon('Raichu', 'Electric', 25, 50, 140, 30, STATUS_PARALYSIS, weakness='Ground')
-charizard = Pokemon('Charizard', 'Fire', 175, 50, 180, 40, STATUS_BURN, weakness='Water')
-venusaur = Pokemon('Venusaur', 'Grass', 325, 50, 230, 25, STATUS_SLEEP, weakness='Fire')
-gyarados = Pokemon('Gyarados', 'Water', 25, 200, 160, 45, STATUS_CONFUSION, weakness='Electric')
-nidoking = Pokemon('Nidoking', 'Ground', 175, 200, 150, 35, STATUS_POISON, weakness='Grass')
-dragonite = Pokemon('Dragonite', 'Dragon', 325, 200, 190, 50, None, weakness=None)  # Dragon has no weakness
-pokemons = [raichu, charizard, venusaur, gyarados, nidoking, dragonite]
+    spec, data = registry.species(name)
+    if not all(data['sprites'].values()):
+        raise ValueError(f'{name} has no sprites')
+    sprites = [sprite_pool.submit(asset_cache.fetch_bytes, url) for url in data['sprites'].values()]
+    for sprite in sprites:
+        sprite.result()
+    return spec, data
+
+# Posted to the event queue as each species (or the dex index) finishes loading
+SPECIES_LOADED = USEREVENT + 1
+DEX_LOADED = USEREVENT + 2
+
+# Every species in the dex by name; the roster comes first
+registry = SpeciesRegistry(base_url)
+
+# Species load in the background as their page is shown. Built Pokemon are
+# kept in a bounded LRU by API name.
+SELECT_PAGE_SIZE = 6
+pokemon_cache_size = 48
+pokemon_cache = OrderedDict()
+pending_species = {}
+failed_species = set()
+first_page_loaded = False
+
+species_pool = ThreadPoolExecutor(max_workers=SELECT_PAGE_SIZE)
+sprite_pool = ThreadPoolExecutor(max_workers=SELECT_PAGE_SIZE * 2)
+
+def post_species_loaded(name, future):
+    pygame.event.post(pygame.event.Event(SPECIES_LOADED, name=name, future=future))
+
+def post_dex_loaded(future):
+    pygame.event.post(pygame.event.Event(DEX_LOADED, future=future))
+
+# Fetch a species over the shared keep-alive session unless it is loaded or on its way
+def request_species(name):
+    if name in pokemon_cache or name in pending_species or name in failed_species:
+        return
+    future = species_pool.submit(fetch_species, name, sprite_pool)
+    pending_species[name] = future
+    future.add_done_callback(functools.partial(post_species_loaded, name))
+
+# The API names on a select page and their Pokemon (None until loaded)
+def page_pokemons(page):
+    names = registry.page(page, SELECT_PAGE_SIZE)
+    pokemons = []
+    for name in names:
+        request_species(name)
+        if name in pokemon_cache:
+            pokemon_cache.move_to_end(name)
+        pokemons.append(pokemon_cache.get(name))
+    return names, pokemons
+
+# Switch the select screen to another page, dropping queued fetches for the old one
+def turn_page(page):
+    page %= registry.page_count(SELECT_PAGE_SIZE)
+    names = registry.page(page, SELECT_PAGE_SIZE)
+    for name, future in pending_species.items():
+        if name not in names:
+            future.cancel()
+    return page
+
+# Build a Pokemon from its fetched data; surfaces are only made on the main thread
+def add_species(name, future):
+    global first_page_loaded
+    del pending_species[name]
+    if future.cancelled():
+        return
+    try:
+        spec, data = future.result()
+        x, y = roster_position(0)
+        pokemon = Pokemon(spec[0], spec[1], x, y, *spec[2:], data=data)
+    except Exception as error:
+        print(f'Could not load {name}: {error}')
+        failed_species.add(name)
+        return
+    
+    pokemon_cache[name] = pokemon
+    while len(pokemon_cache) > pokemon_cache_size:
+        pokemon_cache.popitem(last=False)
+    
+    if not first_page_loaded and all(name in pokemon_cache for name in registry.page(0, SELECT_PAGE_SIZE)):
+        first_page_loaded = True
+        if instrument.enabled:
+            instrument.record('first page', startup_started, time.perf_counter())
+
+def loaded_pokemons():
+    return [pokemon for pokemon in page_pokemons(select_page)[1] if pokemon]
+
+# Put every Pokemon back in its roster slot with its battle state restored,
+# reusing the loaded JSON and sprites
+def reset_roster(roster):
+    for i, pokemon in enumerate(roster):
+        if pokemon is None:
+            continue
+        pokemon.reset()
+        pokemon.x, pokemon.y = roster_position(i)
+        pokemon.size = 150
+        pokemon.set_sprite('front_default')
+
+# Start loading the roster's page right away
+select_page = 0
+page_pokemons(select_page)
 
 player_pokemon = None
 rival_pokemon = None
+battle = None
+battle_stream = None
+battles_played = 0
+recorder = None
 
+# a replay starts as soon as its two species are loaded
+replay_record = None
+replay_policy = None
 game_status = 'main menu'
+if replay_path:
+    try:
+        replay_record = next(itertools.islice(read_replays(replay_path), replay_index, None), None)
+    except BAD_REPLAY as error:
+        raise SystemExit(f'Could not read the replay log {replay_path}: {error}')
+    if replay_record is None:
+        raise SystemExit(f'{replay_path} has no battle {replay_index}')
+    game_status = 'load replay'
+
+# the connection to the battle server, the match it made and the player's
+# potions at the start of the turn, to tell it how many were drunk
+NETWORK_MESSAGE = USEREVENT + 4
+client = None
+online_match = None
+turn_potions = 0
+if server_address:
+    try:
+        client = BattleClient(server_address, lambda: pygame.event.post(pygame.event.Event(NETWORK_MESSAGE)))
+    except OSError as error:
+        print(f'Could not connect to {server_address}: {error}; playing offline')
+
+# then list the rest of the dex; the server only matches roster species, so
+# online the select screen keeps to the roster
+if not client:
+    species_pool.submit(registry.load_index).add_done_callback(post_dex_loaded)
 instructions_button = None
 play_button = None
 button_main_menu = None
 button_stats = None
+button_page_previous = None
+button_page_next = None
 button_previous = None
 button_next = None
+attack_button = None
+potion_button = None
 
-while game_status != 'quit':
+# Screens that only change in response to input
+idle_screens = ('main menu', 'instructions', 'select pokemon', 'pokemon stats', 'player turn', 'gameover',
+                'matchmaking')
+if replay_record:
+    # a replay plays the player's turns without waiting for input
+    idle_screens = tuple(screen for screen in idle_screens if screen != 'player turn')
+drawn_status = None
+clock = pygame.time.Clock()
+
+# Hit rates of the in-memory caches, for the overlay and the profile summary
+for cache_name, cached in (('font', get_font), ('text', render_text), ('sprite', get_sprite),
+                           ('scaled sprite', get_scaled_sprite), ('faded sprite', get_faded_sprite),
+                           ('species', registry.species)):
+    instrument.watch_cache(cache_name, cached)
+
+# The profiling overlay in the top-left corner: FPS, frame-time percentiles
+# and cache hit rates, refreshed twice a second while shown (F3 toggles it)
+OVERLAY_REFRESH = USEREVENT + 3
+OVERLAY_LINES = 8
+overlay_rect = Rect(0, 0, 300, 4 + 13 * OVERLAY_LINES)
+show_overlay = False
+
+def draw_overlay():
+    game.fill(black, overlay_rect)
+    font = get_font(12)
+    for i, line in enumerate(instrument.overlay_lines(clock.get_fps())[:OVERLAY_LINES]):
+        game.blit(font.render(line, True, white), (4, 2 + 13 * i))
+    pygame.display.update(overlay_rect)
+
+def set_overlay(shown):
+    global show_overlay
+    show_overlay = shown
+    pygame.time.set_timer(OVERLAY_REFRESH, 500 if shown else 0)
+    if not shown:
+        invalidate_display()
+
+set_overlay(instrument.show_overlay)
+
+# when the current frame's work began, after any wait for input
+frame_started = None
+
+# the game runs when this file is run; importing it (as the benchmarks do)
+# only sets everything up
+if __name__ == '__main__':
+    while game_status != 'quit':
+    
+        if frame_started is not None:
+            instrument.frame(frame_started, time.perf_counter())
     
-    for event in pygame.event.get():
-        if event.type == QUIT:
-            game_status = 'quit'
+        # drawn over the finished frame so it stays on top of it
+        if show_overlay:
+            draw_overlay()
+    
+        clock.tick(max_fps)
+        events = pygame.event.get()
+    
+        # Once an idle screen is drawn, sleep until the next event instead of redrawing it
+        if not events and not timeline.busy() and game_status in idle_screens and game_status == drawn_status:
+            events = [pygame.event.wait()] + pygame.event.get()
+        frame_started = time.perf_counter()
+    
+        for event in events:
+            if event.type == QUIT:
+                game_status = 'quit'
+        
+            # the window was uncovered; push the whole frame again
+            if event.type == VIDEOEXPOSE:
+                pygame.display.update()
+        
+            if event.type == SPECIES_LOADED:
+                add_species(event.name, event.future)
+        
+            if event.type == DEX_LOADED and event.future.exception():
+                print(f'Could not load the dex index: {event.future.exception()}')
             
-        if event.type == KEYDOWN:
+            if event.type == KEYDOWN:
             
-            if event.key == K_y and game_status == 'gameover':
-                raichu = Pokemon('Raichu', 'Electric', 25, 50, 140, 30, STATUS_PARALYSIS, weakness='Ground')
-                charizard = Pokemon('Charizard', 'Fire', 175, 50, 180, 40, STATUS_BURN, weakness='Water')
-                venusaur = Pokemon('Venusaur', 'Grass', 325, 50, 230, 25, STATUS_SLEEP, weakness='Fire')
-                gyarados = Pokemon('Gyarados', 'Water', 25, 200, 160, 45, STATUS_CONFUSION, weakness='Electric')
-                nidoking = Pokemon('Nidoking', 'Ground', 175, 200, 150, 35, STATUS_POISON, weakness='Grass')
-                dragonite = Pokemon('Dragonite', 'Dragon', 325, 200, 190, 50, None, weakness=None)
-                pokemons = [raichu, charizard, venusaur, gyarados, nidoking, dragonite]
-                game_status = 'select pokemon'
+                if event.key == K_y and game_status == 'gameover' and not timeline.busy():
+                    reset_roster(pokemon_cache.values())
+                    game_status = 'load replay' if replay_record else 'select pokemon'
                 
-            elif event.key == K_n:
-                game_status = 'quit'
+                elif event.key == K_F3 and instrument.enabled:
+                    set_overlay(not show_overlay)
+            
+                elif event.key == K_n:
+                    game_status = 'quit'
             
-            elif event.key == K_b and game_status == 'instructions':
-                game_status = 'main menu'
+                elif event.key == K_b and game_status == 'instructions':
+                    game_status = 'main menu'
                 
-            elif event.key == K_b and game_status == 'pokemon stats':
-                game_status = 'select pokemon'
+                elif event.key == K_b and game_status == 'pokemon stats':
+                    game_status = 'select pokemon'
+            
+                elif event.key == K_LEFT and game_status == 'select pokemon':
+                    select_page = turn_page(select_page - 1)
+            
+                elif event.key == K_RIGHT and game_status == 'select pokemon':
+                    select_page = turn_page(select_page + 1)
             
-        if event.type == MOUSEBUTTONDOWN:
+            if event.type == MOUSEBUTTONDOWN:
             
-            mouse_click = event.pos
+                mouse_click = event.pos
             
-            if game_status == 'main menu':
-                if instructions_button.collidepoint(mouse_click):
-                    game_status = 'instructions'
-                elif play_button.collidepoint(mouse_click):
-                    game_status = 'select pokemon'  
+                if game_status == 'main menu':
+                    if instructions_button.collidepoint(mouse_click):
+                        game_status = 'instructions'
+                    elif play_button.collidepoint(mouse_click):
+                        game_status = 'select pokemon'  
                     
-            elif game_status == 'select pokemon':
+                elif game_status == 'select pokemon':
                 
-                if button_main_menu and button_main_menu.collidepoint(mouse_click):
-                    game_status = 'main menu'
+                    if button_main_menu and button_main_menu.collidepoint(mouse_click):
+                        game_status = 'main menu'
                 
-                elif button_stats and button_stats.collidepoint(mouse_click):
-                    game_status = 'pokemon stats'
-                    
-                for i in range(len(pokemons)):
+                    elif button_stats and button_stats.collidepoint(mouse_click) and loaded_pokemons():
+                        game_status = 'pokemon stats'
+                
+                    elif button_page_previous and button_page_previous.collidepoint(mouse_click):
+                        select_page = turn_page(select_page - 1)
+                
+                    elif button_page_next and button_page_next.collidepoint(mouse_click):
+                        select_page = turn_page(select_page + 1)
+                
+                    for i, pokemon in enumerate(page_pokemons(select_page)[1]):
                     
-                    if pokemons[i].get_rect().collidepoint(mouse_click):
-                        
-                        player_pokemon = pokemons[i]
-                        rival_pokemon = random.choice(pokemons)
+                        if pokemon and tile_rect(i).collidepoint(mouse_click) and client:
+                            
+                            # the server picks the rival and the battle
+                            client.join(pokemon.name, online_opponent)
+                            online_match = None
+                            game_status = 'matchmaking'
                         
-                        while rival_pokemon == player_pokemon:
-                            rival_pokemon = random.choice(pokemons)
+                        elif pokemon and tile_rect(i).collidepoint(mouse_click):
                         
-                        player_pokemon.hp_x = 225
-                        player_pokemon.hp_y = 275
-                        rival_pokemon.hp_x = 100
-                        rival_pokemon.hp_y = 50
+                            # the rival is picked from the Pokemon loaded so far
+                            rivals = [rival for rival in pokemon_cache.values() if rival != pokemon]
+                            if not rivals:
+                                break
                         
-                        game_status = 'prebattle'
+                            battle_stream = BattleStream(session_seed, battles_played)
+                            roll = battle_stream.uniform(MATCHUP_ROLL)
+                            choose_fighters(pokemon, rivals[int(roll * len(rivals))])
+                            game_status = 'prebattle'
             
-            elif game_status == 'player turn':
-                update_display()
-                if attack_button.collidepoint(mouse_click):
-                    player_pokemon.perform_attack(rival_pokemon)
-                    if rival_pokemon.current_hp == 0:
-                        game_status = 'fainted'
-                    else:
-                        # Apply status damage/update
-                        if rival_pokemon.status != STATUS_PARALYSIS:
-                            player_pokemon.apply_status_damage_at_turn_end()
-                        if player_pokemon.current_hp == 0:
-                            game_status = 'fainted'
-                        else:
-                            game_status = 'rival turn'     
+                # the buttons only count once the turn's status check has let the player act
+                elif game_status == 'player turn' and not timeline.busy() and battle.can_act:
+                    update_display()
+                    if attack_button and attack_button.collidepoint(mouse_click):
+                        if client:
+                            client.send_action(battle.turns, turn_potions - player_pokemon.num_potions)
+                        play_events(battle.attack())
+                        game_status = battle_status(battle)
                     
-                elif potion_button.collidepoint(mouse_click):
-                    player_pokemon.use_potion()
-                    # Don't end turn - stay on 'player turn' to allow attack or more potions
+                    elif potion_button and potion_button.collidepoint(mouse_click):
+                        play_events(battle.use_potion())
+                        # Don't end turn - stay on 'player turn' to allow attack or more potions
                                   
-            elif game_status == 'pokemon stats':
-                if button_previous and button_previous.collidepoint(mouse_click):
-                    current_pokemon_index = (current_pokemon_index - 1) % len(pokemons)
-                elif button_next and button_next.collidepoint(mouse_click):
-                    current_pokemon_index = (current_pokemon_index + 1) % len(pokemons)
+                elif game_status == 'pokemon stats':
+                    if button_previous and button_previous.collidepoint(mouse_click):
+                        current_pokemon_index = (current_pokemon_index - 1) % len(loaded_pokemons())
+                    elif button_next and button_next.collidepoint(mouse_click):
+                        current_pokemon_index = (current_pokemon_index + 1) % len(loaded_pokemons())
+    
+        # Let queued battle messages and animations play out before the next step
+        if timeline.busy():
+            timeline.update()
+            if not timeline.busy():
+                # the screen the last step played over has not been drawn yet
+                drawn_status = None
+            continue
     
-    if game_status == 'main menu':
-        instructions_button, play_button = draw_main_menu()
+        drawn_status = game_status
+    
+        if game_status == 'main menu':
+            instructions_button, play_button = draw_main_menu()
 
-    elif game_status == 'instructions':
-        draw_instructions()
+        elif game_status == 'instructions':
+            draw_instructions()
         
-    elif game_status == 'select pokemon':
-        button_main_menu, button_stats = draw_pokemon_select_screen(pokemons)
+        elif game_status == 'select pokemon':
+            button_main_menu, button_stats, button_page_previous, button_page_next = draw_pokemon_select_screen(select_page)
     
-    elif game_status == 'pokemon stats':
-        button_previous, button_next = draw_pokemon_stats_screen(pokemons, current_pokemon_index)
-        
-    elif game_status == 'prebattle':
+        elif game_status == 'pokemon stats':
+            button_previous, button_next = draw_pokemon_stats_screen(loaded_pokemons(), current_pokemon_index)
         
-        game.fill(white)
-        player_pokemon.draw()
-        pygame.display.update()
+        elif game_status == 'load replay':
         
-        player_pokemon.x = 0
-        player_pokemon.y = 150
-        rival_pokemon.x = 300
-        rival_pokemon.y = 25
+            # the replayed Pokemon fight with their recorded stat lines
+            loaded = load_fighters(replay_record.specs)
+            if loaded is None:
+                print('Could not load the replayed Pokemon')
+                game_status = 'quit'
+            elif loaded:
+                battle_stream = BattleStream(replay_record.seed, replay_record.battle_id)
+                game_status = 'prebattle'
         
-        player_pokemon.size = 200
-        rival_pokemon.size = 200
-        player_pokemon.set_sprite('back_default')
-        rival_pokemon.set_sprite('front_default')
+        elif game_status == 'matchmaking':
         
-        game_status = 'start battle'
+            # wait for the server to pair the player, then load both sides
+            online_match = online_match or client.take_match()
+            error = client.take_error()
+            if error:
+                timeline.add(functools.partial(display_message, error), 2)
+                invalidate_display()
+                game_status = 'select pokemon'
+            elif online_match is None:
+                display_message('Waiting for a rival...')
+            else:
+                loaded = load_fighters(online_match.specs)
+                if loaded is None:
+                    timeline.add(functools.partial(display_message, 'Could not load the rival'), 2)
+                    client.leave()
+                    invalidate_display()
+                    game_status = 'select pokemon'
+                elif loaded:
+                    battle_stream = match_stream(online_match)
+                    game_status = 'prebattle'
         
-    elif game_status == 'start battle':
+        elif game_status == 'prebattle':
         
-        alpha = 0
-        while alpha < 255:
-            game.fill(combat_background_grass_color)
-            pygame.draw.rect(game, combat_background_sky_color, (0, 0, game_width, 150))
-            rival_pokemon.draw(draw_grass_pad=True)
-            rival_pokemon.draw(alpha)
-            display_message(f'Rival sent out {rival_pokemon.name}!')
-            alpha += .4
-            pygame.display.update()
-        rival_pokemon.draw_hp()
-        pygame.display.update()
-            
-        time.sleep(1)
-        
-        alpha = 0
-        while alpha < 255:
-            player_pokemon.draw(draw_grass_pad=True)
-            player_pokemon.draw(alpha)
-            display_message(f'Go {player_pokemon.name}!')
-            alpha += .4 
+            game.fill(white)
+            player_pokemon.draw()
             pygame.display.update()
-        player_pokemon.draw_hp()
-        pygame.display.update()
-        
-        # Coin flip to see who goes first
-        time.sleep(2)
-        coin = random.choice(['Heads', 'Tails'])
-        display_message(f'Flipping coin to see who goes first...')
-        time.sleep(3)
-
-        display_message(f'{coin}!')
-        time.sleep(2)
-        
-        if coin == 'Heads': 
-            display_message('Player goes first!')
-            time.sleep(2)
-            game_status = 'player turn'
-        else:
-            display_message('Rival goes first!')
-            time.sleep(2)
-            game_status = 'rival turn'
-            
-        pygame.display.update()
         
-    elif game_status == 'player turn':
+            player_pokemon.x = 0
+            player_pokemon.y = 150
+            rival_pokemon.x = 300
+            rival_pokemon.y = 25
         
-        # Check status at START of turn
-        if not player_status_checked:
-            can_act = player_pokemon.check_status_at_turn_start()
-            player_status_checked = True  # Mark as checked
-            
-            if not can_act:
-                # Cannot act, turn ends
-                time.sleep(2)
-                display_message(f'{player_pokemon.name} cannot attack this turn!')
-                time.sleep(2)
-                
-                # Apply status damage/update
-                rival_pokemon.apply_status_damage_at_turn_end() 
-                player_pokemon.apply_status_damage_at_turn_end()
-                if rival_pokemon.current_hp == 0:
-                    game_status = 'fainted'
-                else:
-                    game_status = 'rival turn'
-                    rival_status_checked = False  # Reset for rival's turn
-                
-                pygame.display.update()
+            player_pokemon.size = 200
+            rival_pokemon.size = 200
+            player_pokemon.set_sprite('back_default')
+            rival_pokemon.set_sprite('front_default')
+        
+            # the battle scene layer is rebuilt for the new pair of Pokemon
+            backgrounds.pop('battle', None)
+            invalidate_display()
+        
+            battle = Battle(player_pokemon, rival_pokemon, battle_stream)
+            battles_played += 1
+            # a replay is checked against its record; online battles are the
+            # server's to record
+            recorder = ReplayRecorder(battle) if replay_record or (replay_log_path and not client) else None
+            if replay_record:
+                replay_policy = ReplayPolicy(replay_record)
+            elif isinstance(rival_policy, SearchPolicy) and not client:
+                rival_policy.prepare(battle)
+            game_status = 'start battle'
+        
+        elif game_status == 'start battle':
+        
+            timeline.animate(functools.partial(send_out, rival_pokemon, f'Rival sent out {rival_pokemon.name}!'), fade_duration)
+            timeline.add(functools.partial(show_hp, rival_pokemon), 1)
+            timeline.animate(functools.partial(send_out, player_pokemon, f'Go {player_pokemon.name}!'), fade_duration)
+            timeline.add(functools.partial(show_hp, player_pokemon), 2)
+            timeline.add(invalidate_display)
+        
+            # Coin flip to see who goes first
+            play_events(battle.start())
+            game_status = battle_status(battle)
+        
+        elif game_status == 'player turn':
+        
+            if client and not online_turn_ready():
                 continue
+        
+            # Check status at START of turn
+            if not battle.turn_started:
+                play_events(battle.start_turn())
+                turn_potions = player_pokemon.num_potions
             
-        # Can act - show buttons
-        game.fill(combat_background_grass_color)
-        pygame.draw.rect(game, combat_background_sky_color, (0, 0, game_width, 150))
-        player_pokemon.draw(draw_grass_pad=True)
-        rival_pokemon.draw(draw_grass_pad=True)
-        player_pokemon.draw_hp()
-        rival_pokemon.draw_hp()
-            
-        attack_button = create_button(240, 140, 10, 350, 130, 420, 'Attack')
-        potion_button = create_button(240, 140, 250, 350, 370, 420, f'Potion ({player_pokemon.num_potions})')
-
-        pygame.draw.line(game, black, (250, 350), (250, 490), 3)
-        pygame.draw.rect(game, black, (10, 350, 480, 140), 3)
+                if not battle.can_act:
+                    # Cannot act, turn ends
+                    game_status = battle_status(battle)
             
-        pygame.display.update()
+                # the buttons appear once the status messages have played
+                drawn_status = None
+                continue
         
-    elif game_status == 'rival turn':
-        # Reset for player's next turn
-        player_status_checked = False
+            # a replay plays the recorded actions instead of waiting for clicks
+            if replay_policy:
+                for action in replay_policy(battle):
+                    if action == ACTION_POTION:
+                        play_events(battle.use_potion())
+                    else:
+                        play_events(battle.attack())
+                game_status = battle_status(battle)
+                continue
+            
+            # Can act - show buttons
+            attack_button, potion_button = draw_battle_screen()
         
-        # First, update the display
-        update_display()
+        elif game_status == 'rival turn':
         
-        # Check status at START of turn
-        can_act = rival_pokemon.check_status_at_turn_start()
+            if client and not online_turn_ready():
+                continue
         
-        if not can_act:
-            # Cannot act, turn ends
-            time.sleep(2)
-            display_message(f'{rival_pokemon.name} cannot attack this turn!')
-            time.sleep(2)
-            
-            # Apply status damage/update
-            player_pokemon.apply_status_damage_at_turn_end()  
-            rival_pokemon.apply_status_damage_at_turn_end()
-            if player_pokemon.current_hp == 0:
-                game_status = 'fainted'
-            else:
-                game_status = 'player turn'
-            
-            pygame.display.update()
+            if not battle.turn_started:
+                # First, update the display
+                timeline.add(functools.partial(update_display, battle.snapshot()))
             
-        else:
-            # Rival can act
-            display_message('Rival is thinking...')
-            time.sleep(2)
-
-            # AI decision: use potion if low HP
-            if (rival_pokemon.max_hp - rival_pokemon.current_hp >= 50) and rival_pokemon.num_potions > 0:
-                rival_pokemon.use_potion()
+                # Check status at START of turn
+                play_events(battle.start_turn())
                 
-                # Update the display to show the new HP and status cleared
-                update_display()
-                time.sleep(2) 
-                rival_pokemon.perform_attack(player_pokemon)
-            else:
-                # AI attacks
-                rival_pokemon.perform_attack(player_pokemon)
-                            
-            if player_pokemon.current_hp == 0:
-                game_status = 'fainted'
-            else:
-                # Apply status damage/effect
-                if player_pokemon.status != STATUS_PARALYSIS:
-                    rival_pokemon.apply_status_damage_at_turn_end()
-                if rival_pokemon.current_hp == 0:
-                    game_status = 'fainted'
-                else: 
-                    game_status = 'player turn'
-            
-            pygame.display.update()
+                if battle.can_act:
+                    timeline.add(functools.partial(display_message, 'Rival is thinking...'), 2)
         
-    elif game_status == 'fainted':
+            if battle.can_act:
+                # Rival can act; online its actions come from the server
+                if client:
+                    actions = client.actions(battle)
+                    if actions is None:
+                        continue
+                else:
+                    with instrument.timer('rival decision'):
+                        actions = (replay_policy or rival_policy)(battle)
+                for action in actions:
+                    if action == ACTION_POTION:
+                        play_events(battle.use_potion())
+                    else:
+                        play_events(battle.attack())
         
-        alpha = 255
-        while alpha > 0:
-            
-            game.fill(combat_background_grass_color)
-            pygame.draw.rect(game, combat_background_sky_color, (0, 0, game_width, 150))
-            player_pokemon.draw_hp()
-            rival_pokemon.draw_hp()
-            
-            if rival_pokemon.current_hp == 0:
-                player_pokemon.draw(draw_grass_pad=True)
-                rival_pokemon.draw(alpha, draw_grass_pad=True)
-                display_message(f'{rival_pokemon.name} fainted!')
-            else:
-                player_pokemon.draw(alpha, draw_grass_pad=True)
-                rival_pokemon.draw(draw_grass_pad=True)
-                display_message(f'{player_pokemon.name} fainted!')
-            alpha -= .4
-            
-            pygame.display.update()
-            
-        game_status = 'gameover'
+            game_status = battle_status(battle)
+        
+        elif game_status == 'fainted':
+        
+            if client and not online_turn_ready():
+                continue
         
-    if game_status == 'gameover':
+            timeline.animate(fade_out_loser, fade_duration)
+            timeline.add(invalidate_display)
+            game_status = 'gameover'
+            finish_recording()
         
-        display_message('Play again (Y/N)?')
+        elif game_status == 'gameover':
         
-pygame.quit()
\ No newline at end of file
+            display_message('Play again (Y/N)?')
+        
+    finish_recording()
+
+    if client:
+        client.close()
+
+    # don't wait for downloads nobody will see
+    species_pool.shutdown(wait=False, cancel_futures=True)
+    sprite_pool.shutdown(wait=False, cancel_futures=True)
+    pygame.quit()
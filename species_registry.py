@@ -0,0 +1,117 @@
+# Registry of every species in the PokeAPI dex
+#
+# The registry starts out holding the hand-tuned ROSTER and grows to the
+# whole dex once the species index has been fetched. Only names are held for
+# the whole dex; species data is fetched when a species is first asked for
+# and kept in a bounded LRU, so memory follows what is being looked at, not
+# how many species exist.
+
+import bisect
+import functools
+
+import asset_cache
+import asset_bundle
+from battle_engine import ROSTER
+
+# how many species' data to keep in memory
+species_cache_size = 64
+
+# PokeAPI numbers alternate forms from 10001; the dex proper comes before
+FIRST_FORM_ID = 10001
+
+
+# The dex number at the end of a PokeAPI resource URL
+def resource_id(url):
+    return int(url.rstrip('/').rsplit('/', 1)[1])
+
+
+def base_stat(data, stat):
+    for entry in data['stats']:
+        if entry['stat']['name'] == stat:
+            return entry['base_stat']
+    return 0
+
+
+# A roster-style spec (name, type, hp, attack, status ability) for a species
+# that has no hand-tuned one, scaled from its base stats to the roster's
+# TCG-style numbers. Dual-typed species get a type like 'Grass/Poison'.
+def derive_spec(name, data):
+    types = sorted(data['types'], key=lambda entry: entry['slot'])
+    type = '/'.join(entry['type']['name'].title() for entry in types) or 'Normal'
+    hp = min(max(round(base_stat(data, 'hp') * 2, -1), 60), 300)
+    attack = min(max(5 * round(base_stat(data, 'attack') / 15), 10), 60)
+    return (name, type, hp, attack, None)
+
+
+class SpeciesRegistry:
+
+    def __init__(self, base_url, roster=ROSTER, cache_size=None):
+        self.base_url = base_url
+
+        # API names in display order: the roster first, then the rest of the dex
+        self.roster_specs = {spec[0].lower(): spec for spec in roster}
+        self.names = list(self.roster_specs)
+
+        # name -> position and sorted names for lookups, type -> names once fetched
+        self.index_names(self.names)
+        self.type_names = {}
+
+        self.species = functools.lru_cache(maxsize=cache_size or species_cache_size)(self.fetch_species)
+
+    def __len__(self):
+        return len(self.names)
+
+    # Fetch the names of the whole dex; safe to call from a loader thread
+    def load_index(self):
+        listing = asset_cache.fetch_json(f'{self.base_url}/pokemon?limit=100000')
+        names = list(self.names)
+        known = set(names)
+        for entry in listing['results']:
+            if entry['name'] not in known and resource_id(entry['url']) < FIRST_FORM_ID:
+                names.append(entry['name'])
+                known.add(entry['name'])
+
+        # swap the lists in whole so readers never see a half-built index
+        self.index_names(names)
+
+    def index_names(self, names):
+        self.positions = {name: i for i, name in enumerate(names)}
+        self.sorted_names = sorted(names)
+        self.names = names
+
+    def page_count(self, per_page):
+        return max(1, -(-len(self.names) // per_page))
+
+    # The API names shown on one page
+    def page(self, number, per_page):
+        return self.names[number * per_page:(number + 1) * per_page]
+
+    # Position of the first species whose name starts with prefix, or None
+    def find(self, prefix):
+        prefix = prefix.lower()
+        i = bisect.bisect_left(self.sorted_names, prefix)
+        if i < len(self.sorted_names) and self.sorted_names[i].startswith(prefix):
+            return self.positions[self.sorted_names[i]]
+        return None
+
+    # Names of every known species of a type (e.g. 'fire'), fetched once per type
+    def of_type(self, type):
+        type = type.lower()
+        if type not in self.type_names:
+            data = asset_cache.fetch_json(f'{self.base_url}/type/{type}')
+            self.type_names[type] = [entry['pokemon']['name'] for entry in data['pokemon']]
+        return [name for name in self.type_names[type] if name in self.positions]
+
+    # The hand-tuned spec of a roster species, or None
+    def roster_spec(self, name):
+        return self.roster_specs.get(name)
+
+    def display_name(self, name):
+        spec = self.roster_specs.get(name)
+        return spec[0] if spec else name.title()
+
+    # (spec, trimmed data) for one species; wrapped in the LRU as species()
+    def fetch_species(self, name):
+        data = asset_cache.fetch_json(f'{self.base_url}/pokemon/{name}')
+        spec = self.roster_specs.get(name) or derive_spec(self.display_name(name), data)
+        return spec, asset_bundle.trim_species(data)
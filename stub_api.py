@@ -0,0 +1,190 @@
+# A local stand-in for the parts of PokeAPI the game uses
+#
+# Serves /pokemon/{name} JSON, the /pokemon?limit= index and the front and
+# back sprites of the roster, so loading can be benchmarked with no network.
+# Responses come from a fixtures directory recorded from the real API when
+# one is given; otherwise they are synthesized: JSON padded with moves to
+# the size of a real response and plain generated PNG sprites. An optional
+# delay per request stands in for network latency. Record fixtures, or
+# serve them, with:
+#
+#     python stub_api.py record <fixtures dir> [api base url]
+#     python stub_api.py [port] [fixtures dir] [latency in seconds]
+#
+# Fixtures layout: pokemon/<name>.json as the API returned it, and
+# sprites/<name>-<side>.png for the sprites it links to.
+
+import io
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pygame
+
+import asset_bundle
+from battle_engine import ROSTER
+
+# national dex number and PokeAPI types of each roster species
+SPECIES = {
+    'raichu': (26, ('electric',)),
+    'charizard': (6, ('fire', 'flying')),
+    'venusaur': (3, ('grass', 'poison')),
+    'gyarados': (130, ('water', 'flying')),
+    'nidoking': (34, ('poison', 'ground')),
+    'dragonite': (149, ('dragon', 'flying')),
+}
+
+# synthesized species JSON is padded to about this many bytes, the size of
+# a typical real /pokemon/{name} response
+species_size = 250 * 1024
+SPRITE_SIZE = 96
+
+
+# A synthesized /pokemon/{name} response whose sprites point at base
+def synthesize_species(name, base):
+    spec = next(spec for spec in ROSTER if spec[0].lower() == name)
+    number, types = SPECIES[name]
+    data = {
+        'id': number,
+        'name': name,
+        'types': [{'slot': i + 1, 'type': {'name': type}} for i, type in enumerate(types)],
+        'stats': [
+            {'base_stat': spec[2] // 2, 'stat': {'name': 'hp'}},
+            {'base_stat': spec[3] * 3, 'stat': {'name': 'attack'}},
+        ],
+        'sprites': {side: f'{base}/sprites/{name}-{side}.png' for side in asset_bundle.SIDES},
+        'moves': [],
+    }
+    size = len(json.dumps(data))
+    while size < species_size:
+        move = {
+            'move': {'name': f'move-{len(data["moves"])}', 'url': f'{base}/api/v2/move/{len(data["moves"])}/'},
+            'version_group_details': [{'level_learned_at': 1, 'move_learn_method': {'name': 'level-up'}}],
+        }
+        data['moves'].append(move)
+        size += len(json.dumps(move)) + 2
+    return data
+
+
+# A plain PNG sprite, different for every species and side
+def synthesize_sprite(name, side):
+    number = SPECIES[name][0]
+    surface = pygame.Surface((SPRITE_SIZE, SPRITE_SIZE), pygame.SRCALPHA)
+    color = (number * 37 % 256, number * 91 % 256, 200 if side == 'front_default' else 80, 255)
+    pygame.draw.circle(surface, color, (SPRITE_SIZE // 2, SPRITE_SIZE // 2), SPRITE_SIZE // 2 - 4)
+    buffer = io.BytesIO()
+    pygame.image.save(surface, buffer, 'sprite.png')
+    return buffer.getvalue()
+
+
+class StubAPI:
+
+    def __init__(self, fixtures=None, latency=0, port=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+        self.url = self.base + '/api/v2'
+        self.thread = None
+
+        # every response body is built once up front, so serving costs the
+        # same on every request
+        self.responses = {}
+        for name in SPECIES:
+            data = self.load_species(name)
+            self.responses[f'/api/v2/pokemon/{name}'] = json.dumps(data).encode()
+            for side in asset_bundle.SIDES:
+                self.responses[f'/sprites/{name}-{side}.png'] = self.load_sprite(name, side)
+        self.responses['/api/v2/pokemon'] = json.dumps({
+            'count': len(SPECIES),
+            'results': [{'name': name, 'url': f'{self.url}/pokemon/{number}/'}
+                        for name, (number, types) in SPECIES.items()],
+        }).encode()
+
+    def load_species(self, name):
+        if not self.fixtures:
+            return synthesize_species(name, self.base)
+        with open(os.path.join(self.fixtures, 'pokemon', f'{name}.json')) as f:
+            data = json.load(f)
+        for side in asset_bundle.SIDES:
+            data['sprites'][side] = f'{self.base}/sprites/{name}-{side}.png'
+        return data
+
+    def load_sprite(self, name, side):
+        if not self.fixtures:
+            return synthesize_sprite(name, side)
+        with open(os.path.join(self.fixtures, 'sprites', f'{name}-{side}.png'), 'rb') as f:
+            return f.read()
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            # keep-alive, like the real API
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = stub.responses.get(urlsplit(self.path).path.rstrip('/'))
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png' if self.path.endswith('.png') else 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    # Serve from a background thread
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Save the roster's species JSON and sprites from a real API as fixtures
+def record(fixtures, base_url=asset_bundle.base_url):
+    import asset_cache
+
+    os.makedirs(os.path.join(fixtures, 'pokemon'), exist_ok=True)
+    os.makedirs(os.path.join(fixtures, 'sprites'), exist_ok=True)
+    for name in SPECIES:
+        content = asset_cache.fetch_bytes(f'{base_url}/pokemon/{name}')
+        with open(os.path.join(fixtures, 'pokemon', f'{name}.json'), 'wb') as f:
+            f.write(content)
+        sprites = json.loads(content)['sprites']
+        for side in asset_bundle.SIDES:
+            with open(os.path.join(fixtures, 'sprites', f'{name}-{side}.png'), 'wb') as f:
+                f.write(asset_cache.fetch_bytes(sprites[side]))
+        print(f'Recorded {name}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'record':
+        record(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else asset_bundle.base_url)
+        sys.exit()
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    fixtures = sys.argv[2] if len(sys.argv) > 2 else None
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    stub = StubAPI(fixtures, latency, port)
+    print(f'Serving {"recorded" if fixtures else "synthesized"} responses at {stub.url}')
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,61 @@
+# Non-blocking scheduler for battle pacing
+#
+# Messages and animations are queued as steps with how long each stays on
+# screen. The game loop calls update() once per frame; it starts whatever
+# step is due and returns straight away, so the loop keeps pumping events
+# (and QUIT keeps working) while a battle plays out.
+
+import time
+from collections import deque
+
+
+class Timeline:
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.steps = deque()
+
+        # the step being played and when it started
+        self.current = None
+        self.started_at = 0
+
+    # Run action once, then hold for duration seconds
+    def add(self, action, duration=0):
+        self.steps.append((action, None, duration))
+
+    # Call animate(progress) on every frame for duration seconds, with
+    # progress going from 0 to 1
+    def animate(self, animate, duration):
+        self.steps.append((None, animate, duration))
+
+    def wait(self, duration):
+        self.steps.append((None, None, duration))
+
+    def busy(self):
+        return self.current is not None or bool(self.steps)
+
+    def clear(self):
+        self.steps.clear()
+        self.current = None
+
+    # Play whatever is due; never blocks
+    def update(self):
+        now = self.clock()
+        while True:
+            if self.current is not None:
+                action, animate, duration = self.current
+                elapsed = now - self.started_at
+                if animate is not None:
+                    animate(min(elapsed / duration, 1) if duration else 1)
+                if elapsed < duration:
+                    return
+                self.current = None
+
+            if not self.steps:
+                return
+
+            self.current = self.steps.popleft()
+            self.started_at = now
+            action = self.current[0]
+            if action is not None:
+                action()
@@ -0,0 +1,282 @@
+# Headless tournaments between species and AI policies
+#
+# Every entrant is a species played by one of the AI difficulties, labelled
+# like 'Pikachu/hard'. A round-robin plays every pair of entrants once; a
+# Swiss tournament plays a few rounds, pairing entrants with equal scores who
+# have not met yet. Each pairing plays a number of games with the entrants
+# swapping sides every game.
+#
+# Battles run in chunks across a process pool on every core. Only a bounded
+# number of chunks is in flight at once and each battle is written out as
+# soon as its chunk finishes, so memory stays flat however many games are
+# played. Every battle draws from the battle_rng stream of the tournament
+# seed and its battle id, so any single game can be played again on its own, and every battle can
+# also be written to a replay log (see battle_replay.py). Stat lines can be
+# overridden from a JSON file to compare balance changes:
+#
+#     python tournament.py [--format round-robin|swiss] [--games N] [--output results.csv] [--replays log]
+#
+# The roster file holds a list of [name, type, hp, attack, status ability]
+# specs; a spec replaces the roster species of the same name or adds a new one.
+
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from battle_ai import DIFFICULTIES, SearchPolicy, make_policy
+from battle_engine import ROSTER, PLAYER, RIVAL, Battle, Fighter, play_battle
+from battle_replay import ReplayRecorder, ReplayWriter, encode
+from battle_rng import BattleStream
+from battle_solver import check_spec
+
+FORMATS = ('round-robin', 'swiss')
+FIELDS = ('battle_id', 'round', 'player', 'rival', 'winner', 'turns')
+
+# battles played by one worker task, and how many tasks each worker may have
+# queued before the next is submitted
+chunk_size = 500
+tasks_per_worker = 4
+
+
+# The roster with any specs from a JSON file swapped in
+def load_roster(path=None):
+    roster = list(ROSTER)
+    if path is None:
+        return roster
+    with open(path) as f:
+        overrides = [tuple(spec) for spec in json.load(f)]
+    positions = {spec[0]: i for i, spec in enumerate(roster)}
+    for spec in overrides:
+        if spec[0] in positions:
+            roster[positions[spec[0]]] = spec
+        else:
+            roster.append(spec)
+    return roster
+
+
+def label(entrant):
+    spec, difficulty = entrant
+    return f'{spec[0]}/{difficulty}'
+
+
+# One policy per difficulty per worker process, so search tables are reused
+# across every battle the worker plays
+_worker_policies = {}
+
+
+def _policy(difficulty):
+    if difficulty not in _worker_policies:
+        _worker_policies[difficulty] = make_policy(difficulty)
+    return _worker_policies[difficulty]
+
+
+# Play count battles of a pairing from first_id on; game k of the pairing has
+# entrant a as the player when k is even. Returns (battle id, whether a won,
+# turns, encoded replay or None) per battle.
+def play_chunk(a, b, first_game, first_id, count, seed, record=False):
+    results = []
+    for game in range(first_game, first_game + count):
+        battle_id = first_id + game - first_game
+        player, rival = (a, b) if game % 2 == 0 else (b, a)
+        battle = Battle(Fighter(*player[0]), Fighter(*rival[0]), BattleStream(seed, battle_id))
+        recorder = ReplayRecorder(battle) if record else None
+
+        player_policy, rival_policy = _policy(player[1]), _policy(rival[1])
+        for policy in {player_policy, rival_policy}:
+            if isinstance(policy, SearchPolicy):
+                policy.prepare(battle)
+
+        play_battle(battle, player_policy, rival_policy)
+        a_won = battle.winner == (PLAYER if game % 2 == 0 else RIVAL)
+        results.append((battle_id, a_won, battle.turns, recorder and encode(recorder.record(battle))))
+    return results
+
+
+# Writes one row per battle to a CSV or JSON Lines file ('-' is stdout as CSV)
+class ResultWriter:
+
+    def __init__(self, path):
+        self.file = sys.stdout if path == '-' else open(path, 'w', newline='')
+        self.jsonl = path.endswith('.jsonl')
+        if not self.jsonl:
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(FIELDS)
+
+    def write(self, row):
+        if self.jsonl:
+            self.file.write(json.dumps(dict(zip(FIELDS, row))) + '\n')
+        else:
+            self.csv.writerow(row)
+
+    def close(self):
+        self.file.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class Tournament:
+
+    def __init__(self, entrants, games, seed, writer, replay_writer=None):
+        self.entrants = entrants
+        self.games = games
+        self.seed = seed
+        self.writer = writer
+        self.replay_writer = replay_writer
+        self.next_id = 0
+
+        # per entrant: match points (1 per pairing won, half per pairing
+        # drawn), battles won and played, and who it has already met
+        self.points = [0.0] * len(entrants)
+        self.wins = [0] * len(entrants)
+        self.played = [0] * len(entrants)
+        self.turns = 0
+        self.opponents = [set() for _ in entrants]
+        self.byes = set()
+
+    # Play one round of (a, b) pairings in the pool and score it
+    def play_round(self, number, pairings, pool, max_pending):
+        pairing_wins = {pairing: 0 for pairing in pairings}
+        pairing_ids = {}
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                a, b = pending.pop(future)
+                for battle_id, a_won, turns, replay in future.result():
+                    winner, loser = (a, b) if a_won else (b, a)
+                    game = battle_id - pairing_ids[a, b]
+                    player, rival = (a, b) if game % 2 == 0 else (b, a)
+                    self.writer.write((battle_id, number, label(self.entrants[player]),
+                                       label(self.entrants[rival]), label(self.entrants[winner]), turns))
+                    if replay:
+                        self.replay_writer.write(replay)
+                    pairing_wins[a, b] += a_won
+                    self.wins[winner] += 1
+                    self.played[winner] += 1
+                    self.played[loser] += 1
+                    self.turns += turns
+
+        for a, b in pairings:
+            pairing_ids[a, b] = self.next_id
+            for first_game in range(0, self.games, chunk_size):
+                count = min(chunk_size, self.games - first_game)
+                while len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = pool.submit(play_chunk, self.entrants[a], self.entrants[b], first_game,
+                                     self.next_id + first_game, count, self.seed, bool(self.replay_writer))
+                pending[future] = (a, b)
+            self.next_id += self.games
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+        for (a, b), wins in pairing_wins.items():
+            self.opponents[a].add(b)
+            self.opponents[b].add(a)
+            share = (wins > self.games - wins) + (wins * 2 == self.games) * 0.5
+            self.points[a] += share
+            self.points[b] += 1 - share
+
+    def standings(self):
+        return sorted(range(len(self.entrants)), key=lambda i: (-self.points[i], -self.wins[i], i))
+
+    # Every pair of entrants, all in one round
+    def round_robin_pairings(self):
+        count = len(self.entrants)
+        return [(a, b) for a in range(count) for b in range(a + 1, count)]
+
+    # Pair entrants down the standings with the nearest one they have not met;
+    # with an odd count the lowest entrant without a bye sits out for a point
+    def swiss_pairings(self):
+        order = self.standings()
+        if len(order) % 2:
+            bye = next((i for i in reversed(order) if i not in self.byes), order[-1])
+            order.remove(bye)
+            self.byes.add(bye)
+            self.points[bye] += 1
+
+        pairings = []
+        while order:
+            a = order.pop(0)
+            b = next((i for i in order if i not in self.opponents[a]), order[0])
+            order.remove(b)
+            pairings.append((a, b))
+        return pairings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a tournament between species and AI policies.')
+    parser.add_argument('--format', choices=FORMATS, default='round-robin')
+    parser.add_argument('--games', type=int, default=100, help='games per pairing')
+    parser.add_argument('--rounds', type=int, help='Swiss rounds (default: log2 of the entrants)')
+    parser.add_argument('--species', nargs='+', help='species names (default: the whole roster)')
+    parser.add_argument('--difficulties', nargs='+', choices=list(DIFFICULTIES), default=['easy'])
+    parser.add_argument('--roster', help='JSON file of specs overriding the roster')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, help='tournament seed (default: random)')
+    parser.add_argument('--output', default='-', help='.csv or .jsonl file, or - for CSV on stdout')
+    parser.add_argument('--replays', help='replay log to append every battle to')
+    args = parser.parse_args()
+
+    roster = load_roster(args.roster)
+    if args.species:
+        by_name = {spec[0].lower(): spec for spec in roster}
+        missing = [name for name in args.species if name.lower() not in by_name]
+        if missing:
+            parser.error(f'unknown species: {", ".join(missing)}')
+        roster = [by_name[name.lower()] for name in args.species]
+    if any(DIFFICULTIES[difficulty] for difficulty in args.difficulties):
+        # the search difficulties value states with the exact solver, which caps HP
+        for spec in roster:
+            try:
+                check_spec(spec)
+            except ValueError as error:
+                parser.error(str(error))
+    entrants = [(spec, difficulty) for spec in roster for difficulty in args.difficulties]
+    if len(entrants) < 2:
+        parser.error('a tournament needs at least two entrants')
+
+    seed = args.seed if args.seed is not None else random.getrandbits(64)
+    writer = ResultWriter(args.output)
+    try:
+        replay_writer = ReplayWriter(args.replays) if args.replays else None
+    except (OSError, ValueError) as error:
+        parser.error(f'cannot append to the replay log: {error}')
+    tournament = Tournament(entrants, args.games, seed, writer, replay_writer)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as pool:
+        max_pending = args.workers * tasks_per_worker
+        if args.format == 'round-robin':
+            tournament.play_round(1, tournament.round_robin_pairings(), pool, max_pending)
+        else:
+            rounds = args.rounds or math.ceil(math.log2(len(entrants)))
+            for number in range(1, rounds + 1):
+                tournament.play_round(number, tournament.swiss_pairings(), pool, max_pending)
+    writer.close()
+    if replay_writer:
+        replay_writer.close()
+    elapsed = time.perf_counter() - start
+
+    # the summary goes to stderr so results can be piped from stdout
+    total = tournament.next_id
+    log = sys.stderr
+    print(f'{"Entrant":<24}{"Points":>8}{"Wins":>10}{"Played":>10}{"Win rate":>10}', file=log)
+    for i in tournament.standings():
+        played = tournament.played[i]
+        rate = tournament.wins[i] / played if played else 0
+        print(f'{label(entrants[i]):<24}{tournament.points[i]:>8.1f}{tournament.wins[i]:>10}'
+              f'{played:>10}{rate:>10.3f}', file=log)
+    print(f'{total} battles (seed {seed}, {tournament.turns / max(total, 1):.1f} turns on average) '
+          f'in {elapsed:.1f} s ({total / elapsed * 60:,.0f} battles per minute)', file=log)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# The full 18-type effectiveness chart as flat lookup tables
+#
+# A Pokemon attacks with its primary type and defends with one or two types.
+# Every defending combination gets a column index (first * 18 + second, with
+# second == first for a single type), so the multiplier of any attack is one
+# index into a precomputed table instead of a walk over type names. The
+# tables are array-backed; battle_sim views them as NumPy arrays to look up
+# whole batches of matchups at once.
+
+import math
+from array import array
+
+TYPES = (
+    'Normal', 'Fire', 'Water', 'Electric', 'Grass', 'Ice',
+    'Fighting', 'Poison', 'Ground', 'Flying', 'Psychic', 'Bug',
+    'Rock', 'Ghost', 'Dragon', 'Dark', 'Steel', 'Fairy',
+)
+TYPE_INDEX = {name: i for i, name in enumerate(TYPES)}
+
+# Number of defending type combinations (columns of the tables)
+DEFENSE_COMBOS = len(TYPES) * len(TYPES)
+
+# Attacking type -> defending types it is not neutral against
+CHART = {
+    'Normal': {'Rock': .5, 'Ghost': 0, 'Steel': .5},
+    'Fire': {'Fire': .5, 'Water': .5, 'Grass': 2, 'Ice': 2, 'Bug': 2, 'Rock': .5, 'Dragon': .5, 'Steel': 2},
+    'Water': {'Fire': 2, 'Water': .5, 'Grass': .5, 'Ground': 2, 'Rock': 2, 'Dragon': .5},
+    'Electric': {'Water': 2, 'Electric': .5, 'Grass': .5, 'Ground': 0, 'Flying': 2, 'Dragon': .5},
+    'Grass': {'Fire': .5, 'Water': 2, 'Grass': .5, 'Poison': .5, 'Ground': 2, 'Flying': .5, 'Bug': .5,
+              'Rock': 2, 'Dragon': .5, 'Steel': .5},
+    'Ice': {'Fire': .5, 'Water': .5, 'Grass': 2, 'Ice': .5, 'Ground': 2, 'Flying': 2, 'Dragon': 2, 'Steel': .5},
+    'Fighting': {'Normal': 2, 'Ice': 2, 'Poison': .5, 'Flying': .5, 'Psychic': .5, 'Bug': .5, 'Rock': 2,
+                 'Ghost': 0, 'Dark': 2, 'Steel': 2, 'Fairy': .5},
+    'Poison': {'Grass': 2, 'Poison': .5, 'Ground': .5, 'Rock': .5, 'Ghost': .5, 'Steel': 0, 'Fairy': 2},
+    'Ground': {'Fire': 2, 'Electric': 2, 'Grass': .5, 'Poison': 2, 'Flying': 0, 'Bug': .5, 'Rock': 2, 'Steel': 2},
+    'Flying': {'Electric': .5, 'Grass': 2, 'Fighting': 2, 'Bug': 2, 'Rock': .5, 'Steel': .5},
+    'Psychic': {'Fighting': 2, 'Poison': 2, 'Psychic': .5, 'Dark': 0, 'Steel': .5},
+    'Bug': {'Fire': .5, 'Grass': 2, 'Fighting': .5, 'Poison': .5, 'Flying': .5, 'Psychic': 2, 'Ghost': .5,
+            'Dark': 2, 'Steel': .5, 'Fairy': .5},
+    'Rock': {'Fire': 2, 'Ice': 2, 'Fighting': .5, 'Ground': .5, 'Flying': 2, 'Bug': 2, 'Steel': .5},
+    'Ghost': {'Normal': 0, 'Psychic': 2, 'Ghost': 2, 'Dark': .5},
+    'Dragon': {'Dragon': 2, 'Steel': .5, 'Fairy': 0},
+    'Dark': {'Fighting': .5, 'Psychic': 2, 'Ghost': 2, 'Dark': .5, 'Fairy': .5},
+    'Steel': {'Fire': .5, 'Water': .5, 'Electric': .5, 'Ice': 2, 'Rock': 2, 'Steel': .5, 'Fairy': 2},
+    'Fairy': {'Fire': .5, 'Fighting': 2, 'Poison': .5, 'Dragon': 2, 'Dark': 2, 'Steel': .5},
+}
+
+# TCG-style damage: +10 per doubling and -10 per halving of the multiplier.
+# An immunity counts as three halvings; every hit still deals MIN_DAMAGE so
+# that two Pokemon immune to each other can still finish a battle.
+IMMUNE_BONUS = -30
+MIN_DAMAGE = 10
+
+
+# (attacking type index, defending combination index) for a type string such
+# as 'Fire' or 'Grass/Poison'
+def parse_types(type):
+    indexes = [TYPE_INDEX[name] for name in type.split('/')]
+    first = indexes[0]
+    second = indexes[1] if len(indexes) > 1 else first
+    return first, first * len(TYPES) + second
+
+
+def _multiplier(attacking, defending):
+    first, second = divmod(defending, len(TYPES))
+    row = CHART[TYPES[attacking]]
+    multiplier = row.get(TYPES[first], 1)
+    if second != first:
+        multiplier *= row.get(TYPES[second], 1)
+    return multiplier
+
+
+def _bonus(multiplier):
+    if multiplier == 0:
+        return IMMUNE_BONUS
+    return round(10 * math.log2(multiplier))
+
+
+# MULTIPLIER and BONUS hold one row of DEFENSE_COMBOS entries per attacking type
+MULTIPLIER = array('d', (
+    _multiplier(attacking, defending)
+    for attacking in range(len(TYPES)) for defending in range(DEFENSE_COMBOS)
+))
+BONUS = array('b', (_bonus(multiplier) for multiplier in MULTIPLIER))
+
+
+# Multiplier of an attack, from parsed type indexes
+def effectiveness(attacking, defending):
+    return MULTIPLIER[attacking * DEFENSE_COMBOS + defending]
+
+
+# Damage dealt by a hit of the given base attack, from parsed type indexes
+def type_damage(attack, attacking, defending):
+    return max(attack + BONUS[attacking * DEFENSE_COMBOS + defending], MIN_DAMAGE)
+
+
+# Damage and multiplier of a hit between two type strings
+def hit_damage(attack, attacker_type, defender_type):
+    attacking = parse_types(attacker_type)[0]
+    defending = parse_types(defender_type)[1]
+    return type_damage(attack, attacking, defending), effectiveness(attacking, defending)
+
+
+# The types a defender takes super effective damage from
+def weaknesses(type):
+    defending = parse_types(type)[1]
+    return [name for i, name in enumerate(TYPES) if effectiveness(i, defending) > 1]